@@ -0,0 +1,683 @@
+"""
+Load generator for the socket.io server.
+Simulates games played by headless clients and reports event latency percentiles,
+emits per second and server CPU/memory usage.
+
+Usage (from the api directory):
+    python -m benchmark.loadtest --spawn --games 50 --duration 60 --json results.json
+    python -m benchmark.loadtest --url http://127.0.0.1:4433 --server-pid 1234 --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse
+
+import socketio
+
+WARMUP_TEXT = "Prepare to receive instructions"
+ASTEROID_TEXT = "Asteroid!"
+BLACK_HOLE_TEXT = "Black hole!"
+SLIDER_TYPES = ("slider", "circular_slider", "buttons_slider")
+SWITCH_ON_WORDS = ("Activate", "Engage", "Switch on")
+NUMBER_RE = re.compile(r"\d+")
+
+# Events sent by the harness and the event that answers them
+REQUESTS = {
+    "create_game": "game_join_success",
+    "join_game": "game_join_success",
+    "ready": "game_info",
+    "start_game": "game_started",
+}
+
+
+def percentile(values, p):
+    """
+    Returns the `p`-th percentile of `values` (nearest rank)
+    :param values: sorted list of numbers
+    :param p: percentile, between 0 and 100
+    :return:
+    """
+    if not values:
+        return None
+    k = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+def random_value(command):
+    """
+    Returns a random valid value for a grid command
+    :param command: grid command dict, as sent in `grid` events
+    :return:
+    """
+    if command["type"] in SLIDER_TYPES:
+        return random.randint(command["min"], command["max"])
+    elif command["type"] == "switch":
+        return random.choice([True, False])
+    elif command["type"] == "actions":
+        return random.choice(command["actions"])
+    return None
+
+
+def parse_instruction(text, commands):
+    """
+    Finds the command and the value an instruction text refers to
+    :param text: instruction text
+    :param commands: `{name: grid command dict}` of all the commands in the game
+    :return: `(command, value)` tuple, or `None` if no command matches
+    """
+    command = None
+    for name in sorted(commands, key=len, reverse=True):
+        if name in text:
+            command = commands[name]
+            break
+    if command is None:
+        return None
+
+    rest = text.replace("$" + command["name"], "").replace(command["name"], "")
+    if command["type"] in SLIDER_TYPES:
+        match = NUMBER_RE.search(rest)
+        if match is not None:
+            value = int(match.group())
+        elif "maximum" in rest:
+            value = command["max"]
+        else:
+            value = command["min"]
+    elif command["type"] == "switch":
+        value = rest.startswith(SWITCH_ON_WORDS)
+    elif command["type"] == "actions":
+        value = next((x for x in command["actions"] if rest.lower().startswith(x.lower())), None)
+    else:
+        value = None
+    return command, value
+
+
+class Stats:
+    """
+    Latencies and event counters shared by all simulated clients
+    """
+    def __init__(self):
+        self.latencies = {}
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self.server_errors = {}
+        self.games_started = 0
+        self.games_over = 0
+        self.levels = 0
+        self.instructions_completed = 0
+        self.started_at = time.monotonic()
+
+    def record(self, kind, seconds):
+        self.latencies.setdefault(kind, []).append(seconds)
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started_at
+        latencies = {}
+        for kind, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            latencies[kind] = {
+                "count": len(values),
+                "p50": percentile(values, 50) * 1000,
+                "p90": percentile(values, 90) * 1000,
+                "p99": percentile(values, 99) * 1000,
+                "max": values[-1] * 1000,
+            }
+        return {
+            "elapsed": elapsed,
+            "sent": self.sent,
+            "received": self.received,
+            "sent_per_second": self.sent / elapsed,
+            "received_per_second": self.received / elapsed,
+            "errors": self.errors,
+            "server_errors": self.server_errors,
+            "games_started": self.games_started,
+            "games_over": self.games_over,
+            "levels": self.levels,
+            "instructions_completed": self.instructions_completed,
+            "latencies_ms": latencies,
+        }
+
+
+class ProcessMonitor:
+    """
+    Samples CPU and memory usage of a process and its children from /proc
+    """
+    def __init__(self, pid, interval=1):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._ticks = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self._task = None
+
+    @property
+    def available(self):
+        return os.path.isdir("/proc/{}".format(self.pid))
+
+    def _pids(self, pid):
+        pids = [pid]
+        try:
+            for tid in os.listdir("/proc/{}/task".format(pid)):
+                with open("/proc/{}/task/{}/children".format(pid, tid)) as f:
+                    for child in f.read().split():
+                        pids += self._pids(int(child))
+        except (FileNotFoundError, ProcessLookupError):
+            pass
+        return pids
+
+    def read(self):
+        """
+        :return: `(cpu seconds, rss bytes)` of the process tree
+        """
+        cpu, rss = 0, 0
+        for pid in self._pids(self.pid):
+            try:
+                with open("/proc/{}/stat".format(pid)) as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                cpu += (int(fields[11]) + int(fields[12])) / self._ticks
+                rss += int(fields[21]) * self._page_size
+            except (FileNotFoundError, ProcessLookupError, IndexError):
+                continue
+        return cpu, rss
+
+    def start(self):
+        if not self.available:
+            logging.warning("Cannot monitor server process {}".format(self.pid))
+            return
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        last_cpu, _ = self.read()
+        last_time = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            cpu, rss = self.read()
+            now = time.monotonic()
+            self.samples.append(((cpu - last_cpu) / (now - last_time) * 100, rss))
+            last_cpu, last_time = cpu, now
+
+    def summary(self):
+        if not self.samples:
+            return None
+        cpu = sorted(x[0] for x in self.samples)
+        rss = [x[1] for x in self.samples]
+        return {
+            "cpu_percent_mean": sum(cpu) / len(cpu),
+            "cpu_percent_p90": percentile(cpu, 90),
+            "cpu_percent_max": cpu[-1],
+            "rss_mb_start": rss[0] / 2 ** 20,
+            "rss_mb_max": max(rss) / 2 ** 20,
+            "rss_mb_end": rss[-1] / 2 ** 20,
+        }
+
+
+class SimulatedPlayer:
+    """
+    A headless socket.io client
+    """
+    def __init__(self, game, index):
+        self.game = game
+        self.index = index
+        self.stats = game.stats
+        self.uid = None
+        self.grid = []
+        self.latest = {}
+        self.instruction = None
+        self.instruction_sent_at = None
+        self.waiters = {}
+        self.sio = socketio.AsyncClient(reconnection=False)
+        for event in (
+            "welcome", "game_join_success", "game_join_fail", "game_info", "game_started", "grid",
+            "command", "next_level", "game_over", "player_disconnected", "safe", "health_info",
+            "lobby_snapshot", "lobby_delta", "flip_grid",
+        ):
+            self.sio.on(event, self._handler(event))
+        for event in (
+            "error_missing_arguments", "error_invalid_arguments", "error_unlinkable_client",
+            "error_not_in_game", "error_in_game", "error_is_not_host",
+        ):
+            self.sio.on(event, self._handler(event))
+
+    def _handler(self, event):
+        async def handler(data=None):
+            self.stats.received += 1
+            self.latest[event] = data
+            if event.startswith("error_"):
+                self.stats.server_errors[event] = self.stats.server_errors.get(event, 0) + 1
+            future = self.waiters.pop(event, None)
+            if future is not None and not future.done():
+                future.set_result(data)
+            callback = getattr(self, "on_" + event, None)
+            if callback is not None:
+                await callback(data)
+        return handler
+
+    def expect(self, event):
+        """
+        Returns a future resolved by the next `event`
+        :param event: event name
+        :return:
+        """
+        future = asyncio.get_event_loop().create_future()
+        self.waiters[event] = future
+        return future
+
+    async def wait_for(self, event, predicate, timeout=10):
+        """
+        Waits for an `event` whose payload satisfies `predicate`, checking the last one received first
+        :param event: event name
+        :param predicate: function that takes the event payload
+        :param timeout: seconds to wait
+        :return: event payload
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            future = self.expect(event)
+            if event in self.latest and predicate(self.latest[event]):
+                return self.latest[event]
+            try:
+                data = await asyncio.wait_for(future, max(0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise RuntimeError("No matching {}".format(event))
+            if predicate(data):
+                return data
+
+    async def emit(self, event, data=None):
+        self.stats.sent += 1
+        await self.sio.emit(event, data if data is not None else {})
+
+    async def request(self, event, data=None, timeout=10):
+        """
+        Sends `event` and waits for its response event, recording the latency
+        :param event: event name, one of `REQUESTS`
+        :param data: event payload
+        :param timeout: seconds to wait for the response
+        :return: response payload
+        """
+        response = self.expect(REQUESTS[event])
+        start = time.monotonic()
+        await self.emit(event, data)
+        try:
+            result = await asyncio.wait_for(response, timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError("No {} after {}".format(REQUESTS[event], event))
+        self.stats.record(event, time.monotonic() - start)
+        return result
+
+    async def connect(self, url, transports):
+        welcome = self.expect("welcome")
+        start = time.monotonic()
+        await self.sio.connect(url, transports=transports)
+        self.uid = (await asyncio.wait_for(welcome, 10))["uid"]
+        self.stats.record("connect", time.monotonic() - start)
+
+    async def on_game_started(self, data):
+        await self.emit("intro_done")
+
+    async def on_next_level(self, data):
+        self.complete_instruction()
+        self.instruction = None
+        if self.index == 0:
+            self.stats.levels += 1
+        await self.emit("intro_done")
+
+    async def on_grid(self, data):
+        self.grid = data
+        self.game.update_commands()
+
+    async def on_command(self, data):
+        if data["text"] == WARMUP_TEXT:
+            return
+        if data.get("expired") is False:
+            self.complete_instruction()
+        self.instruction = data["text"]
+        self.game.schedule_answer(self, data["text"])
+
+    async def on_safe(self, data):
+        self.game.special_defeated()
+
+    async def on_game_over(self, data):
+        self.game.finish()
+
+    async def on_player_disconnected(self, data):
+        self.game.finish()
+
+    def complete_instruction(self):
+        if self.instruction_sent_at is not None:
+            self.stats.record("instruction", time.monotonic() - self.instruction_sent_at)
+            self.stats.instructions_completed += 1
+            self.instruction_sent_at = None
+
+
+class SimulatedGame:
+    """
+    A group of simulated players that plays games one after the other
+    """
+    def __init__(self, options, stats):
+        self.options = options
+        self.stats = stats
+        self.players = [SimulatedPlayer(self, i) for i in range(options.players)]
+        self.commands = {}
+        self.owners = {}
+        self.special_sent_at = None
+        self.finished = None
+        self.tasks = set()
+
+    @property
+    def host(self):
+        return self.players[0]
+
+    def update_commands(self):
+        self.commands = {}
+        self.owners = {}
+        for player in self.players:
+            for command in player.grid:
+                self.commands[command["name"]] = command
+                self.owners[command["name"]] = player
+
+    def finish(self):
+        if self.finished is not None and not self.finished.done():
+            self.finished.set_result(None)
+
+    def special_defeated(self):
+        if self.special_sent_at is not None:
+            self.stats.record("special", time.monotonic() - self.special_sent_at)
+            self.special_sent_at = None
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def schedule_answer(self, player, text):
+        self.spawn(self.answer(player, text))
+
+    async def answer(self, player, text):
+        await asyncio.sleep(random.expovariate(1 / self.options.think_time))
+        if player.instruction != text or self.finished.done():
+            # A new instruction arrived in the meantime
+            return
+
+        if text.startswith(ASTEROID_TEXT) or text.startswith(BLACK_HOLE_TEXT):
+            event = "defeat_asteroid" if text.startswith(ASTEROID_TEXT) else "defeat_black_hole"
+            self.special_sent_at = time.monotonic()
+            for p in self.players:
+                await p.emit(event)
+            return
+
+        parsed = parse_instruction(text, self.commands)
+        if parsed is None:
+            logging.warning("Cannot parse instruction {}".format(text))
+            return
+        command, value = parsed
+        owner = self.owners[command["name"]]
+        if random.random() < self.options.accuracy:
+            player.instruction_sent_at = time.monotonic()
+            await owner.emit("command", {"name": command["name"], "value": value})
+        else:
+            await self.wrong_command(owner, command, value)
+
+    async def wrong_command(self, player, command=None, value=None):
+        """
+        Sends a command that doesn't complete any instruction (most of the times)
+        :param player: `SimulatedPlayer` that sends the command
+        :param command: command to get wrong. If `None` or it can't have a wrong value, a random one is used.
+        :param value: right value for `command`
+        :return:
+        """
+        wrong_values = []
+        if command is not None and command["type"] in SLIDER_TYPES:
+            wrong_values = [x for x in range(command["min"], command["max"] + 1) if x != value]
+        elif command is not None and command["type"] == "switch":
+            wrong_values = [not value]
+        elif command is not None and command["type"] == "actions":
+            wrong_values = [x for x in command["actions"] if x != value]
+        if wrong_values:
+            await player.emit("command", {"name": command["name"], "value": random.choice(wrong_values)})
+        elif player.grid:
+            command = random.choice(player.grid)
+            await player.emit("command", {"name": command["name"], "value": random_value(command)})
+
+    async def noise(self, player):
+        while not self.finished.done():
+            await asyncio.sleep(random.expovariate(self.options.noise_rate))
+            if player.grid and not self.finished.done():
+                await self.wrong_command(player)
+
+    async def special_noise(self, player):
+        while not self.finished.done():
+            await asyncio.sleep(random.expovariate(self.options.special_rate))
+            if not self.finished.done():
+                await player.emit(random.choice(["defeat_asteroid", "defeat_black_hole"]))
+
+    async def play(self):
+        """
+        Creates a game, fills it and plays it until it's over
+        :return:
+        """
+        self.finished = asyncio.get_event_loop().create_future()
+        self.commands, self.owners = {}, {}
+        for player in self.players:
+            player.grid, player.latest, player.instruction, player.instruction_sent_at = [], {}, None, None
+
+        game_id = (await self.host.request("create_game", {"name": "loadtest", "public": False}))["game_id"]
+        await self.host.emit("change_game_settings", {"size": len(self.players)})
+        for player in self.players[1:]:
+            await player.request("join_game", {"game_id": game_id})
+        for player in self.players:
+            await player.request("ready")
+        await self.host.wait_for("game_info", lambda x: all(slot is not None and slot["ready"] for slot in x["slots"]))
+        await self.host.request("start_game")
+        self.stats.games_started += 1
+
+        if self.options.noise_rate > 0:
+            for player in self.players:
+                self.spawn(self.noise(player))
+        if self.options.special_rate > 0:
+            for player in self.players:
+                self.spawn(self.special_noise(player))
+
+        await self.finished
+        self.stats.games_over += 1
+
+    async def run(self, deadline):
+        for player in self.players:
+            await player.connect(self.options.url, self.options.transports)
+        try:
+            while time.monotonic() < deadline:
+                disposed = False
+                try:
+                    await asyncio.wait_for(self.play(), max(0, deadline - time.monotonic()))
+                    # Game over, the server has already disposed the game
+                    disposed = True
+                except asyncio.TimeoutError:
+                    pass
+                except Exception as e:
+                    self.stats.errors += 1
+                    logging.warning("Simulated game failed: {}".format(repr(e)))
+                finally:
+                    self.finish()
+                    for task in list(self.tasks):
+                        task.cancel()
+                if not disposed:
+                    for player in self.players:
+                        await player.emit("leave_game")
+                await asyncio.sleep(0.1)
+        finally:
+            for player in self.players:
+                await player.sio.disconnect()
+
+
+def spawn_server(url, workers, seed=None):
+    """
+    Starts a server in a new process group and waits until it accepts connections
+    :param url: server url
+    :param workers: number of workers
+    :param seed: `GAME_SEED` of the server, or `None` for random games
+    :return: `subprocess.Popen` object
+    """
+    parsed = urlparse(url)
+    api_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [sys.executable, "happycity.py"],
+        cwd=api_dir,
+        env={
+            **os.environ, "SIO_PORT": str(parsed.port), "SSL_CERT": "", "WORKERS": str(workers),
+            **({"GAME_SEED": str(seed)} if seed is not None else {})
+        },
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    for _ in range(300):
+        try:
+            socket.create_connection((parsed.hostname, parsed.port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("The server exited with code {}".format(process.returncode))
+            time.sleep(0.1)
+    stop_server(process)
+    raise RuntimeError("The server did not start")
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    process.wait()
+
+
+def print_report(results, baseline=None):
+    def delta(path, fmt="{:.2f}"):
+        if baseline is None:
+            return ""
+        old = baseline
+        for key in path:
+            old = old.get(key) if old is not None else None
+        new = results
+        for key in path:
+            new = new.get(key) if new is not None else None
+        if old in (None, 0) or new is None:
+            return ""
+        return " (baseline " + fmt.format(old) + ", {:+.1f}%)".format((new - old) / old * 100)
+
+    s = results["stats"]
+    print("Duration: {:.1f}s, {} clients, {} games started, {} over, {} levels, {} instructions completed, {} errors".format(
+        s["elapsed"], results["clients"], s["games_started"], s["games_over"], s["levels"],
+        s["instructions_completed"], s["errors"]
+    ))
+    if s["server_errors"]:
+        print("Server errors: {}".format(", ".join("{} {}".format(k, v) for k, v in sorted(s["server_errors"].items()))))
+    print("Client emits: {} ({:.1f}/s){}".format(s["sent"], s["sent_per_second"], delta(("stats", "sent_per_second"))))
+    print("Server emits: {} ({:.1f}/s){}".format(
+        s["received"], s["received_per_second"], delta(("stats", "received_per_second"))
+    ))
+    print("Latency (ms)         count      p50      p90      p99      max")
+    for kind, l in s["latencies_ms"].items():
+        print("  {:<16} {:>9} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f}{}".format(
+            kind, l["count"], l["p50"], l["p90"], l["p99"], l["max"], delta(("stats", "latencies_ms", kind, "p99"))
+        ))
+    server = results["server"]
+    if server is not None:
+        print("Server CPU: mean {:.1f}%, p90 {:.1f}%, max {:.1f}%{}".format(
+            server["cpu_percent_mean"], server["cpu_percent_p90"], server["cpu_percent_max"],
+            delta(("server", "cpu_percent_mean"))
+        ))
+        print("Server RSS: start {:.1f} MB, max {:.1f} MB, end {:.1f} MB{}".format(
+            server["rss_mb_start"], server["rss_mb_max"], server["rss_mb_end"], delta(("server", "rss_mb_max"))
+        ))
+
+
+async def run(options):
+    stats = Stats()
+    games = [SimulatedGame(options, stats) for _ in range(options.games)]
+    monitor = ProcessMonitor(options.server_pid) if options.server_pid is not None else None
+    if monitor is not None:
+        monitor.start()
+
+    stats.started_at = time.monotonic()
+    deadline = stats.started_at + options.duration
+
+    async def start_game(i, game):
+        # Spread connections over the ramp up time
+        await asyncio.sleep(options.ramp * i / len(games))
+        await game.run(deadline)
+
+    results = await asyncio.gather(*[start_game(i, g) for i, g in enumerate(games)], return_exceptions=True)
+    for r in results:
+        if isinstance(r, Exception):
+            stats.errors += 1
+            logging.warning("Simulated game crashed: {}".format(repr(r)))
+
+    if monitor is not None:
+        monitor.stop()
+    return {
+        "options": {k: v for k, v in vars(options).items() if k not in ("baseline", "json")},
+        "clients": options.games * options.players,
+        "stats": stats.summary(),
+        "server": monitor.summary() if monitor is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates headless players and measures server performance")
+    parser.add_argument("--url", default="http://127.0.0.1:4433", help="server url")
+    parser.add_argument("--spawn", action="store_true", help="start a server on --url and monitor it")
+    parser.add_argument("--workers", type=int, default=1, help="workers of the spawned server")
+    parser.add_argument("--server-pid", type=int, default=None, help="pid of the server to monitor")
+    parser.add_argument("--games", type=int, default=10, help="concurrent games")
+    parser.add_argument("--players", type=int, default=2, help="players per game")
+    parser.add_argument("--duration", type=float, default=30, help="test duration in seconds")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which clients connect")
+    parser.add_argument("--think-time", type=float, default=1.5, help="mean seconds before answering an instruction")
+    parser.add_argument("--accuracy", type=float, default=0.9, help="probability of answering correctly")
+    parser.add_argument("--noise-rate", type=float, default=0.5, help="random commands per second per player")
+    parser.add_argument("--special-rate", type=float, default=0, help="random defeat events per second per player")
+    parser.add_argument("--transport", action="append", dest="transports", help="socket.io transports")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the simulated players and `GAME_SEED` of the spawned server")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    parser.add_argument("--baseline", default=None, help="results file to compare with")
+    options = parser.parse_args()
+    options.transports = options.transports or ["websocket"]
+
+    logging.basicConfig(level=logging.INFO)
+    if options.seed is not None:
+        random.seed(options.seed)
+    server = None
+    if options.spawn:
+        server = spawn_server(options.url, options.workers, options.seed)
+        options.server_pid = server.pid
+    try:
+        results = asyncio.get_event_loop().run_until_complete(run(options))
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    baseline = None
+    if options.baseline is not None:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if options.json is not None:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Memory footprint of the server state, measured in-process with tracemalloc. No sockets are involved, emits are discarded.
+Reports the bytes allocated per idle client, per lobby game (with its host) and per in-progress 4-player game
+(with its clients, grids and pending instructions).
+
+Usage (from the api directory):
+    python -m benchmark.memory --json before.json
+    python -m benchmark.memory --compare before.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import time
+import tracemalloc
+
+from benchmark.micro import API_DIR, SIDS, git_revision, setup_environment
+
+
+def measure(loop, make, count):
+    """
+    Creates `count` objects with `make` and measures the memory they retain
+    :param loop: event loop
+    :param make: coroutine function creating one object
+    :param count: number of objects to create
+    :return: bytes per object
+    """
+    async def make_all():
+        return [await make() for _ in range(count)]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = loop.run_until_complete(make_all())
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (after - before) / count
+
+
+def register(loop):
+    from server.client import Client
+    from server.game import Game
+    from singletons.client_manager import ClientManager
+    from singletons.lobby_manager import LobbyManager
+
+    async def make_client():
+        client = Client(next(SIDS))
+        ClientManager().add_client(client)
+        return client
+
+    async def make_lobby_game():
+        game = Game(name="benchmark", public=True)
+        await LobbyManager().add_game(game)
+        await game.join_client(await make_client())
+        return game
+
+    async def make_playing_game():
+        game = Game(name="benchmark", public=False)
+        game.max_players = 4
+        await LobbyManager().add_game(game)
+        for _ in range(4):
+            client = await make_client()
+            await game.join_client(client)
+            await game.ready(client)
+        await game.start()
+        for slot in game.slots:
+            await game.generate_instruction(slot)
+        return game
+
+    return {
+        "idle_client": (make_client, 2000),
+        "lobby_game": (make_lobby_game, 500),
+        "playing_game[4]": (make_playing_game, 100),
+    }
+
+
+def print_results(results, baseline=None):
+    print("{:<24} {:>12}".format("object", "bytes"))
+    for name, size in results["objects"].items():
+        line = "{:<24} {:>12.0f}".format(name, size)
+        old = baseline["objects"].get(name) if baseline is not None else None
+        if old is not None:
+            line += "  {:+7.1f}% vs {}".format((size - old) / old * 100, baseline["meta"].get("revision"))
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server state memory footprint")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    parser.add_argument("--compare", default=None, help="results file to compare with")
+    options = parser.parse_args()
+
+    os.chdir(API_DIR)
+    loop = asyncio.get_event_loop()
+    setup_environment()
+    random.seed(options.seed)
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "seed": options.seed,
+        },
+        "objects": {},
+    }
+    for name, (make, count) in register(loop).items():
+        # Warm up caches and interned strings before measuring
+        measure(loop, make, 10)
+        results["objects"][name] = measure(loop, make, count)
+
+    baseline = None
+    if options.compare is not None:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if options.json is not None:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""
+In-process micro-benchmarks of the game logic hot paths. No sockets are involved, emits are discarded.
+
+Usage (from the api directory):
+    python -m benchmark.micro --json before.json
+    python -m benchmark.micro --compare before.json --max-regression 0.15
+    python -m benchmark.micro --filter grid
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARKS = []
+SIDS = ("benchmark{}".format(i) for i in itertools.count())
+
+
+def benchmark(name, setup=None):
+    """
+    Decorator that registers a benchmark.
+    The decorated function (regular or coroutine) runs one operation and takes the value returned by `setup`.
+    :param name: benchmark name
+    :param setup: function called once before measuring, its return value is passed to the benchmark
+    :return:
+    """
+    def decorator(f):
+        BENCHMARKS.append((name, setup, f))
+        return f
+    return decorator
+
+
+def measure(f, context, loop, rounds, round_time):
+    """
+    Runs `f` in `rounds` rounds of at least `round_time` seconds each
+    :return: list of seconds per operation, one per round
+    """
+    if asyncio.iscoroutinefunction(f):
+        async def run(n):
+            start = time.perf_counter()
+            for _ in range(n):
+                await f(context)
+            return time.perf_counter() - start
+
+        def timed(n):
+            return loop.run_until_complete(run(n))
+    else:
+        def timed(n):
+            start = time.perf_counter()
+            for _ in range(n):
+                f(context)
+            return time.perf_counter() - start
+
+    # Calibrate the number of operations per round
+    n = 1
+    while True:
+        elapsed = timed(n)
+        if elapsed >= round_time:
+            break
+        n = n * 10 if elapsed < round_time / 10 else max(n + 1, int(n * round_time / elapsed * 1.2))
+    return [timed(n) / n for _ in range(rounds)]
+
+
+def summarize(times):
+    return {
+        "rounds": len(times),
+        "min": min(times),
+        "max": max(times),
+        "mean": statistics.mean(times),
+        "median": statistics.median(times),
+        "stddev": statistics.stdev(times) if len(times) > 1 else 0,
+        "ops": 1 / statistics.median(times),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def setup_environment():
+    """
+    Loads words and layouts and replaces sio emits and rooms with no-ops
+    :return:
+    """
+    from singletons.layout_catalogue import LayoutCatalogue
+    from singletons.sio import Sio
+    from singletons.words_storage import WordsStorage
+
+    async def emit(*args, **kwargs):
+        return
+
+    sio = Sio()
+    sio.emit = emit
+    sio.enter_room = lambda *args, **kwargs: None
+    sio.leave_room = lambda *args, **kwargs: None
+    WordsStorage().load()
+    LayoutCatalogue().load()
+
+
+def make_game(loop, modifier=None):
+    """
+    Creates a game with two players in progress, with grids generated
+    :param loop: event loop
+    :param modifier: `GameModifier` class to force, or `None`
+    :return: `Game` object
+    """
+    from server.client import Client
+    from server.game import Game
+    from singletons.client_manager import ClientManager
+
+    async def make():
+        # Seeded from `random`, so runs with the same --seed build the same games
+        game = Game(name="benchmark", public=False, seed=random.getrandbits(32))
+        for _ in range(2):
+            client = Client(next(SIDS))
+            ClientManager().add_client(client)
+            await game.join_client(client)
+            await game.ready(client)
+        game.playing = True
+        game.level = 1
+        game.game_modifier = modifier(game) if modifier is not None else None
+        await game.generate_grids()
+        # Stay in the same level while completing instructions
+        game.difficulty["completed_instruction_health_increase"] = 0
+        return game
+    return loop.run_until_complete(make())
+
+
+def register(loop):
+    from server.game_modifiers import Alien, AsteroidsField, BlackHolesField, FlipGrid, Symbols
+    from server.instruction import Instruction
+    from singletons.event_log import EventLog
+    from singletons.sio import Sio
+    from utils.command_name_generator import CommandNameGenerator
+    from utils import event_log, server
+    from utils.grid import Grid
+    from utils.special_commands import DummyAsteroidCommand
+
+    @benchmark("grid_construction")
+    def grid_construction(_):
+        Grid(CommandNameGenerator(), random.randint(0, 1))
+
+    class NameGeneratorContext:
+        def __init__(self):
+            self.generator = CommandNameGenerator()
+            self.generated = 0
+
+    @benchmark("command_name_generation", setup=NameGeneratorContext)
+    def command_name_generation(context):
+        # A new generator every game, the names of two grids
+        if context.generated == 32:
+            context.generator = CommandNameGenerator()
+            context.generated = 0
+        context.generator.generate_command_name(context.generated % 2)
+        context.generated += 1
+
+    @benchmark("instruction_init", setup=lambda: make_game(loop))
+    def instruction_init(game):
+        source, target = game.slots
+        Instruction(source, target, random.choice(target.grid.objects))
+
+    @benchmark("instruction_init_special", setup=lambda: make_game(loop))
+    def instruction_init_special(game):
+        Instruction(game.slots[0], None, DummyAsteroidCommand())
+
+    @benchmark("generate_instruction", setup=lambda: make_game(loop))
+    async def generate_instruction(game):
+        await game.generate_instruction(random.choice(game.slots))
+
+    def do_command_setup():
+        game = make_game(loop)
+        for slot in game.slots:
+            loop.run_until_complete(game.generate_instruction(slot))
+        return game
+
+    @benchmark("do_command", setup=do_command_setup)
+    async def do_command(game):
+        # Complete a random pending instruction (generating a new one)
+        instruction = random.choice([x.instruction for x in game.slots])
+        if instruction.target is None:
+            await game.generate_instruction(instruction.source)
+            return
+        await game.do_command(instruction.target.client, instruction.target_command.name, instruction.value)
+
+    @benchmark("do_command_useless", setup=do_command_setup)
+    async def do_command_useless(game):
+        slot = random.choice(game.slots)
+        command = random.choice(slot.grid.objects)
+        value = Instruction(slot, slot, command).value
+        if command in game.instructed_commands:
+            return
+        await game.do_command(slot.client, command.name, value)
+
+    validate_command = server.compile_args((("name", str),))
+    validate_create_game = server.compile_args((("name", str), ("public", bool)))
+
+    @benchmark("args_validation[command]")
+    def args_validation_command(_):
+        validate_command({"name": "Calibrate the pipe", "value": 3})
+
+    @benchmark("args_validation[create_game]")
+    def args_validation_create_game(_):
+        validate_create_game({"name": "benchmark", "public": True})
+
+    def pipeline_setup():
+        # A no-op handler behind the `command` requirements and rate limit (never reached),
+        # called by a player of a game in progress
+        @server.handler(
+            "benchmark_pipeline", requires=(server.IN_PROGRESS,), args=(("name", str),), rate_limit=(1e9, 1e9)
+        )
+        async def benchmark_pipeline(sid, data, client):
+            return
+        return Sio().handlers["/"]["benchmark_pipeline"], make_game(loop).slots[0].client.sid
+
+    @benchmark("handler_pipeline[command]", setup=pipeline_setup)
+    async def handler_pipeline(context):
+        pipeline, sid = context
+        await pipeline(sid, {"name": "Calibrate the pipe", "value": 3})
+
+    for modifier in (None, Symbols, Alien, FlipGrid, AsteroidsField, BlackHolesField):
+        modifier_name = modifier.__name__ if modifier is not None else "none"
+
+        @benchmark("generate_grids[{}]".format(modifier_name), setup=lambda m=modifier: make_game(loop, m))
+        async def generate_grids(game):
+            await game.generate_grids()
+
+        @benchmark("grid_serialization[{}]".format(modifier_name), setup=lambda m=modifier: make_game(loop, m))
+        def grid_serialization(game):
+            for slot in game.slots:
+                json.dumps(slot.grid.to_payload())
+
+        @benchmark("grid_payload[{}]".format(modifier_name), setup=lambda m=modifier: make_game(loop, m))
+        def grid_payload(game):
+            for slot in game.slots:
+                slot.grid.invalidate_payload()
+                slot.grid.payload()
+
+    @benchmark("event_log_encode")
+    def event_log_encode(_):
+        # Done by the writer thread, per event
+        event_log.encode(bytearray(), event_log.COMMAND, 1234, "BENCH", (1, "Calibrate the pipe", 3))
+
+    def event_log_setup():
+        # Registered last, the other benchmarks run with the event log disabled.
+        # Events are encoded by the writer thread meanwhile, so this is the whole cost of logging.
+        game = make_game(loop)
+        game.uuid = "BENCH"
+        EventLog().path = os.devnull
+        EventLog().start()
+        return game
+
+    @benchmark("event_log_record", setup=event_log_setup)
+    def event_log_record(game):
+        EventLog().record(game, event_log.COMMAND, 1, "Calibrate the pipe", 3)
+
+
+def print_results(results, baseline=None, max_regression=None):
+    """
+    Prints a results table, comparing medians with `baseline` if provided
+    :return: names of the benchmarks slower than `baseline` by more than `max_regression`
+    """
+    regressions = []
+    print("{:<36} {:>12} {:>12} {:>12} {:>8}".format("benchmark", "median (us)", "min (us)", "stddev (us)", "rounds"))
+    for name, r in results["benchmarks"].items():
+        line = "{:<36} {:>12.2f} {:>12.2f} {:>12.2f} {:>8}".format(
+            name, r["median"] * 1e6, r["min"] * 1e6, r["stddev"] * 1e6, r["rounds"]
+        )
+        old = baseline["benchmarks"].get(name) if baseline is not None else None
+        if old is not None:
+            change = (r["median"] - old["median"]) / old["median"]
+            line += "  {:+7.1f}% vs {}".format(change * 100, baseline["meta"].get("revision"))
+            if max_regression is not None and change > max_regression:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Game logic micro-benchmarks")
+    parser.add_argument("--filter", default=None, help="run only benchmarks whose name contains this string")
+    parser.add_argument("--rounds", type=int, default=10, help="measured rounds per benchmark")
+    parser.add_argument("--round-time", type=float, default=0.05, help="minimum seconds per round")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    parser.add_argument("--compare", default=None, help="results file to compare with")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="exit with an error if a median is slower than --compare by more than this ratio")
+    options = parser.parse_args()
+
+    os.chdir(API_DIR)
+    loop = asyncio.get_event_loop()
+    setup_environment()
+    register(loop)
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "seed": options.seed,
+        },
+        "benchmarks": {},
+    }
+    for name, setup, f in BENCHMARKS:
+        if options.filter is not None and options.filter not in name:
+            continue
+        random.seed(options.seed)
+        # Keep leftover debug prints out of the report
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            context = setup() if setup is not None else None
+            times = measure(f, context, loop, options.rounds, options.round_time)
+        results["benchmarks"][name] = summarize(times)
+
+    baseline = None
+    if options.compare is not None:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+    regressions = print_results(results, baseline, options.max_regression)
+    if options.json is not None:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        print("{} benchmark(s) regressed: {}".format(len(regressions), ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
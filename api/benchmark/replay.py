@@ -0,0 +1,293 @@
+"""
+Replays the games recorded in event log files (see `singletons.event_log`) in-process, faster than real time.
+No sockets are involved, emits are discarded. Player actions are re-driven on new `Game`s with the logged seeds,
+while timers run on a virtual clock (see `Scheduler.use_virtual_clock`), so a session of hours takes seconds.
+The events the replayed games produce (instructions, expiries, health, levels, game over) are compared with the
+logged ones, and the time spent on each kind of action and on the timers is reported.
+Games without a `create` event in the given files (rotated away) are skipped, games saved to a snapshot on shutdown
+are replayed until the shutdown.
+
+Usage (from the api directory):
+    python -m benchmark.replay events.log.1 events.log
+    python -m benchmark.replay events.log --speed 60 --game ABCDE
+    python -m benchmark.replay events.log --profile replay.prof
+"""
+import argparse
+import asyncio
+import collections
+import cProfile
+import itertools
+import logging
+import os
+import pstats
+import time
+
+from benchmark.micro import API_DIR, setup_environment
+
+logger = logging.getLogger(__name__)
+
+TIMERS = "(timers)"
+# Added to the times of the events before moving the clock, so float rounding doesn't delay timers due at that time
+EPSILON = 1e-6
+
+
+class Replay:
+    """
+    Re-drives the logged games, in the order of their events
+    """
+    def __init__(self, speed=0):
+        # Replay speed relative to real time, 0 = as fast as possible
+        self.speed = speed
+        # Game ids are reused once games are disposed, so each logged game gets a key (its id, then `<id>#2`...)
+        self.keys = {}                          # logged game id: key of the last game logged with that id
+        self.created = collections.Counter()    # logged game id: number of games logged with that id
+        self.games = {}                         # key: `Game` object being replayed
+        self.replayed_keys = {}                 # replayed game id: key of the logged game it replays
+        self.clients = {}                       # (key, uid): `Client` object
+        self.expected = collections.defaultdict(list)   # key: list of logged (kind, fields) outputs
+        self.got = collections.defaultdict(list)        # key: list of replayed (kind, fields) outputs
+        self.skipped = 0
+        self.rejected = collections.Counter()           # kind: number of actions the replayed game refused
+        self.timings = collections.defaultdict(lambda: [0, 0])  # kind: [count, seconds]
+        self._sids = ("replay{}".format(i) for i in itertools.count())
+
+    async def run(self, records):
+        """
+        :param records: `utils.event_log.Record`s sorted by time
+        :return:
+        """
+        from singletons.scheduler import Scheduler
+        from utils import event_log
+
+        start_time = wall_start = None
+        for record in records:
+            if start_time is None:
+                start_time = record.time
+                wall_start = time.perf_counter()
+            if self.speed > 0:
+                delay = wall_start + (record.time - start_time) / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            if record.kind in (event_log.SAVE, event_log.RESTORE):
+                # Timers didn't run anymore once the server started shutting down, so the clock doesn't move
+                self.stop(record.game_id)
+                self.skipped += 1
+                continue
+            start = time.perf_counter()
+            # Timers run at the time of the next event, so their lag on the server is replayed too
+            await Scheduler().advance(record.time + EPSILON)
+            self._time(TIMERS, start)
+
+            if record.kind == event_log.CREATE:
+                await self.create(record)
+                continue
+            key = self.keys.get(record.game_id)
+            if key is None:
+                self.skipped += 1
+            elif record.kind in event_log.OUTPUTS:
+                self.expected[key].append((record.kind, record.fields))
+            else:
+                start = time.perf_counter()
+                try:
+                    await self.drive(key, record)
+                except (RuntimeError, ValueError, TypeError, KeyError) as e:
+                    self.rejected[record.kind] += 1
+                    logger.debug("%s %s rejected by game %s: %s", record.kind, record.fields, key, e)
+                self._time(record.kind, start)
+        self.collect()
+
+    def collect(self):
+        """
+        Files the events produced by the replayed games so far under the logged game they replay.
+        Called before a new game can take the id of a disposed one, and at the end.
+        :return:
+        """
+        from singletons.event_log import EventLog
+        from utils import event_log
+
+        for record in EventLog().take():
+            if record.kind in event_log.OUTPUTS and record.game_id in self.replayed_keys:
+                self.got[self.replayed_keys[record.game_id]].append((record.kind, record.fields))
+
+    async def create(self, record):
+        from server.game import Game
+        from singletons.lobby_manager import LobbyManager
+
+        self.collect()
+        seed, public, max_players, name = record.fields
+        game = Game(name=name, public=public, seed=seed)
+        game.max_players = max_players
+        await LobbyManager().add_game(game)
+        self.created[record.game_id] += 1
+        n = self.created[record.game_id]
+        key = record.game_id if n == 1 else "{}#{}".format(record.game_id, n)
+        self.keys[record.game_id] = key
+        self.games[key] = game
+        self.replayed_keys[game.uuid] = key
+        self.collect()
+
+    def stop(self, game_id):
+        """
+        Stops replaying the logged game `game_id`, its next events are skipped
+        :param game_id: logged game id
+        :return:
+        """
+        key = self.keys.pop(game_id, None)
+        if key is not None:
+            self.games[key].cancel_timers()
+
+    def client(self, key, uid):
+        """
+        :return: `Client` object standing for the player `uid` of the logged game `key`
+        """
+        from server.client import Client
+        from singletons.client_manager import ClientManager
+
+        if (key, uid) not in self.clients:
+            self.clients[key, uid] = Client(next(self._sids), uid=uid)
+            ClientManager().add_client(self.clients[key, uid])
+        return self.clients[key, uid]
+
+    async def drive(self, key, record):
+        """
+        Does the action in `record` on the game replaying the logged game `key`
+        :param key: logged game key
+        :param record: input `utils.event_log.Record`
+        :return:
+        """
+        from singletons.sessions import Sessions
+        from utils import event_log
+
+        game, kind, fields = self.games[key], record.kind, record.fields
+        if kind == event_log.JOIN:
+            await game.join_client(self.client(key, fields[0]))
+        elif kind == event_log.LEAVE:
+            await self.client(key, fields[0]).leave_game()
+        elif kind == event_log.SETTINGS:
+            await game.update_settings(size=fields[0], public=fields[1])
+        elif kind == event_log.READY:
+            await game.ready(self.client(key, fields[0]))
+        elif kind == event_log.START:
+            # Logged however the game was started (host, quick match, single player)
+            if not game.playing:
+                await game.start()
+        elif kind == event_log.INTRO_DONE:
+            await game.intro_done(self.client(key, fields[0]))
+        elif kind == event_log.COMMAND:
+            await game.do_command(self.client(key, fields[0]), fields[1], fields[2])
+        elif kind == event_log.DEFEAT:
+            await game.defeat_special(self.client(key, fields[0]), black_hole=fields[1])
+        elif kind == event_log.DETACH:
+            # Players who lost their socket don't get instructions to complete and don't hold back asteroids
+            await game.detach_client(self.client(key, fields[0]))
+        elif kind == event_log.RESUME:
+            Sessions().take(self.client(key, fields[0]).token)
+            await game.resume_client(self.client(key, fields[0]))
+        elif kind == event_log.DISPOSE:
+            if not game.disposing:
+                await game.dispose()
+
+    def compare(self):
+        """
+        Compares the events produced by the replayed games with the logged ones
+        :return: `{logged game key: (index, expected, got)}` dict with the first difference of each game that diverged
+        """
+        diverged = {}
+        for key in self.games:
+            for i, (a, b) in enumerate(itertools.zip_longest(self.expected[key], self.got[key])):
+                if a != b:
+                    diverged[key] = (i, a, b)
+                    break
+        return diverged
+
+    def _time(self, kind, start):
+        timing = self.timings[kind]
+        timing[0] += 1
+        timing[1] += time.perf_counter() - start
+
+
+def load(paths, game_id=None):
+    """
+    :param paths: event log files, in any order
+    :param game_id: only keep the events of this game
+    :return: list of `utils.event_log.Record`s sorted by time
+    """
+    from utils import event_log
+
+    records = []
+    for path in paths:
+        records.extend(x for x in event_log.read(path) if game_id is None or x.game_id == game_id)
+    # Stable, events logged in the same millisecond keep their order
+    records.sort(key=lambda x: x.time)
+    return records
+
+
+def print_results(replay, records, diverged, elapsed):
+    from utils import event_log
+
+    duration = records[-1].time - records[0].time if records else 0
+    print("{:<24} {:>10} {:>12} {:>12}".format("event", "count", "total (ms)", "mean (us)"))
+    for kind, (count, seconds) in sorted(replay.timings.items(), key=lambda x: -x[1][1]):
+        name = event_log.KINDS[kind][0] if kind in event_log.KINDS else kind
+        print("{:<24} {:>10} {:>12.1f} {:>12.1f}".format(name, count, seconds * 1000, seconds / count * 1e6))
+    print()
+    print("{} events, {} games, {} events of unknown games skipped".format(
+        len(records), len(replay.games), replay.skipped
+    ))
+    if replay.rejected:
+        print("Actions rejected: {}".format(", ".join(
+            "{} {}".format(n, event_log.KINDS[kind][0]) for kind, n in replay.rejected.items()
+        )))
+    print("Replayed {:.1f}s of games in {:.2f}s ({:.0f}x real time)".format(
+        duration, elapsed, duration / elapsed if elapsed > 0 else 0
+    ))
+    print("{} games replayed identically, {} diverged".format(len(replay.games) - len(diverged), len(diverged)))
+    for key, (i, expected, got) in sorted(diverged.items()):
+        print("  {} event {}: logged {}, replayed {}".format(key, i, expected, got))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay games from event logs")
+    parser.add_argument("files", nargs="+", help="event log files")
+    parser.add_argument("--speed", type=float, default=0, help="times real time, 0 = as fast as possible")
+    parser.add_argument("--game", default=None, help="only replay this game")
+    parser.add_argument("--profile", default=None, help="write cProfile stats to this file")
+    options = parser.parse_args()
+
+    paths = [os.path.abspath(x) for x in options.files]
+    os.chdir(API_DIR)
+    logging.basicConfig(level=logging.WARNING)
+    loop = asyncio.get_event_loop()
+    setup_environment()
+
+    from singletons.event_log import EventLog
+    from singletons.scheduler import Scheduler
+    from utils.event_log import EventLogError
+
+    try:
+        records = load(paths, options.game)
+    except (OSError, EventLogError) as e:
+        parser.error(str(e))
+    Scheduler().use_virtual_clock(records[0].time if records else 0)
+    EventLog().capture()
+
+    replay = Replay(options.speed)
+    profiler = cProfile.Profile() if options.profile is not None else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    loop.run_until_complete(replay.run(records))
+    if profiler is not None:
+        profiler.disable()
+    elapsed = time.perf_counter() - start
+
+    print_results(replay, records, replay.compare(), elapsed)
+    if profiler is not None:
+        profiler.dump_stats(options.profile)
+        print()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+
+
+if __name__ == '__main__':
+    main()
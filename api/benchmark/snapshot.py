@@ -0,0 +1,126 @@
+"""
+Time taken to save and restore the games of a worker (see `utils.snapshot`), in-process. No sockets are involved,
+emits are discarded. Builds `--games` in-progress 2-player games with grids and pending instructions, then reports
+the time to take the snapshot, serialize it, write it, read it back and rebuild the games, and the file size.
+
+Usage (from the api directory):
+    python -m benchmark.snapshot --json before.json
+    python -m benchmark.snapshot --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+
+from benchmark.micro import API_DIR, git_revision, make_game, setup_environment
+
+
+def run(loop, games):
+    """
+    :param loop: event loop
+    :param games: number of games to build
+    :return: `{step: seconds}` dict and snapshot file size in bytes
+    """
+    from server.game import Game
+    from singletons.config import Config
+    from singletons.lobby_manager import LobbyManager
+    from utils import json_backend, snapshot
+
+    async def build(game):
+        await LobbyManager().add_game(game)
+        for slot in game.slots:
+            await game.generate_instruction(slot)
+
+    async def rebuild(data):
+        return [await Game.restore(x, Config()["RESUME_TIMEOUT"]) for x in data["lobby"]["games"]]
+
+    timings = {}
+    start = time.perf_counter()
+    for _ in range(games):
+        loop.run_until_complete(build(make_game(loop)))
+    timings["build"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data = snapshot.take()
+    timings["take"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    text = json_backend.get_backend().dumps(data)
+    timings["serialize"] = time.perf_counter() - start
+
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        start = time.perf_counter()
+        snapshot.save(path)
+        timings["save"] = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        with open(path) as f:
+            data = json_backend.get_backend().loads(f.read())
+        timings["load"] = time.perf_counter() - start
+    finally:
+        os.remove(path)
+
+    start = time.perf_counter()
+    restored = loop.run_until_complete(rebuild(data))
+    timings["restore"] = time.perf_counter() - start
+    assert len(restored) == games and len(text) > 0
+    return timings, size
+
+
+def print_results(results, baseline=None):
+    print("{:<24} {:>12}".format("step", "seconds"))
+    for name, seconds in results["timings"].items():
+        line = "{:<24} {:>12.3f}".format(name, seconds)
+        old = baseline["timings"].get(name) if baseline is not None else None
+        if old:
+            line += "  {:+7.1f}% vs {}".format((seconds - old) / old * 100, baseline["meta"].get("revision"))
+        print(line)
+    print("{:<24} {:>12.1f}".format("file size (MiB)", results["size"] / 1024 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Games snapshot save and restore time")
+    parser.add_argument("--games", type=int, default=10000, help="number of games")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    parser.add_argument("--compare", default=None, help="results file to compare with")
+    options = parser.parse_args()
+
+    os.chdir(API_DIR)
+    loop = asyncio.get_event_loop()
+    setup_environment()
+    random.seed(options.seed)
+
+    timings, size = run(loop, options.games)
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "seed": options.seed,
+            "games": options.games,
+        },
+        "timings": timings,
+        "size": size,
+    }
+
+    baseline = None
+    if options.compare is not None:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if options.json is not None:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,27 @@
+import asyncio
+import functools
 import logging
+import signal
 import ssl
+import subprocess
+import sys
+import time
 
 import os
 from aiohttp import web
 
+from singletons import cluster
+from singletons.cluster import Cluster
 from singletons.config import Config
+from singletons.event_log import EventLog
+from singletons.layout_catalogue import LayoutCatalogue
+from singletons.metrics import Metrics
+from singletons.profiler import Profiler
 from singletons.sio import Sio
 from singletons.words_storage import WordsStorage
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
 
 HEADER = """
  _   _                           _____ _ _         
@@ -20,40 +35,189 @@ HEADER = """
 
 """
 
- 
+
+def spawn_workers():
+    """
+    Runs `WORKERS` worker processes and waits for them
+    :return:
+    """
+    logger.info("Spawning %s workers", Config()["WORKERS"])
+    workers = [
+        subprocess.Popen([sys.executable] + sys.argv, env={**os.environ, "WORKER_ID": str(i)})
+        for i in range(Config()["WORKERS"])
+    ]
+    if hasattr(signal, "SIGTERM"):
+        # Let the workers save their games (see `save_snapshot`)
+        signal.signal(signal.SIGTERM, lambda *_: [w.terminate() for w in workers])
+    try:
+        for w in workers:
+            w.wait()
+    except KeyboardInterrupt:
+        for w in workers:
+            w.terminate()
+
+
+async def start_cluster(app):
+    await Cluster().start()
+
+
+@web.middleware
+async def websocket_only(request, handler):
+    # Multi-worker mode: polling requests of the same session can reach any worker, which doesn't know it
+    if request.path.startswith("/socket.io") and request.query.get("transport") != "websocket":
+        raise web.HTTPBadRequest(text="Only the websocket transport is supported")
+    return await handler(request)
+
+
+async def start_worker_endpoints(runner, app):
+    await runner.setup()
+    port = Config()["METRICS_PORT"] + Config()["WORKER_ID"]
+    await web.TCPSite(runner, Config()["SIO_HOST"], port).start()
+    logger.info("Serving worker endpoints on port %s", port)
+
+
+async def stop_worker_endpoints(runner, app):
+    await runner.cleanup()
+
+
+async def start_loop_monitor(app):
+    Metrics().start_loop_monitor()
+
+
+async def start_profiler(app):
+    Profiler().start()
+    if hasattr(signal, "SIGUSR1"):
+        # `kill -USR1 <worker pid>` logs the profiler report
+        asyncio.get_event_loop().add_signal_handler(
+            signal.SIGUSR1, lambda: logger.info("%s", Profiler().format_report())
+        )
+
+
+async def start_reaper(app):
+    # Imported here because it depends on the server package (see `main`)
+    from singletons.reaper import Reaper
+    Reaper().start()
+
+
+async def restore_snapshot(app):
+    # Imported here because it depends on the server package (see `main`)
+    from utils import snapshot
+    path = snapshot.snapshot_path()
+    if path is None:
+        return
+    try:
+        await snapshot.restore(path, Config()["RESUME_TIMEOUT"])
+    except Exception:
+        logger.exception("Could not restore snapshot %s", path)
+
+
+async def save_snapshot(app):
+    # Called on SIGTERM/SIGINT too, aiohttp shuts down gracefully
+    from utils import snapshot
+    path = snapshot.snapshot_path()
+    if path is None:
+        return
+    start = time.perf_counter()
+    try:
+        games = snapshot.save(path)
+    except Exception:
+        logger.exception("Could not save snapshot %s", path)
+        return
+    logger.info("Saved %s games to %s in %.3fs", games, path, time.perf_counter() - start)
+
+
+async def start_event_log(app):
+    EventLog().start()
+
+
+async def close_event_log(app):
+    EventLog().close()
+
+
 def main():
+    setup_logging(
+        Config()["LOG_LEVEL"] or (logging.DEBUG if Config()["DEBUG"] else logging.INFO),
+        json_format=Config()["LOG_FORMAT"] == "json"
+    )
     logging.getLogger("aiohttp").setLevel(logging.CRITICAL)
-    logging.getLogger().setLevel(logging.DEBUG if Config()["DEBUG"] else logging.INFO)
+    # socket.io logs every packet at INFO level
+    for name in ("socketio", "engineio"):
+        logging.getLogger(name).setLevel(logging.DEBUG if Config()["DEBUG"] else logging.WARNING)
+
+    cluster.check_config()
+    if Config()["WORKER_ID"] is None:
+        # Multi-worker mode and no worker id, we are the launcher
+        spawn_workers()
+        return
 
     # Debug alert
     if Config()["DEBUG"]:
-        logging.debug("Running in debug mode")
+        logger.debug("Running in debug mode")
     if Config()["SINGLE_PLAYER"]:
-        logging.debug("Running in single player mode")
+        logger.debug("Running in single player mode")
 
     # ASCII art
-    print(HEADER)
+    if Config()["WORKER_ID"] == 0:
+        print(HEADER)
 
     # Load words storage
     WordsStorage().load()
 
+    # Enumerate grid layouts
+    LayoutCatalogue().load()
+
     # Create sio and aiohttp server
-    app = web.Application()
-    sio = Sio(cors_allowed_origins=[])
+    app = web.Application(middlewares=[websocket_only] if Cluster().enabled else [])
+    sio = Sio(cors_allowed_origins=[], client_manager=Cluster().sio_manager)
     sio.attach(app)
+    app.on_startup.append(start_cluster)
 
     # Config server functionality (see server/__init__.py)
     import server
 
+    # Endpoints reporting on this worker only. In multi-worker mode any worker can answer on SIO_PORT,
+    # so each one serves them on its own port.
+    worker_app = web.Application() if Cluster().enabled else app
+    if worker_app is not app:
+        runner = web.AppRunner(worker_app)
+        app.on_startup.append(functools.partial(start_worker_endpoints, runner))
+        app.on_cleanup.append(functools.partial(stop_worker_endpoints, runner))
+
+    # Health check
+    worker_app.router.add_get("/healthz", server.health_endpoint)
+
+    # Metrics endpoint
+    if Config()["METRICS"]:
+        worker_app.router.add_get("/metrics", server.metrics_endpoint)
+        app.on_startup.append(start_loop_monitor)
+
+    # Game events log, for offline replays (see `benchmark.replay`), started before restoring the snapshot
+    # and closed after saving it, so restored games are logged
+    app.on_startup.append(start_event_log)
+
+    # Games snapshot, restored after the cluster is up so restored public games are announced to the other workers
+    app.on_startup.append(restore_snapshot)
+    app.on_shutdown.append(save_snapshot)
+    app.on_shutdown.append(close_event_log)
+
+    # Idle games and clients reaper
+    app.on_startup.append(start_reaper)
+
+    # Profiler
+    if Profiler().enabled:
+        app.on_startup.append(start_profiler)
+        if Config()["ADMIN_TOKEN"]:
+            worker_app.router.add_get("/admin/profile", server.profile_endpoint)
+
     # Load SSL context
     cert_path = Config()["SSL_CERT"]
     key_path = Config()["SSL_KEY"]
     if cert_path and key_path and os.path.isfile(cert_path) and os.path.isfile(key_path):
-        logging.info("Using SSL")
+        logger.info("Using SSL")
         ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
         ssl_context.load_cert_chain(Config()["SSL_CERT"], Config()["SSL_KEY"])
     else:
-        logging.warning("SSL is disabled!")
+        logger.warning("SSL is disabled!")
         ssl_context = None
 
     # Start server
@@ -61,7 +225,8 @@ def main():
         app,
         host=Config()["SIO_HOST"],
         port=Config()["SIO_PORT"],
-        ssl_context=ssl_context
+        ssl_context=ssl_context,
+        reuse_port=Cluster().enabled
     )
 
 if __name__ == '__main__':
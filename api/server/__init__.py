@@ -1,42 +1,64 @@
+import hmac
 import logging
 
+from aiohttp import web
+
 from server.client import Client
 from server.game import Game
 from singletons.client_manager import ClientManager
+from singletons.cluster import Cluster
+from singletons.config import Config
+from singletons.emit_coalescer import EmitCoalescer
 from singletons.lobby_manager import LobbyManager
+from singletons.matchmaker import Matchmaker
+from singletons.metrics import Metrics
+from singletons.profiler import Profiler
+from singletons.scheduler import Scheduler
+from singletons.sessions import Sessions
 from singletons.sio import Sio
-from utils import server
+from utils import game_ids, server
+
+logger = logging.getLogger(__name__)
 
 sio = Sio()
+cluster = Cluster()
+metrics = Metrics()
 
 # TODO: some of these raise uncaught runtime errors in akerino edge cases
 
 
 @sio.on("connect")
+@server.profile("connect")
 async def connect(sid, environ):
     c = Client(sid)
     ClientManager().add_client(c)
-    await sio.emit("welcome", {"uid": c.uid}, room=sid)
-    logging.info("{} connected".format(c.uid))
+    await sio.emit("welcome", {"uid": c.uid, "token": c.token}, room=sid)
+    logger.info("%s connected", c.uid)
 
 
 @sio.on("disconnect")
-@server.link_client
-async def disconnect(sid, data, client):
+@server.profile("disconnect")
+async def disconnect(sid, data=None):
     try:
+        client = ClientManager()[sid]
         ClientManager().remove_client(client)
-        await client.dispose()
-        logging.info("{} disconnected".format(sid))
+        Matchmaker().cancel(client)
+        if client.remote_game_id is not None:
+            # The worker hosting the game holds the slot or removes the proxy
+            cluster.publish("detach", to=cluster.owner_of(client.remote_game_id), sid=sid)
+            client.remote_game_id = None
+        elif client.game is not None and client.game.resumable:
+            # Keep the slot for a while, the client may come back with its token (see `resume`)
+            await client.game.detach_client(client)
+        else:
+            await client.dispose()
+        logger.info("%s disconnected", sid)
     except KeyError:
         # TODO: Log
         return
 
 
-@sio.on("create_game")
-@server.base
-@server.link_client
-@server.client_not_in_game
-@server.args(("name", str), ("public", bool))
+@server.handler("create_game", requires=(server.NOT_IN_GAME,), args=(("name", str), ("public", bool)))
 async def create_game(sid, data, client):
     match = Game(name=data["name"], public=data["public"])
     await LobbyManager().add_game(match)
@@ -47,45 +69,83 @@ async def create_game(sid, data, client):
         return
 
 
-@sio.on("join_lobby")
-@server.base
-@server.link_client
+@server.handler("join_lobby")
 async def join_lobby(sid, data, client):
+    # Send a page of the lobby, then `lobby_delta` updates. Send `join_lobby` again to get another page.
+    page = data.get("page") if type(data) is dict else None
     sio.enter_room(client.sid, "lobby")
-    for _, g in LobbyManager().items():
-        if g.public and not g.playing:
-            await sio.emit("lobby_info", g.sio_lobby_info(), room=sid)
-    logging.info("{} joined lobby".format(sid))
+    await sio.emit("lobby_snapshot", LobbyManager().lobby_snapshot(page if type(page) is int else 0), room=sid)
+    logger.info("%s joined lobby", sid)
 
 
-@sio.on("leave_lobby")
-@server.base
-@server.link_client
+@server.handler("leave_lobby")
 async def leave_lobby(sid, data, client):
     sio.leave_room(client.sid, "lobby")
-    logging.info("{} left lobby".format(sid))
+    logger.info("%s left lobby", sid)
 
 
-@sio.on("join_game")
-@server.base
-@server.link_client
-@server.client_not_in_game
-@server.args(("game_id", str))
+@server.handler("join_game", requires=(server.NOT_IN_GAME,), args=(("game_id", str),))
 async def join_game(sid, data, client):
-    if data["game_id"].lower() not in LobbyManager():
-        logging.warning("{} tried to enter unknown game {}".format(sid, data["game_id"]))
+    game_id = game_ids.normalize(data["game_id"])
+    if not cluster.is_local(game_id):
+        # Hosted by another worker, ask it to add this client
+        cluster.publish(
+            "join", to=cluster.owner_of(game_id), sid=sid, uid=client.uid, token=client.token, game_id=game_id
+        )
+    elif game_id not in LobbyManager():
+        logger.warning("%s tried to enter unknown game %s", sid, data["game_id"])
         await sio.emit("game_join_fail", {
             "message": "Partita non trovata"
-        })
+        }, room=sid)
+    else:
+        await LobbyManager()[game_id].join_client(client)
+
+
+@server.handler("resume", requires=(server.NOT_IN_GAME,), args=(("token", str),))
+async def resume(sid, data, client):
+    # Take back the slot of a player left without socket, see singletons/sessions.py
+    session = Sessions().take(data["token"])
+    if session is not None and session.game is not None:
+        # The session replaces the client made for this socket
+        ClientManager().remove_client(client)
+        Matchmaker().cancel(client)
+        await resume_session(session, client.sid, client.worker_id)
+    elif session is None and cluster.enabled:
+        # The session may be held by another worker, which sends `resync` if it is
+        cluster.publish("resume", sid=sid, token=data["token"])
     else:
-        await LobbyManager()[data["game_id"]].join_client(client)
+        await sio.emit("resume_fail", room=sid)
+
+
+async def resume_session(session, sid, worker_id):
+    """
+    Binds a detached session to a new socket and sends it the state of its game
+    :param session: `Client` object taken from `Sessions`, in a game
+    :param sid: sid of the new socket
+    :param worker_id: worker the new socket is connected to
+    :return:
+    """
+    session.sid = sid
+    session.worker_id = worker_id
+    session.last_activity = Scheduler().time()
+    ClientManager().add_client(session)
+    await session.game.resume_client(session)
+
+
+@server.handler("quick_match", requires=(server.NOT_IN_GAME,), args=(("size", int),))
+async def quick_match(sid, data, client):
+    # Join a public game or wait for other players, see singletons/matchmaker.py
+    await Matchmaker().quick_match(client, min(max(2, data["size"]), Game.MAX_PLAYERS))
+
 
+@server.handler("cancel_quick_match")
+async def cancel_quick_match(sid, _, client):
+    if Matchmaker().cancel(client):
+        await sio.emit("quick_match_cancelled", room=sid)
+        logger.info("%s left the quick match queue", sid)
 
-@sio.on("change_game_settings")
-@server.base
-@server.link_client
-@server.client_in_game
-@server.client_is_host
+
+@server.handler("change_game_settings", requires=(server.IN_GAME, server.HOST))
 async def change_game_settings(sid, data, client):
     kwargs = {}
     if "size" in data and type(data["size"]) is int:
@@ -95,49 +155,37 @@ async def change_game_settings(sid, data, client):
     await client.game.update_settings(**kwargs)
 
 
-@sio.on("ready")
-@server.base
-@server.link_client
-@server.client_in_game
+@server.handler("ready", requires=(server.IN_GAME,))
 async def toggle_ready(sid, _, client):
     await client.game.ready(client)
 
 
-@sio.on("leave_game")
-@server.base
-@server.link_client
-@server.client_in_game
+@server.handler("leave_game", requires=(server.IN_GAME,))
 async def leave_game(sid, _, client):
     await client.leave_game()
 
 
-@sio.on("start_game")
-@server.base
-@server.link_client
-@server.client_in_game
-#@server.client_is_host # Uncomment this to restrict starting the game to host only
+# Add server.HOST to restrict starting the game to host only
+@server.handler("start_game", requires=(server.IN_GAME,))
 async def start_game(sid, _, client):
     try:
         await client.game.start()
     except RuntimeError:
-        logging.warning("{} game wanted to start, but requirements arent met".format(client.game.uuid))
+        logger.warning("%s game wanted to start, but requirements arent met", client.game.uuid)
 
 
-@sio.on("intro_done")
-@server.base
-@server.link_client
-@server.client_in_game_in_progress
+@server.handler("intro_done", requires=(server.IN_PROGRESS,))
 async def intro_done(sid, _, client):
     await client.game.intro_done(client)
 
 
-@sio.on("command")
-@server.base
-@server.link_client
-@server.client_in_game_in_progress
-@server.args(("name", str))
+COMMAND_RATE_LIMIT = (Config()["COMMAND_RATE_LIMIT"], Config()["COMMAND_BURST"])
+SPECIAL_RATE_LIMIT = (Config()["SPECIAL_RATE_LIMIT"], Config()["SPECIAL_BURST"])
+
+
+@server.handler("command", requires=(server.IN_PROGRESS,), args=(("name", str),), rate_limit=COMMAND_RATE_LIMIT)
 async def command(sid, data, client):
-    print("Got", data)
+    logger.debug("%s sent command %s", sid, data)
     try:
         await client.game.do_command(client, data["name"], data["value"] if "value" in data else None)
     except ValueError:
@@ -145,19 +193,221 @@ async def command(sid, data, client):
         pass
 
 
-@sio.on("defeat_asteroid")
-@server.base
-@server.link_client
-@server.client_in_game_in_progress
-async def command(sid, data, client):
-    logging.debug("Got an asteroid!")
+@server.handler("defeat_asteroid", requires=(server.IN_PROGRESS,), rate_limit=SPECIAL_RATE_LIMIT)
+async def defeat_asteroid(sid, data, client):
+    logger.debug("Got an asteroid!")
     await client.game.defeat_special(client, False)
 
 
-@sio.on("defeat_black_hole")
-@server.base
-@server.link_client
-@server.client_in_game_in_progress
-async def command(sid, data, client):
-    logging.debug("Got a black hole!")
+@server.handler("defeat_black_hole", requires=(server.IN_PROGRESS,), rate_limit=SPECIAL_RATE_LIMIT)
+async def defeat_black_hole(sid, data, client):
+    logger.debug("Got a black hole!")
     await client.game.defeat_special(client, True)
+
+
+# Multi-worker mode (see singletons/cluster.py)
+# Events handled by the worker that hosts the game
+FORWARDED_EVENTS = {
+    "change_game_settings", "ready", "leave_game", "start_game",
+    "intro_done", "command", "defeat_asteroid", "defeat_black_hole"
+}
+
+
+async def route_event(event, sid, data=None, *args):
+    """
+    `Sio` event router. Forwards game events of clients that joined a game hosted by another worker.
+    :return: `True` if the event has been forwarded and must not be handled by this worker
+    """
+    if event not in FORWARDED_EVENTS:
+        return False
+    try:
+        client = ClientManager()[sid]
+    except KeyError:
+        return False
+    if client.remote_game_id is None:
+        return False
+    client.last_activity = Scheduler().time()
+    if server.rate_limited(client, event):
+        # Don't flood the message bus, the hosting worker would drop it anyway
+        return True
+    cluster.publish("event", to=cluster.owner_of(client.remote_game_id), sid=sid, event=event, payload=data)
+    return True
+
+
+if cluster.enabled:
+    sio.event_router = route_event
+
+
+@cluster.on("join")
+async def cluster_join(worker_id, sid, uid, game_id, token=None, quick_match=False):
+    if quick_match:
+        # The matchmaker of the other worker tries another game if this one has no room anymore
+        match = LobbyManager()[game_id] if game_id in LobbyManager() else None
+        if match is None or match.playing or len(match.slots) >= match.max_players:
+            cluster.publish("join_failed", to=worker_id, sid=sid, game_id=game_id)
+            return
+    elif game_id not in LobbyManager():
+        await sio.emit("game_join_fail", {
+            "message": "Partita non trovata"
+        }, room=sid)
+        return
+
+    # Proxy for the remote client
+    proxy = Client(sid, uid=uid, worker_id=worker_id, token=token)
+    try:
+        ClientManager().add_client(proxy)
+    except ValueError:
+        # Already in a game hosted by this worker
+        return
+
+    match = LobbyManager()[game_id]
+    await match.join_client(proxy)
+    if proxy.game is match:
+        cluster.publish("joined", to=worker_id, sid=sid, game_id=game_id)
+    else:
+        ClientManager().remove_client(proxy)
+        if quick_match:
+            cluster.publish("join_failed", to=worker_id, sid=sid, game_id=game_id)
+
+
+@cluster.on("resume")
+async def cluster_resume(worker_id, sid, token):
+    session = Sessions().take(token)
+    if session is None or session.game is None:
+        return
+    # The socket is connected to another worker, the session becomes a proxy
+    cluster.publish("joined", to=worker_id, sid=sid, game_id=session.game.uuid)
+    await resume_session(session, sid, worker_id)
+
+
+@cluster.on("joined")
+async def cluster_joined(worker_id, sid, game_id):
+    try:
+        client = ClientManager()[sid]
+    except KeyError:
+        # Disconnected in the meantime
+        cluster.publish("leave", to=worker_id, sid=sid)
+        return
+    client.remote_game_id = game_id
+    Matchmaker().joined(client)
+
+
+@cluster.on("join_failed")
+async def cluster_join_failed(worker_id, sid, game_id):
+    # Quick match join refused, see `Matchmaker.join_failed`
+    try:
+        client = ClientManager()[sid]
+    except KeyError:
+        return
+    await Matchmaker().join_failed(client, game_id)
+
+
+@cluster.on("leave")
+async def cluster_leave(worker_id, sid):
+    try:
+        proxy = ClientManager()[sid]
+    except KeyError:
+        return
+    await proxy.leave_game()
+
+
+@cluster.on("detach")
+async def cluster_detach(worker_id, sid):
+    # The socket of a proxy is gone
+    try:
+        proxy = ClientManager()[sid]
+    except KeyError:
+        return
+    if proxy.game is not None and proxy.game.resumable:
+        ClientManager().remove_client(proxy)
+        await proxy.game.detach_client(proxy)
+    else:
+        await proxy.leave_game()
+
+
+@cluster.on("left")
+async def cluster_left(worker_id, sid, game_id):
+    try:
+        client = ClientManager()[sid]
+    except KeyError:
+        return
+    if client.remote_game_id == game_id:
+        client.remote_game_id = None
+
+
+@cluster.on("event")
+async def cluster_event(worker_id, sid, event, payload):
+    await sio.trigger_event(event, sid, payload)
+
+
+@cluster.on("lobby_delta")
+async def cluster_lobby_delta(worker_id, added, updated, removed):
+    LobbyManager().update_remote_lobby(added, updated, removed)
+
+
+@cluster.on("lobby_sync")
+async def cluster_lobby_sync(worker_id, games=None):
+    if games is not None:
+        LobbyManager().replace_remote_lobby(worker_id, games)
+    cluster.publish("lobby_delta", to=worker_id, added=LobbyManager().local_lobby_infos(), updated=[], removed=[])
+
+
+@cluster.on_reconnect
+def cluster_reconnected():
+    # Lobby changes were missed both ways while disconnected: send all our public games and ask for theirs
+    cluster.publish("lobby_sync", games=LobbyManager().local_lobby_infos())
+
+
+metrics.gauge("happycity_clients", "Connected clients", function=lambda: len(ClientManager()))
+metrics.gauge("happycity_games", "Games hosted by this worker", function=lambda: len(LobbyManager()))
+metrics.gauge(
+    "happycity_games_playing", "Games in progress hosted by this worker",
+    function=lambda: sum(1 for _, g in LobbyManager().items() if g.playing)
+)
+metrics.gauge(
+    "happycity_players", "Players in games hosted by this worker",
+    function=lambda: sum(len(g.slots) for _, g in LobbyManager().items())
+)
+metrics.gauge("happycity_scheduled_timers", "Pending game timers", function=lambda: len(Scheduler()))
+metrics.gauge(
+    "happycity_message_bus_connected", "Whether this worker is connected to the message bus",
+    function=lambda: int(cluster.connected)
+)
+metrics.gauge("happycity_detached_sessions", "Players waiting to resume their session", function=lambda: len(Sessions()))
+metrics.gauge("happycity_matchmaking_queued", "Clients waiting for a quick match", function=lambda: len(Matchmaker()))
+metrics.counter(
+    "happycity_coalesced_emits_saved_total", "State updates dropped because a newer one replaced them",
+    function=lambda: EmitCoalescer().stats["saved"]
+)
+
+
+async def metrics_endpoint(request):
+    return web.Response(
+        body=metrics.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+async def health_endpoint(request):
+    """
+    Health check, fails while this worker can't reach the other ones
+    """
+    if not cluster.connected:
+        raise web.HTTPServiceUnavailable(text="Message bus disconnected")
+    return web.Response(text="OK")
+
+
+async def profile_endpoint(request):
+    """
+    Profiler report, as text or as JSON with `?format=json`. `?reset=1` clears the collected data.
+    Requires the `ADMIN_TOKEN` in the `token` query parameter.
+    """
+    if not hmac.compare_digest(request.query.get("token", ""), Config()["ADMIN_TOKEN"] or ""):
+        raise web.HTTPForbidden()
+    if request.query.get("format") == "json":
+        response = web.json_response(Profiler().report())
+    else:
+        response = web.Response(text=Profiler().format_report())
+    if request.query.get("reset") == "1":
+        Profiler().reset()
+    return response
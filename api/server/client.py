@@ -1,14 +1,47 @@
+import secrets
+
 from constants import client_statuses
 from singletons.client_manager import ClientManager
+from singletons.cluster import Cluster
+from singletons.config import Config
+from singletons.scheduler import Scheduler
 
 
 class Client:
-    def __init__(self, sid):
+    __slots__ = ("sid", "uid", "token", "status", "_game", "worker_id", "remote_game_id", "last_activity",
+                 "rate_limits")
+
+    def __init__(self, sid, uid=None, worker_id=None, token=None):
         self.sid = sid
-        self.uid = ClientManager().next_uid()
+        self.uid = ClientManager().next_uid() if uid is None else uid
+        # Secret used to resume the session from another socket (see `singletons.sessions`)
+        self.token = secrets.token_urlsafe(16) if token is None else token
         self.status = client_statuses.NONE
         self._game = None
 
+        # Worker the socket is connected to. Differs from ours if this is a proxy for a remote client.
+        self.worker_id = Config()["WORKER_ID"] if worker_id is None else worker_id
+        # Id of the game this client has joined, if it's hosted by another worker
+        self.remote_game_id = None
+        # `Scheduler().time()` of the last event received from this client (see `singletons.reaper`)
+        self.last_activity = Scheduler().time()
+        # event: `TokenBucket`, created on the first rate limited event (see `utils.rate_limit`)
+        self.rate_limits = None
+
+    def snapshot(self):
+        """
+        :return: JSON serializable state of this client, restored with `Client.restore`
+        """
+        return {"sid": self.sid, "uid": self.uid, "token": self.token}
+
+    @classmethod
+    def restore(cls, data):
+        """
+        :param data: `Client.snapshot` dict
+        :return: `Client` object, connected to this worker, not registered in `ClientManager`
+        """
+        return cls(data["sid"], uid=data["uid"], token=data["token"])
+
     async def dispose(self):
         # Leave joined game
         await self.leave_game()
@@ -19,9 +52,17 @@ class Client:
         self._game = game
 
     async def leave_game(self):
+        if self.remote_game_id is not None:
+            Cluster().publish("leave", to=Cluster().owner_of(self.remote_game_id), sid=self.sid)
+            self.remote_game_id = None
         if self._game is not None:
+            game = self._game
             await self._game.remove_client(self)
             self._game = None
+            if self.is_proxy:
+                # Notify the worker the client is connected to and forget the proxy
+                Cluster().publish("left", to=self.worker_id, sid=self.sid, game_id=game.uuid)
+                ClientManager().remove_client(self)
 
     @property
     def game(self):
@@ -29,7 +70,11 @@ class Client:
 
     @property
     def is_in_game(self):
-        return self._game is not None
+        return self._game is not None or self.remote_game_id is not None
+
+    @property
+    def is_proxy(self):
+        return self.worker_id != Config()["WORKER_ID"]
 
     @property
     def is_host(self):
@@ -1,4 +1,4 @@
-import asyncio
+import collections
 import logging
 import random
 
@@ -6,14 +6,37 @@ from server import Client
 from server.game_modifiers import FlipGrid, Symbols, BlackHolesField, AsteroidsField, Alien
 from server.instruction import Instruction
 from singletons.config import Config
+from singletons.emit_coalescer import EmitCoalescer
+from singletons.event_log import EventLog
 from singletons.lobby_manager import LobbyManager
+from singletons.matchmaker import Matchmaker
+from singletons.metrics import Metrics
+from singletons.scheduler import Scheduler
+from singletons.sessions import Sessions
 from singletons.sio import Sio
+from utils import event_log, json_backend
 from utils.command_name_generator import CommandNameGenerator
-from utils.grid import Grid, Button, SliderLikeElement, Actions, Switch, GridElement
+from utils.grid import Grid, Button, SliderLikeElement, Actions, Switch
 from utils.special_commands import DummyAsteroidCommand, DummyBlackHoleCommand, SpecialCommand
 
+logger = logging.getLogger(__name__)
+
+GAME_MODIFIERS = {x.__name__: x for x in (Symbols, FlipGrid, AsteroidsField, BlackHolesField, Alien)}
+
+# Seeds of the new games of this worker. With `GAME_SEED` set, games created in the same order get the same seeds.
+_seeds = random.Random(
+    None if Config()["GAME_SEED"] is None
+    else Config()["GAME_SEED"] * Config()["WORKERS"] + (Config()["WORKER_ID"] or 0)
+)
+
 
 class Slot:
+    __slots__ = (
+        "client", "ready", "intro_done", "host", "role", "grid", "instruction", "next_generation_timer",
+        "defeating_asteroid", "defeating_black_hole", "reset_asteroid_timer", "reset_black_hole_timer",
+        "special_command_cooldown"
+    )
+
     def __init__(self, client, ready=False, host=False, role=0):
         self.client = client
         self.ready = ready
@@ -23,56 +46,131 @@ class Slot:
 
         self.grid = None
         self.instruction = None
-        self.next_generation_task = None
+        self.next_generation_timer = None
 
         self.defeating_asteroid = False
         self.defeating_black_hole = False
+        self.reset_asteroid_timer = None
+        self.reset_black_hole_timer = None
 
         self.special_command_cooldown = 0
 
-    def sio_slot_info(self):
+    @property
+    def detached(self):
+        """
+        :return: `True` if the player lost its socket and may resume its session (see `Game.detach_client`)
+        """
+        return self.client.token in Sessions()
+
+    def to_payload(self):
+        """
+        :return: dict sent to the clients in the `game_info` event
+        """
         return {
             "uid": self.client.uid,
             "ready": self.ready,
             "host": self.host
         }
 
-    async def reset_asteroid(self, after=2):
-        await asyncio.sleep(after)
+    def snapshot(self, slots):
+        """
+        :param slots: `Slot` objects of the game
+        :return: JSON serializable state of this slot, restored with `Slot.restore`.
+                 The instruction is saved only if it's active, with the seconds left before it expires.
+        """
+        remaining = self.next_generation_timer.remaining if self.next_generation_timer is not None else None
+        return {
+            "client": self.client.snapshot(),
+            "ready": self.ready,
+            "intro_done": self.intro_done,
+            "host": self.host,
+            "role": self.role,
+            "grid": self.grid.snapshot() if self.grid is not None else None,
+            "instruction": self.instruction.snapshot(slots) if remaining is not None else None,
+            "instruction_remaining": remaining,
+            "special_command_cooldown": self.special_command_cooldown,
+        }
+
+    @classmethod
+    def restore(cls, data):
+        """
+        :param data: `Slot.snapshot` dict
+        :return: `Slot` object, without instruction (see `Game.restore`)
+        """
+        slot = cls(Client.restore(data["client"]), ready=data["ready"], host=data["host"], role=data["role"])
+        slot.intro_done = data["intro_done"]
+        slot.grid = Grid.restore(data["grid"]) if data["grid"] is not None else None
+        slot.special_command_cooldown = data["special_command_cooldown"]
+        return slot
+
+    def reset_asteroid(self):
         self.defeating_asteroid = False
 
-    async def reset_black_hole(self, after=2):
-        await asyncio.sleep(after)
+    def reset_black_hole(self):
         self.defeating_black_hole = False
 
+    def timers(self):
+        return self.next_generation_timer, self.reset_asteroid_timer, self.reset_black_hole_timer
+
+    def cancel_timers(self):
+        for timer in self.timers():
+            if timer is not None:
+                timer.cancel()
+
 
 class Game:
     STARTING_HEALTH = 50
     HEALTH_LOOP_RATE = 2
+    SPECIAL_COMMAND_RESET_TIME = 2
     MAX_PLAYERS = 4
 
-    def __init__(self, name, public):
+    def __init__(self, name, public, seed=None):
         self._uuid = None   # implemented as a property
 
+        # Every random choice of this game (grids, command names, instructions, modifiers) uses `rng`,
+        # so the same seed replays the same grids and instructions given the same player actions
+        self.seed = _seeds.getrandbits(32) if seed is None else seed
+        self._rng = None    # implemented as a property, created when first used (2.5 KiB)
+
         self.name = name
 
         self.public = public
         self.max_players = 2
+        # Start as soon as the game is full and everyone is ready (quick matches)
+        self.auto_start = False
 
         self.slots = []
         self.playing = False
         self.disposing = False
-        self.instructions = []
+        self.created_at = Scheduler().time()
+        self.finished_at = None     # `Scheduler().time()` of the game over
+        # Games restored from a snapshot wait for their players with their timers paused (see `pause_timers`)
+        self.paused = False
+        self.abandon_timer = None
+
+        # Serialized game info, see `game_info_payload`
+        self._game_info_payload = None
+
+        # Active instructions, indexed by target command name and by special command type.
+        # Commands are counted, the fallback in `generate_instruction` can instruct one twice.
+        self.instructions = set()
+        self.instructed_commands = collections.Counter()
+        self.instructions_by_command_name = {}
+        self.instructions_by_special_command = {
+            DummyAsteroidCommand: [],
+            DummyBlackHoleCommand: []
+        }
 
         self.level = -1
         self.health = self.STARTING_HEALTH
         self.death_limit = 0
 
-        self.health_drain_task = None
+        self.warmup_timer = None
+        self.health_drain_timer = None
 
         self.previous_game_modifier = None
         self.game_modifier = None
-        self.game_modifier_task = None
+        self.game_modifier_timer = None
 
         self.difficulty = {
             "instructions_time": 25,                        # seconds to complete an instruction
@@ -107,6 +205,99 @@ class Game:
             raise RuntimeError("Game's uuid cannot be changed!")
         self._uuid = uuid
 
+    def snapshot(self):
+        """
+        Returns the state of this game: settings, level, health, difficulty, modifier, slots with their grids
+        and active instructions, and the seconds left on each timer
+        :return: JSON serializable dict, restored with `Game.restore`
+        """
+        return {
+            "id": self.uuid,
+            "seed": self.seed,
+            "name": self.name,
+            "public": self.public,
+            "max_players": self.max_players,
+            "auto_start": self.auto_start,
+            "playing": self.playing,
+            "finished": Scheduler().time() - self.finished_at if self.finished_at is not None else None,
+            "level": self.level,
+            "health": self.health,
+            "death_limit": self.death_limit,
+            "difficulty": self.difficulty,
+            "game_modifier": type(self.game_modifier).__name__ if self.game_modifier is not None else None,
+            "previous_game_modifier": (
+                type(self.previous_game_modifier).__name__ if self.previous_game_modifier is not None else None
+            ),
+            "timers": {
+                name: timer.remaining if timer is not None else None
+                for name, timer in (
+                    ("warmup", self.warmup_timer),
+                    ("health_drain", self.health_drain_timer),
+                    ("game_modifier", self.game_modifier_timer),
+                )
+            },
+            "slots": [x.snapshot(self.slots) for x in self.slots],
+        }
+
+    @classmethod
+    async def restore(cls, data, resume_timeout):
+        """
+        Rebuilds a game from `Game.snapshot`, with its timers paused with the time they had left.
+        Its clients are not connected (see `singletons.sessions`), the timers start again when the first one resumes
+        its session, and the game is disposed if nobody does within `resume_timeout` seconds.
+        :param data: `Game.snapshot` dict
+        :param resume_timeout: seconds players have to resume their sessions
+        :return: `Game` object, not registered in `LobbyManager`
+        """
+        game = cls(name=data["name"], public=data["public"], seed=data["seed"])
+        game.uuid = data["id"]
+        game.max_players = data["max_players"]
+        game.auto_start = data["auto_start"]
+        game.playing = data["playing"]
+        if data["finished"] is not None:
+            game.finished_at = Scheduler().time() - data["finished"]
+        game.level = data["level"]
+        game.health = data["health"]
+        game.death_limit = data["death_limit"]
+        game.difficulty = game.vanilla_difficulty = data["difficulty"]
+        if data["game_modifier"] is not None:
+            game.game_modifier = GAME_MODIFIERS[data["game_modifier"]](game)
+        if data["previous_game_modifier"] is not None:
+            game.previous_game_modifier = GAME_MODIFIERS[data["previous_game_modifier"]](game)
+
+        game.slots = [Slot.restore(x) for x in data["slots"]]
+        for slot, x in zip(game.slots, data["slots"]):
+            await slot.client.join_game(game)
+            if x["instruction"] is not None:
+                slot.instruction = Instruction.restore(x["instruction"], game.slots)
+                game.add_instruction(slot.instruction)
+                slot.next_generation_timer = Scheduler().call_later(
+                    x["instruction_remaining"], game.expire_instruction, slot
+                )
+
+        timers = data["timers"]
+        if timers["warmup"] is not None:
+            game.warmup_timer = Scheduler().call_later(timers["warmup"], game.warmup_done)
+        if timers["health_drain"] is not None:
+            game.health_drain_timer = Scheduler().call_every(
+                game.HEALTH_LOOP_RATE, game.drain_health, delay=timers["health_drain"]
+            )
+        if timers["game_modifier"] is not None:
+            game.game_modifier_timer = Scheduler().call_every(
+                game.game_modifier.TICK_RATE, game.game_modifier.tick, delay=timers["game_modifier"]
+            )
+        game.pause_timers(resume_timeout)
+        return game
+
+    @property
+    def rng(self):
+        """
+        :return: `random.Random` object of this game, seeded with `seed`
+        """
+        if self._rng is None:
+            self._rng = random.Random(self.seed)
+        return self._rng
+
     async def join_client(self, client):
         """
         Adds a client to the match and notifies match and lobby
@@ -129,12 +320,18 @@ class Game:
 
         # Add the client to this match's clients
         self.slots.append(Slot(client, host=len(self.slots) == 0, role=min(len(self.slots), 3))) # !todo: parameterise max number of roles
+        self.invalidate_game_info()
+        EventLog().record(self, event_log.JOIN, client.uid)
+        if self.paused:
+            # Restored lobby game, someone new is here
+            self.resume_timers()
 
         # Enter sio room
         Sio().enter_room(client.sid, self.sio_room)
 
         # Bind client to this game
         await client.join_game(self)
+        Matchmaker().cancel(client)
 
         # Notify joined client
         await Sio().emit("game_join_success", {
@@ -149,7 +346,7 @@ class Game:
         # Notify lobby if public
         await self.notify_lobby()
 
-        logging.info("{} joined game {}".format(client.sid, self.uuid))
+        logger.info("%s joined game %s", client.sid, self.uuid)
 
         if Config()["SINGLE_PLAYER"]:
             await self.start()
@@ -178,6 +375,9 @@ class Game:
 
         # Remove the client
         self.slots.remove(slot_to_remove)
+        slot_to_remove.cancel_timers()
+        self.invalidate_game_info()
+        EventLog().record(self, event_log.LEAVE, client.uid)
 
         # Leave sio room
         Sio().leave_room(client.sid, self.sio_room)
@@ -193,9 +393,10 @@ class Game:
         elif not self.playing:
             # Choose another host if host left
             if slot_to_remove.host and len(self.slots) > 0:
-                new_host = random.choice(self.slots)
+                new_host = self.rng.choice(self.slots)
                 new_host.host = True
-                logging.info("{} chosen as new host in game {}".format(client.sid, self.uuid))
+                self.invalidate_game_info()
+                logger.info("%s chosen as new host in game %s", client.sid, self.uuid)
 
             # Notify other clients
             await self.notify_game()
@@ -204,10 +405,51 @@ class Game:
             await self.notify_lobby()
 
             # Dispose room if everyone left
-            if self.is_empty:
+            if self.is_empty and not self.disposing:
                 await self.dispose()
 
-        logging.info("{} left game {}".format(client.sid, self.uuid))
+        logger.info("%s left game %s", client.sid, self.uuid)
+
+    def add_instruction(self, instruction):
+        """
+        Adds `instruction` to the active instructions and indexes it
+        :param instruction: `Instruction` object
+        :return:
+        """
+        self.instructions.add(instruction)
+        self.instructed_commands[instruction.target_command] += 1
+        if issubclass(type(instruction.target_command), SpecialCommand):
+            self.instructions_by_special_command[type(instruction.target_command)].append(instruction)
+        else:
+            self.instructions_by_command_name.setdefault(instruction.target_command.name, []).append(instruction)
+
+    def remove_instruction(self, instruction):
+        """
+        Removes `instruction` from the active instructions, if present
+        :param instruction: `Instruction` object
+        :return: `True` if it was an active instruction, `False` otherwise
+        """
+        if instruction not in self.instructions:
+            return False
+        self.instructions.remove(instruction)
+        self.instructed_commands[instruction.target_command] -= 1
+        if self.instructed_commands[instruction.target_command] <= 0:
+            del self.instructed_commands[instruction.target_command]
+        if issubclass(type(instruction.target_command), SpecialCommand):
+            self.instructions_by_special_command[type(instruction.target_command)].remove(instruction)
+        else:
+            bucket = self.instructions_by_command_name[instruction.target_command.name]
+            bucket.remove(instruction)
+            if not bucket:
+                del self.instructions_by_command_name[instruction.target_command.name]
+        return True
+
+    def clear_instructions(self):
+        self.instructions.clear()
+        self.instructed_commands.clear()
+        self.instructions_by_command_name.clear()
+        for bucket in self.instructions_by_special_command.values():
+            bucket.clear()
 
     @property
     def sio_room(self):
@@ -219,15 +461,26 @@ class Game:
 
     async def notify_lobby(self):
         if self.public:
-            await Sio().emit("lobby_info", self.sio_lobby_info(), room="lobby")
+            LobbyManager().update_lobby_game(self.sio_lobby_info())
 
     async def notify_game(self):
-        await Sio().emit("game_info", self.sio_game_info(), room=self.sio_room)
+        await EmitCoalescer().emit("game_info", self.game_info_payload(), room=self.sio_room)
+
+    def game_info_payload(self):
+        """
+        Returns the `game_info` event payload, serialized once.
+        Call `invalidate_game_info` after changing the name, size, visibility or the slots.
+        :return: `RawJSON` object
+        """
+        if self._game_info_payload is None:
+            self._game_info_payload = json_backend.encode(self.sio_game_info())
+        return self._game_info_payload
+
+    def invalidate_game_info(self):
+        self._game_info_payload = None
 
     async def notify_lobby_dispose(self):
-        await Sio().emit("lobby_disposed", {
-            "game_id": self.uuid
-        }, room="lobby")
+        LobbyManager().remove_lobby_game(self.uuid)
 
     def sio_lobby_info(self):
         return {
@@ -238,9 +491,77 @@ class Game:
             "public": self.public
         }
 
+    @property
+    def resumable(self):
+        """
+        :return: `True` if players who lose their socket keep their slot for `RECONNECT_TIMEOUT` seconds
+        """
+        return self.playing and self.finished_at is None and not self.disposing and Config()["RECONNECT_TIMEOUT"] > 0
+
+    async def detach_client(self, client):
+        """
+        Keeps the slot of a client whose socket is gone, so it can resume its session from a new one.
+        The game goes on meanwhile. If the client doesn't come back in time, it leaves the game.
+        :param client: `Client` object, in this game and no longer in `ClientManager`
+        :return:
+        """
+        if self.get_slot(client) is None:
+            raise ValueError("Client not in match")
+        Sio().leave_room(client.sid, self.sio_room)
+        # No socket anywhere anymore, like the sessions restored from a snapshot
+        client.worker_id = Config()["WORKER_ID"]
+        Sessions().detach(client, Config()["RECONNECT_TIMEOUT"])
+        EventLog().record(self, event_log.DETACH, client.uid)
+        await Sio().emit("player_detached", {"uid": client.uid}, room=self.sio_room)
+        logger.info("%s lost its socket in game %s, holding its slot", client.sid, self.uuid)
+
+    async def resume_client(self, client):
+        """
+        Brings back a client whose session has been resumed from a new socket (see `singletons.sessions`),
+        sending it the current state of the game in a `resync` event
+        :param client: `Client` object, already in a slot of this game
+        :return:
+        """
+        slot = self.get_slot(client)
+        if slot is None:
+            raise ValueError("Client not in match")
+        if self.paused:
+            self.resume_timers()
+        Sio().enter_room(client.sid, self.sio_room)
+        EventLog().record(self, event_log.RESUME, client.uid)
+        await Sio().emit("resync", self.sio_resync_info(slot), room=client.sid)
+        await Sio().emit("player_resumed", {"uid": client.uid}, room=self.sio_room, skip_sid=client.sid)
+        Metrics().resumed_sessions.inc()
+        logger.info("%s resumed its session in game %s", client.sid, self.uuid)
+
+    def sio_resync_info(self, slot):
+        remaining = slot.next_generation_timer.remaining if slot.next_generation_timer is not None else None
+        return {
+            "uid": slot.client.uid,
+            "token": slot.client.token,
+            "game": self.sio_game_info(),
+            "playing": self.playing,
+            "over": self.finished_at is not None,
+            "level": self.level,
+            "intro_done": slot.intro_done,
+            "health": {
+                "health": self.health,
+                "death_limit": self.death_limit
+            },
+            # Grids are sent once everyone has played the intro (see `intro_done_all`)
+            "grid": (
+                slot.grid.to_payload() if self.playing and slot.grid is not None and all(x.intro_done for x in self.slots)
+                else None
+            ),
+            "command": (
+                slot.instruction.to_payload(remaining) if slot.instruction is not None and remaining is not None
+                else None
+            ),
+        }
+
     def sio_game_info(self):
         return {**self.sio_lobby_info(), **{
-            "slots": [x.sio_slot_info() for x in self.slots] + [None] * (self.max_players - len(self.slots))
+            "slots": [x.to_payload() for x in self.slots] + [None] * (self.max_players - len(self.slots))
         }}
 
     def get_host(self):
@@ -279,6 +600,8 @@ class Game:
         if public is not None:
             self.public = public
             visibility_changed = True
+        self.invalidate_game_info()
+        EventLog().record(self, event_log.SETTINGS, self.max_players, self.public)
         await self.notify_game()
 
         if self.public:
@@ -301,7 +624,11 @@ class Game:
         if slot is None:
             raise ValueError("Client not in match")
         slot.ready = not slot.ready
+        self.invalidate_game_info()
+        EventLog().record(self, event_log.READY, client.uid)
         await self.notify_game()
+        if self.auto_start and len(self.slots) == self.max_players and all(x.ready for x in self.slots):
+            await self.start()
 
     async def start(self):
         """
@@ -311,6 +638,7 @@ class Game:
         if len(self.slots) > 1 and all([x.ready for x in self.slots]) or Config()["SINGLE_PLAYER"]:
             # Game starts
             self.playing = True
+            EventLog().record(self, event_log.START)
 
             # Remove game from lobby
             await self.notify_lobby_dispose()
@@ -318,7 +646,8 @@ class Game:
             # First level
             await self.next_level()
 
-            # Notify all clients
+            # Notify all clients, sending any pending game_info first
+            await EmitCoalescer().flush(self.sio_room)
             await Sio().emit("game_started", room=self.sio_room)
         else:
             raise RuntimeError("Conditions not met for game to start")
@@ -329,18 +658,14 @@ class Game:
         sets game modifiera and generates new grids
         :return:
         """
-        # Stop drain loop task
-        if self.health_drain_task is not None:
-            self.health_drain_task.cancel()
+        # Stop warmup, health drain, game modifier and command generation timers
+        self.cancel_timers()
 
-        # Stop game modifier task
-        if self.game_modifier_task is not None:
-            self.game_modifier_task.cancel()
+        # Instructions of the previous level point to the old grids
+        self.clear_instructions()
 
-        # Stop all command generation loop tasks
-        for slot in self.slots:
-            if slot.next_generation_task is not None:
-                slot.next_generation_task.cancel()
+        # Pending health updates are about the previous level
+        EmitCoalescer().discard(self.sio_room, "health_info")
 
         # Go to next level
         self.level += 1
@@ -352,7 +677,7 @@ class Game:
         # Change difficulty settings if this is not the first level
         if self.level > 0:
             # Remove any eventual game modifier difficulty changes
-            logging.debug("VANILLA DIFF: {}".format(self.vanilla_difficulty))
+            logger.debug("VANILLA DIFF: %s", self.vanilla_difficulty)
             self.difficulty = self.vanilla_difficulty
 
             self.difficulty["instructions_time"] = max(7.0, self.difficulty["instructions_time"] - 1.25)
@@ -376,19 +701,23 @@ class Game:
             #         self.difficulty["useless_command_health_decrease"] + 0.1
             #     )
             self.difficulty["game_modifier_chance"] = min(1.0, self.difficulty["game_modifier_chance"] + 0.25)
-            logging.debug("Current difficulty: {}".format(self.difficulty))
+            logger.debug("Current difficulty: %s", self.difficulty)
 
             # Game modifiers
-            if random.random() < self.difficulty["game_modifier_chance"]:
+            if self.rng.random() < self.difficulty["game_modifier_chance"]:
                 self.previous_game_modifier = self.game_modifier
-                cls = random.choice(
+                cls = self.rng.choice(
                     list(filter(
                         lambda x: x != self.previous_game_modifier,
-                        [Symbols, FlipGrid, AsteroidsField, BlackHolesField, Alien]
+                        GAME_MODIFIERS.values()
                     ))
                 )
                 self.game_modifier = cls(self)
 
+        EventLog().record(
+            self, event_log.LEVEL, self.level, type(self.game_modifier).__name__ if self.game_modifier is not None else ""
+        )
+
         # Set all `intro done` to false
         for i in self.slots:
             i.intro_done = False
@@ -400,9 +729,72 @@ class Game:
         # Generate grids
         await self.generate_grids()
 
-        # Start game modifier task if needed
-        if self.game_modifier is not None:
-            self.game_modifier_task = asyncio.Task(self.game_modifier.task())
+        # Start game modifier ticks if needed
+        if self.game_modifier is not None and self.game_modifier.TICK_RATE is not None:
+            self.game_modifier_timer = Scheduler().call_every(
+                self.game_modifier.TICK_RATE,
+                self.game_modifier.tick,
+                delay=0
+            )
+
+    def cancel_timers(self):
+        """
+        Cancels all scheduled timers of this match and its slots
+        :return:
+        """
+        for timer in self.timers():
+            if timer is not None:
+                timer.cancel()
+        if self.abandon_timer is not None:
+            self.abandon_timer.cancel()
+            self.abandon_timer = None
+
+    def timers(self):
+        """
+        :return: iterator of the game timers of this match and its slots, `None` for those not scheduled
+        """
+        yield self.warmup_timer
+        yield self.health_drain_timer
+        yield self.game_modifier_timer
+        for slot in self.slots:
+            yield from slot.timers()
+
+    def pause_timers(self, timeout):
+        """
+        Pauses the timers of this match (warmup, health drain, game modifier, instruction expiries) until one of its
+        players resumes its session, see `resume_timers`. The match is disposed if nobody does within `timeout` seconds.
+        :param timeout: seconds to wait for a player
+        :return:
+        """
+        self.paused = True
+        for timer in self.timers():
+            if timer is not None:
+                timer.pause()
+        self.abandon_timer = Scheduler().call_later(timeout, self.abandon)
+
+    def resume_timers(self):
+        """
+        Restarts the timers paused by `pause_timers`, with the time they had left
+        :return:
+        """
+        self.paused = False
+        if self.abandon_timer is not None:
+            self.abandon_timer.cancel()
+            self.abandon_timer = None
+        for timer in self.timers():
+            if timer is not None:
+                timer.resume()
+
+    async def abandon(self):
+        """
+        Disposes this match, none of its players came back after a restart (see `pause_timers`)
+        :return:
+        """
+        self.abandon_timer = None
+        if not self.paused or self.disposing:
+            return
+        logger.info("Nobody resumed restored game %s, disposing it", self.uuid)
+        await self.dispose()
 
     async def generate_grids(self):
         """
@@ -411,10 +803,10 @@ class Game:
         """
         if not self.playing:
             raise RuntimeError("Game not in progress!")
-        name_generator = CommandNameGenerator()
+        name_generator = CommandNameGenerator(rng=self.rng)
 
         for slot in self.slots:
-            g = Grid(name_generator, slot.role)
+            g = Grid(name_generator, slot.role, rng=self.rng)
 
             # Game modifier post processor if needed
             if self.game_modifier is not None:
@@ -422,6 +814,7 @@ class Game:
                     self.game_modifier.grid_post_processor(g)
                 except NotImplementedError:
                     pass
+                g.invalidate_payload()
 
             slot.grid = g
 
@@ -440,6 +833,7 @@ class Game:
 
         # This client has played the intro
         slot.intro_done = True
+        EventLog().record(self, event_log.INTRO_DONE, client.uid)
 
         # Check if everyone has played the intro
         for i in self.slots:
@@ -455,7 +849,7 @@ class Game:
         """
         # Notify each client about their grid if eveyone has completed intro
         for slot in self.slots:
-            await Sio().emit("grid", slot.grid.__dict__(), room=slot.client.sid)
+            await Sio().emit("grid", slot.grid.payload(), room=slot.client.sid)
 
         # Warmup dummy instruction
         warmup_time = max(int(self.difficulty["instructions_time"] / 5), 3)
@@ -465,22 +859,26 @@ class Game:
         }, room=self.sio_room)
 
         # Wait until the dummy instruction expires
-        await asyncio.sleep(warmup_time)
+        self.warmup_timer = Scheduler().call_later(warmup_time, self.warmup_done)
 
+    async def warmup_done(self):
+        """
+        Called when the warmup dummy instruction expires.
+        Generates the first command for each slot and starts the health drain timer
+        :return:
+        """
         # Generate first command for each slot, starting the regeneration loop as well
         for slot in self.slots:
             await self.generate_instruction(slot)
 
-        # Star the health drain task too
-        self.health_drain_task = asyncio.Task(self.health_drain_loop())
+        # Start the health drain timer too
+        self.health_drain_timer = Scheduler().call_every(self.HEALTH_LOOP_RATE, self.drain_health)
 
-    async def generate_instruction(self, slot, expired=None, stop_old_task=True):
+    async def generate_instruction(self, slot, expired=None):
         """
-        Generates and sets a valid and unique Instruction for `Slot` and schedules
-        an asyncio Task to run
+        Generates and sets a valid and unique Instruction for `Slot` and (re)schedules
+        its expiry timer
         :param slot: `Slot` object that will be the target of that instruction
-        :param stop_old_task: if `True`, stop the old generation task.
-                              Set to `False` if running in the generation loop, `True` if calling from outside the loop.
         :param expired: Send this to the client with the new instruction.
                         If `True`, the old instruction expired.
                         If `False`, the old instruction was successful.
@@ -488,19 +886,16 @@ class Game:
                         The client will play sounds and visual fx accordingly.
         :return:
         """
-        # Stop the old next generation task if needed
-        if slot.next_generation_task is not None and stop_old_task:
-            slot.next_generation_task.cancel()
         old_instruction = slot.instruction
 
         # Choose between an asteroid/black hole or normal command
         command = None
-        if random.random() < self.difficulty["asteroid_chance"] and slot.special_command_cooldown <= 0:
+        if self.rng.random() < self.difficulty["asteroid_chance"] and slot.special_command_cooldown <= 0:
             # Asteroid, force target and command
             target = None
             command = DummyAsteroidCommand()
             slot.special_command_cooldown = self.difficulty["special_command_cooldown"] + 1
-        elif random.random() < self.difficulty["black_hole_chance"] and slot.special_command_cooldown <= 0:
+        elif self.rng.random() < self.difficulty["black_hole_chance"] and slot.special_command_cooldown <= 0:
             # Black hole, force target and command
             target = None
             command = DummyBlackHoleCommand()
@@ -513,96 +908,109 @@ class Game:
             # Choose a random slot and a random command.
             # We don't do this in `Instruction` because we need to access
             # match's properties and passing match and next_levelinstruction to `Instruction` is not elegant imo
-            if random.randint(0, 5) == 0:
+            # Filter out our slot and the players who lost their socket, they can't do anything in their grid
+            others = [z for z in self.slots if z != slot and not z.detached]
+            if self.rng.randint(0, 5) == 0 or not others:
                 # 1/5 chance of getting a command in our grid
                 target = slot
             else:
-                # Filter out our slot and chose another one randomly
-                target = random.choice(list(filter(lambda z: z != slot, self.slots)))
+                # Chose another one randomly
+                target = self.rng.choice(others)
 
         # Decrease special command cooldown
         slot.special_command_cooldown = max(0, slot.special_command_cooldown - 1)
-        logging.debug("SPECIAL {}".format(slot.special_command_cooldown))
+        logger.debug("SPECIAL %s", slot.special_command_cooldown)
 
         # Generate a command if needed
         if command is None:
             # Find a random command that is not used in any other instructions at the moment and is not the same as the
             # previous one
-            valid_command = False
-            while not valid_command:
-                valid_command = True
-                command = random.choice(target.grid.objects)
-                print(self.instructions + [slot.instruction])
-                print(slot.instruction)
-                for x in self.instructions + [slot.instruction]:
-                    # x is `None` if slot.instructions is None (first generation)
-                    if x is not None and x.target_command == command:
-                        valid_command = False
-                        break
+            candidates = [
+                x for x in target.grid.objects
+                if x not in self.instructed_commands
+                and (old_instruction is None or x is not old_instruction.target_command)
+            ]
+            command = self.rng.choice(candidates if candidates else target.grid.objects)
 
         # Set this slot's instruction and notify the client
-        slot.instruction = Instruction(slot, target, command)
+        slot.instruction = Instruction(slot, target, command, self.rng)
+        EventLog().record(
+            self, event_log.INSTRUCTION, slot.client.uid, target.client.uid if target is not None else None,
+            slot.instruction.command_name, slot.instruction.value
+        )
 
         # Add new one
-        self.instructions.append(slot.instruction)
+        self.add_instruction(slot.instruction)
+        Metrics().instructions_generated.inc()
 
         # Notify the client about the new command and the status of the old command
-        await Sio().emit("command", {
-            "text": slot.instruction.text,
-            "time": self.difficulty["instructions_time"],
-            "expired": expired,
-        }, room=slot.client.sid)
+        await Sio().emit(
+            "command", slot.instruction.to_payload(self.difficulty["instructions_time"], expired), room=slot.client.sid
+        )
 
         if old_instruction is not None and issubclass(type(old_instruction.target_command), SpecialCommand):
             await Sio().emit("safe", room=self.sio_room)
 
-        # Schedule a new generation
-        slot.next_generation_task = asyncio.Task(self.schedule_generation(slot, self.difficulty["instructions_time"]))
+        # Schedule a new generation, moving the old expiry if there's one
+        if slot.next_generation_timer is None:
+            slot.next_generation_timer = Scheduler().call_later(
+                self.difficulty["instructions_time"],
+                self.expire_instruction,
+                slot
+            )
+        else:
+            slot.next_generation_timer.reschedule(self.difficulty["instructions_time"])
 
-    async def schedule_generation(self, slot, seconds):
+    async def expire_instruction(self, slot):
         """
-        Executes a new instruction generation for `slot` after `seconds` have passed
+        Called by `slot`'s generation timer when its instruction expires.
+        Drains health and generates a new instruction.
         :param slot: `Slot` object that will receive the `Instruction`
-        :param seconds: number of seconds to wait
         :return:
         """
-        await asyncio.sleep(seconds)
-
         # Remove expired instruction
-        if slot.instruction in self.instructions:
-            self.instructions.remove(slot.instruction)
+        self.remove_instruction(slot.instruction)
+        Metrics().instructions_expired.inc()
+        EventLog().record(self, event_log.EXPIRE, slot.client.uid)
 
         # Drain health
         self.health -= self.difficulty["expired_command_health_decrease"]
 
         # Generate a new instruction
-        await self.generate_instruction(slot, expired=True, stop_old_task=False)  # if True, it would stop itself :|
-
-    async def health_drain_loop(self):
-        while True:
-            # Drain health every two seconds
-            await asyncio.sleep(self.HEALTH_LOOP_RATE)
-            self.health -= self.difficulty["health_drain_rate"] * self.HEALTH_LOOP_RATE
-            self.death_limit = min(
-                90,
-                self.death_limit + self.difficulty["death_limit_increase_rate"] * self.HEALTH_LOOP_RATE
-            )
-            logging.debug("Draining health, new value {} and death limit is {}".format(self.health, self.death_limit))
+        await self.generate_instruction(slot, expired=True)
 
-            if self.health <= self.death_limit:
-                # Game over
-                await self.game_over()
-                break
-            else:
-                # Game still in progress, broadcast new health
-                await self.notify_health()
+    async def drain_health(self):
+        """
+        Called by the health drain timer every `HEALTH_LOOP_RATE` seconds
+        :return:
+        """
+        self.health -= self.difficulty["health_drain_rate"] * self.HEALTH_LOOP_RATE
+        self.death_limit = min(
+            90,
+            self.death_limit + self.difficulty["death_limit_increase_rate"] * self.HEALTH_LOOP_RATE
+        )
+        logger.debug("Draining health, new value %s and death limit is %s", self.health, self.death_limit)
+        EventLog().record(self, event_log.HEALTH, self.health, self.death_limit)
+
+        if self.health <= self.death_limit:
+            # Game over
+            self.health_drain_timer.cancel()
+            await self.game_over()
+        else:
+            # Game still in progress, broadcast new health
+            await self.notify_health()
 
     async def game_over(self):
+        # Stop generating instructions, the game is disposed by the reaper or when everyone leaves
+        self.finished_at = Scheduler().time()
+        self.cancel_timers()
+        EventLog().record(self, event_log.GAME_OVER, self.level)
+        await EmitCoalescer().flush(self.sio_room)
         await Sio().emit("game_over", room=self.sio_room)
-        logging.info("{} game over".format(self.uuid))
+        logger.info("%s game over at level %s (seed %s)", self.uuid, self.level, self.seed)
 
     async def notify_health(self):
-        await Sio().emit("health_info", {
+        await EmitCoalescer().emit("health_info", {
             "health": self.health,
             "death_limit": self.death_limit
         }, room=self.sio_room)
@@ -623,10 +1031,7 @@ class Game:
             raise ValueError("Client not in match")
 
         # Make sure the command is valid
-        command = None
-        for c in slot.grid.objects:
-            if c.name == command_name:
-                command = c
+        command = slot.grid.get_object(command_name)
         if command is None:
             raise ValueError("Command not found")
 
@@ -640,6 +1045,8 @@ class Game:
         elif type(command) is Switch and type(value) is not bool:
             raise ValueError("Invalid value, must be a bool")
 
+        EventLog().record(self, event_log.COMMAND, client.uid, command_name, value)
+
         # Update status if it's a slider or switch
         if issubclass(type(command), SliderLikeElement):
             command.value = value
@@ -648,9 +1055,8 @@ class Game:
 
         # Check if this command completes an instruction
         instruction_completed = None
-        for instruction in self.instructions:
-            if issubclass(type(instruction.target_command), GridElement) \
-                    and instruction.target_command.name == command_name and instruction.value == value:
+        for instruction in self.instructions_by_command_name.get(command_name, ()):
+            if instruction.value == value:
                 instruction_completed = instruction
 
         if instruction_completed is None:
@@ -662,8 +1068,11 @@ class Game:
         await self.complete_instruction(instruction_completed)
 
     async def complete_instruction(self, instruction_completed, increase_health=True):
-        # Remove old instruction
-        self.instructions.remove(instruction_completed)
+        # Remove old instruction. Already gone if the level changed while completing a previous one
+        # (e.g. several asteroid instructions), don't replace it then.
+        if not self.remove_instruction(instruction_completed):
+            return
+        Metrics().instructions_completed.inc()
 
         # Increase health if needed
         if increase_health:
@@ -679,7 +1088,7 @@ class Game:
             }, room=self.sio_room)
         else:
             # This was an useful command! Force new generation outside the loop
-            await self.generate_instruction(instruction_completed.source, expired=False, stop_old_task=True)
+            await self.generate_instruction(instruction_completed.source, expired=False)
             await self.notify_health()
 
     async def dispose(self):
@@ -691,31 +1100,22 @@ class Game:
         if self.disposing:
             raise RuntimeError("The match is already disposing")
         self.disposing = True
+        EventLog().record(self, event_log.DISPOSE)
 
-        # Cancel all pending next generation tasks
-        for slot in self.slots:
-            if slot.next_generation_task is not None:
-                logging.debug("slot {} generation task cancelled".format(slot))
-                slot.next_generation_task.cancel()
-
-        # Cancel health drain task too
-        if self.health_drain_task is not None:
-            logging.debug("Health drain task cancelled")
-            self.health_drain_task.cancel()
-
-        # Also game modifier task
-        if self.game_modifier_task is not None:
-            logging.debug("Game modifier task cancelled")
-            self.game_modifier_task.cancel()
+        # Cancel all pending timers (generation, health drain, game modifier...)
+        self.cancel_timers()
+        EmitCoalescer().discard(self.sio_room)
+        logger.debug("%s timers cancelled", self.uuid)
 
-        # Make everyone leave the game
-        for slot in self.slots:
+        # Make everyone leave the game (`leave_game` removes the slot from `self.slots`)
+        for slot in list(self.slots):
+            Sessions().cancel(slot.client.token)
             await slot.client.leave_game()
 
         # Remove from lobby
         await LobbyManager().remove_game(self)
 
-        logging.info("{} match disposed".format(self.uuid))
+        logger.info("%s match disposed", self.uuid)
 
     async def defeat_special(self, client, black_hole=False):
         # Playing/player checks
@@ -725,6 +1125,8 @@ class Game:
         if slot is None:
             raise ValueError("Client not in match")
 
+        EventLog().record(self, event_log.DEFEAT, client.uid, black_hole)
+
         # Defeat thing
         if black_hole:
             slot.defeating_black_hole = True
@@ -734,28 +1136,38 @@ class Game:
         # Check if everyone is defeating
         all_defeated = True
         for s in self.slots:
+            if s.detached:
+                # Away, the others can defeat it without them
+                continue
             if (not s.defeating_black_hole and black_hole) or (not s.defeating_asteroid and not black_hole):
                 all_defeated = False
                 break
 
         # Everyone has defeated asteroid/black hole!
         if all_defeated:
-            logging.debug("All defeated!")
+            logger.debug("All defeated!")
 
             # Check if there's a special command (we may have more than once)
-            instructions_completed = []
-            for instruction in self.instructions:
-                if (type(instruction.target_command) is DummyBlackHoleCommand and black_hole) \
-                        or (type(instruction.target_command) is DummyAsteroidCommand and not black_hole):
-                    instructions_completed.append(instruction)
+            instructions_completed = list(self.instructions_by_special_command[
+                DummyBlackHoleCommand if black_hole else DummyAsteroidCommand
+            ])
 
-            # Complete all instructions (two loops because we're removing items from self.instructions)
+            # Complete all instructions (copied because we're removing items from the index)
             for instruction in instructions_completed:
-                logging.debug("SPECIAL DONE!")
+                logger.debug("SPECIAL DONE!")
                 await self.complete_instruction(instruction, increase_health=False)
 
-        # Reset defeating back to False after two seconds
-        asyncio.Task(slot.reset_black_hole() if black_hole else slot.reset_asteroid())
-
-
-
+        # Reset defeating back to False after two seconds, postponing the reset if it's already scheduled
+        if black_hole:
+            if slot.reset_black_hole_timer is None:
+                slot.reset_black_hole_timer = Scheduler().call_later(
+                    self.SPECIAL_COMMAND_RESET_TIME,
+                    slot.reset_black_hole
+                )
+            else:
+                slot.reset_black_hole_timer.reschedule(self.SPECIAL_COMMAND_RESET_TIME)
+        else:
+            if slot.reset_asteroid_timer is None:
+                slot.reset_asteroid_timer = Scheduler().call_later(self.SPECIAL_COMMAND_RESET_TIME, slot.reset_asteroid)
+            else:
+                slot.reset_asteroid_timer.reschedule(self.SPECIAL_COMMAND_RESET_TIME)
@@ -1,19 +1,20 @@
-import asyncio
 import logging
-import random
 import string
 
 from singletons.sio import Sio
 
+logger = logging.getLogger(__name__)
+
 
 class GameModifier:
     DESCRIPTION = ""
+    TICK_RATE = None    # seconds between two `tick` calls, `None` if this modifier doesn't tick
 
     def __init__(self, match):
         self.match = match
 
-    async def task(self):
-        raise asyncio.CancelledError()
+    async def tick(self):
+        return
 
     def grid_post_processor(self, grid):
         return
@@ -24,13 +25,12 @@ class GameModifier:
 
 class FlipGrid(GameModifier):
     DESCRIPTION = "Reflection matrix activated!"
+    TICK_RATE = 8
 
-    async def task(self):
-        while True:
-            logging.debug("Screen filp")
-            if random.getrandbits(1):
-                await Sio().emit("flip_grid", room=self.match.sio_room)
-            await asyncio.sleep(8)
+    async def tick(self):
+        logger.debug("Screen filp")
+        if self.match.rng.getrandbits(1):
+            await Sio().emit("flip_grid", room=self.match.sio_room)
 
 
 class Symbols(GameModifier):
@@ -43,10 +43,10 @@ class Symbols(GameModifier):
         # At least 2 commands with symbols
         while total_symbols < 2:
             for o in grid.objects:
-                if random.randrange(0, 2) == 0:
+                if self.match.rng.randrange(0, 2) == 0:
                     total_symbols += 1
                     o.additional_data["symbol"] = True
-                    o.name = random.choice(available_symbols)
+                    grid.rename_object(o, self.match.rng.choice(available_symbols))
                     available_symbols.remove(o.name)
 
 
@@ -59,7 +59,7 @@ class Alien(GameModifier):
         # At least 2 commands with wrong name
         while total_alien == 0:
             for o in grid.objects:
-                if random.randrange(0, 2) == 0:
+                if self.match.rng.randrange(0, 2) == 0:
                     total_alien += 1
                     o.additional_data["alien"] = True
                 if total_alien >= 2:
@@ -70,7 +70,7 @@ class AsteroidsField(GameModifier):
     DESCRIPTION = "Incoming asteroid field!"
 
     def difficulty_post_processor(self, diff):
-        print(diff)
+        logger.debug("Asteroids field, difficulty before: %s", diff)
         diff["asteroid_chance"] *= 3
         diff["black_hole_chance"] /= 2
         diff["special_command_cooldown"] //= 2
@@ -81,7 +81,7 @@ class BlackHolesField(GameModifier):
     DESCRIPTION = "Incoming black holes!"
 
     def difficulty_post_processor(self, diff):
-        print(diff)
+        logger.debug("Black holes field, difficulty before: %s", diff)
         diff["black_hole_chance"] *= 3
         diff["asteroid_chance"] /= 2
         diff["special_command_cooldown"] //= 2
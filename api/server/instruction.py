@@ -4,16 +4,78 @@ import random
 from utils.grid import Button, SliderLikeElement, Switch, Actions, GridElement
 from utils.special_commands import DummyBlackHoleCommand, DummyAsteroidCommand, SpecialCommand
 
+# `Instruction.snapshot` command names of special commands, never used as grid command names
+SPECIAL_ASTEROID = ":asteroid"
+SPECIAL_BLACK_HOLE = ":black_hole"
+
 
 class Instruction:
-    def __init__(self, source, target, target_command):
+    __slots__ = ("source", "target", "target_command", "value", "text")
+
+    def __init__(self, source, target, target_command, rng=random):
         self.source = source
         self.target = target
         self.target_command = target_command
-        self.value = self.generate_value()  # new value to set the target command to. Only for sliders/switches
-        self.text = self.generate_text()    # instruction text, visible to the client
+        self.value = self.generate_value(rng)   # new value to set the target command to. Only for sliders/switches
+        self.text = self.generate_text(rng)     # instruction text, visible to the client
+
+    def to_payload(self, time, expired=None):
+        """
+        :param time: seconds to complete the instruction
+        :param expired: whether the previous instruction expired, `None` if there wasn't one
+        :return: dict sent to the source client in the `command` event
+        """
+        return {
+            "text": self.text,
+            "time": time,
+            "expired": expired,
+        }
+
+    @property
+    def command_name(self):
+        """
+        :return: name of the target command, `SPECIAL_ASTEROID` or `SPECIAL_BLACK_HOLE` for special commands
+        """
+        if type(self.target_command) is DummyAsteroidCommand:
+            return SPECIAL_ASTEROID
+        if type(self.target_command) is DummyBlackHoleCommand:
+            return SPECIAL_BLACK_HOLE
+        return self.target_command.name
+
+    def snapshot(self, slots):
+        """
+        :param slots: `Slot` objects of the game
+        :return: JSON serializable state of this instruction, restored with `Instruction.restore`
+        """
+        return {
+            "source": slots.index(self.source),
+            "target": slots.index(self.target) if self.target is not None else None,
+            "command": self.command_name,
+            "value": self.value,
+            "text": self.text,
+        }
+
+    @classmethod
+    def restore(cls, data, slots):
+        """
+        :param data: `Instruction.snapshot` dict
+        :param slots: restored `Slot` objects of the game, with their grids
+        :return: `Instruction` object
+        """
+        instruction = cls.__new__(cls)
+        instruction.source = slots[data["source"]]
+        instruction.target = slots[data["target"]] if data["target"] is not None else None
+        if data["command"] == SPECIAL_ASTEROID:
+            instruction.target_command = DummyAsteroidCommand()
+        elif data["command"] == SPECIAL_BLACK_HOLE:
+            instruction.target_command = DummyBlackHoleCommand()
+        else:
+            instruction.target_command = instruction.target.grid.get_object(data["command"])
+        instruction.value = data["value"]
+        instruction.text = data["text"]
+        return instruction
 
-    def generate_value(self):
+    def generate_value(self, rng=random):
         if type(self.target_command) is Button:
             # No extra actions required for buttons
             return None
@@ -22,14 +84,14 @@ class Instruction:
             return None
         elif issubclass(type(self.target_command), SliderLikeElement):
             # For slider-like elements, pick a new random value between min and max, excluding the current one
-            return random.choice([x for x in range(self.target_command.min, self.target_command.max + 1) if x != self.target_command.value])
+            return rng.choice([x for x in range(self.target_command.min, self.target_command.max + 1) if x != self.target_command.value])
         elif type(self.target_command) is Switch:
             # If it's a switch, flip it
             return not self.target_command.toggled
         elif type(self.target_command) is Actions:
-            return random.choice(self.target_command.actions)
+            return rng.choice(self.target_command.actions)
 
-    def generate_text(self):
+    def generate_text(self, rng=random):
         if type(self.target_command) is Button:
             sentences = [
                 "Operate {name}",
@@ -75,7 +137,7 @@ class Instruction:
             raise ValueError("Invalid command type")
 
         # Choose a random sentence form the possible ones and format it
-        sentence = random.choice(sentences)
+        sentence = rng.choice(sentences)
         if issubclass(type(self.target_command), GridElement):
             if "symbol" in self.target_command.additional_data:
                 name = "${}".format(self.target_command.name)
@@ -1,4 +1,5 @@
 import server.client
+from singletons.config import Config
 from utils.singleton import singleton
 
 
@@ -6,7 +7,9 @@ from utils.singleton import singleton
 class ClientManager:
     def __init__(self):
         self._clients_by_sid = {}
-        self._uid = 0
+        # uids are unique across workers: worker n generates n, n + WORKERS, n + 2 * WORKERS...
+        self._uid = Config()["WORKER_ID"]
+        self._uid_step = Config()["WORKERS"]
 
     def add_client(self, client):
         if type(client) is not server.client.Client:
@@ -22,9 +25,27 @@ class ClientManager:
             raise KeyError("This client is not registered")
         del self._clients_by_sid[client.sid]
 
+    def items(self):
+        return self._clients_by_sid.items()
+
     def __getitem__(self, item):
         return self._clients_by_sid[item]
 
+    def __len__(self):
+        return len(self._clients_by_sid)
+
     def next_uid(self):
-        self._uid += 1
+        self._uid += self._uid_step
         return self._uid
+
+    @property
+    def last_uid(self):
+        return self._uid
+
+    def restore_uid(self, last_uid):
+        """
+        Continues generating uids after `last_uid`, so they don't collide with the ones of restored clients
+        :param last_uid: `last_uid` of a previous run of this worker
+        :return:
+        """
+        self._uid = max(self._uid, last_uid)
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import zlib
+
+from singletons.config import Config
+from utils import game_ids
+from utils.bus_client_manager import BusClientManager
+from utils.message_bus import make_message_bus
+from utils.singleton import singleton
+
+logger = logging.getLogger(__name__)
+
+
+def check_config():
+    """
+    Makes sure the multi-worker settings can work, so a bad configuration fails at startup
+    instead of silently losing the messages between workers
+    :return:
+    """
+    if Config()["WORKERS"] > 1 and Config()["MESSAGE_BUS"] == "local":
+        raise ValueError(
+            "MESSAGE_BUS=local only reaches the worker that publishes, it can't be used with WORKERS={}. "
+            "Use MESSAGE_BUS=socket.".format(Config()["WORKERS"])
+        )
+
+
+@singleton
+class Cluster:
+    """
+    Multi-worker support.
+    Every game lives in the worker chosen by its id (see `owner_of`). Clients connected to
+    another worker are represented in the owner worker by a proxy `Client` with the same sid,
+    their game events are forwarded to the owner through the message bus and the owner's emits
+    reach them through `BusClientManager`.
+    Cluster message handlers are registered with `on`, like sio event handlers (see server/__init__.py).
+    """
+
+    def __init__(self):
+        self.worker_id = Config()["WORKER_ID"]
+        self.workers = Config()["WORKERS"]
+        self.bus = None
+        self.sio_manager = None
+        self._messages = None
+        self._handlers = {}
+
+        if self.enabled:
+            check_config()
+            self.bus = make_message_bus(Config()["MESSAGE_BUS"], Config()["MESSAGE_BUS_ADDRESS"], hub=self.worker_id == 0)
+            self.sio_manager = BusClientManager(self.bus, owns_room=self.owns_room)
+
+    @property
+    def enabled(self):
+        return self.workers > 1
+
+    @property
+    def connected(self):
+        """
+        :return: whether this worker can reach the other ones (always `True` with a single worker)
+        """
+        return not self.enabled or self.bus.connected
+
+    async def start(self):
+        """
+        Connects to the message bus and starts routing events
+        :return:
+        """
+        if not self.enabled:
+            return
+        self._messages = asyncio.Queue()
+        self.bus.subscribe(self._on_message)
+        await self.bus.start()
+        asyncio.ensure_future(self._dispatch())
+
+        # Ask the other workers for their public games
+        self.publish("lobby_sync")
+        logger.info("Worker %s/%s ready", self.worker_id, self.workers)
+
+    def on(self, kind):
+        """
+        Decorator that registers a handler for cluster messages of type `kind`.
+        Handlers are called with the sender worker id and the message data as keyword arguments.
+        :param kind: message type
+        :return:
+        """
+        def decorator(f):
+            self._handlers[kind] = f
+            return f
+        return decorator
+
+    def on_reconnect(self, callback):
+        """
+        Decorator that registers a callback called when this worker is back on the message bus
+        after losing its connection. The callback is never called if running with a single worker.
+        :param callback: regular function without arguments
+        :return:
+        """
+        if self.enabled:
+            self.bus.on_reconnect(callback)
+        return callback
+
+    def owner_of(self, game_id):
+        """
+        Returns the id of the worker that hosts `game_id`.
+        Short codes are split between workers by value (see `utils.game_ids`), uuids by hash.
+        :param game_id: normalized game id
+        :return: worker id
+        """
+        if not self.enabled:
+            return self.worker_id
+        if not game_ids.is_uuid(game_id):
+            value = game_ids.decode(game_id)
+            if value is not None:
+                return value % self.workers
+        return zlib.crc32(game_id.encode()) % self.workers
+
+    def is_local(self, game_id):
+        return self.owner_of(game_id) == self.worker_id
+
+    def owns_room(self, room):
+        """
+        :param room: sio room name
+        :return: `True` if `room` is the room of a game hosted by this worker (see `Game.sio_room`),
+                 whose remote players are only put in it by this worker
+        """
+        return room.startswith("game/") and self.is_local(room[len("game/"):])
+
+    def publish(self, _type, to=None, **data):
+        """
+        Publishes a cluster message. Does nothing if running with a single worker.
+        :param _type: message type
+        :param to: destination worker id. If `None`, the message is sent to all the other workers.
+        :param data: message data
+        :return:
+        """
+        if not self.enabled:
+            return
+        self.bus.publish({"type": "cluster", "kind": _type, "from": self.worker_id, "to": to, "data": data})
+
+    def _on_message(self, message):
+        if message.get("type") != "cluster" or message["from"] == self.worker_id:
+            return
+        if message["to"] is not None and message["to"] != self.worker_id:
+            return
+        self._messages.put_nowait(message)
+
+    async def _dispatch(self):
+        while True:
+            message = await self._messages.get()
+            try:
+                await self._handlers[message["kind"]](message["from"], **message["data"])
+            except Exception:
+                logger.exception("Error while handling cluster message %s", message["kind"])
@@ -11,13 +11,96 @@ class Config:
             "DEBUG": config("DEBUG", default="0", cast=bool),
             "SINGLE_PLAYER": config("SINGLE_PLAYER", default="0", cast=bool),
 
+            # `text` or `json` (one JSON object per line). LOG_LEVEL defaults to DEBUG in debug mode, INFO otherwise.
+            "LOG_FORMAT": config("LOG_FORMAT", default="text"),
+            "LOG_LEVEL": config("LOG_LEVEL", default=None, cast=lambda x: None if x is None else x.upper()),
+
+            # Text wordlists directory and compiled wordlist, used if newer than the text files
+            "WORDS_DIR": config("WORDS_DIR", default="words"),
+            "WORDS_FILE": config("WORDS_FILE", default=os.path.join("words", "words.bin")),
+
+            # Seconds between two lobby updates (`lobby_delta` events), public games per `lobby_snapshot` page
+            "LOBBY_UPDATE_INTERVAL": config("LOBBY_UPDATE_INTERVAL", default=0.5, cast=float),
+            "LOBBY_PAGE_SIZE": config("LOBBY_PAGE_SIZE", default=50, cast=int),
+
+            # Seed of the random seeds of the games (see `Game.rng`). Unset picks random seeds, setting it makes the
+            # games created in the same order replay the same grids and instructions.
+            "GAME_SEED": config("GAME_SEED", default=None, cast=lambda x: None if x is None else int(x)),
+
+            # Length of the game codes players type to join private games (32^length codes split between workers)
+            "GAME_ID_LENGTH": config("GAME_ID_LENGTH", default=5, cast=int),
+
+            # Seconds between two reaper sweeps (0 disables it). Lobby games whose players haven't sent anything for
+            # GAME_IDLE_TTL seconds, games over for GAME_FINISHED_TTL seconds and clients not in a game idle for
+            # CLIENT_IDLE_TTL seconds are disposed/disconnected. A TTL of 0 disables that check.
+            "REAPER_INTERVAL": config("REAPER_INTERVAL", default=30, cast=float),
+            "GAME_IDLE_TTL": config("GAME_IDLE_TTL", default=600, cast=float),
+            "GAME_FINISHED_TTL": config("GAME_FINISHED_TTL", default=120, cast=float),
+            "CLIENT_IDLE_TTL": config("CLIENT_IDLE_TTL", default=1800, cast=float),
+
+            # Games are saved to SNAPSHOT_FILE on shutdown and restored on startup (disabled if empty). In multi-worker
+            # mode each worker uses its own file (`<name>.<worker id>.<ext>`). Players have RESUME_TIMEOUT seconds
+            # to reconnect to a restored game before they leave it.
+            "SNAPSHOT_FILE": config("SNAPSHOT_FILE", default=""),
+            "RESUME_TIMEOUT": config("RESUME_TIMEOUT", default=60, cast=float),
+            # Seconds a player who loses its connection during a game keeps its slot (0 ends the game right away)
+            "RECONNECT_TIMEOUT": config("RECONNECT_TIMEOUT", default=20, cast=float),
+
+            # Every game appends its events (joins, commands, instructions, health, levels...) to EVENT_LOG_FILE, in a
+            # compact binary format replayed with `python -m benchmark.replay` (disabled if empty). Events are written
+            # by a background thread every EVENT_LOG_FLUSH_INTERVAL seconds or when EVENT_LOG_BUFFER events are pending.
+            # The file is rotated when it gets bigger than EVENT_LOG_MAX_BYTES, keeping EVENT_LOG_BACKUPS old files.
+            # In multi-worker mode each worker uses its own file, like SNAPSHOT_FILE.
+            "EVENT_LOG_FILE": config("EVENT_LOG_FILE", default=""),
+            "EVENT_LOG_MAX_BYTES": config("EVENT_LOG_MAX_BYTES", default=16 * 1024 * 1024, cast=int),
+            "EVENT_LOG_BACKUPS": config("EVENT_LOG_BACKUPS", default=4, cast=int),
+            "EVENT_LOG_FLUSH_INTERVAL": config("EVENT_LOG_FLUSH_INTERVAL", default=1, cast=float),
+            "EVENT_LOG_BUFFER": config("EVENT_LOG_BUFFER", default=4096, cast=int),
+
+            # Game events accepted from each client per second and at once (token bucket), for commands and for
+            # asteroids/black holes. Events over the limit are dropped. A rate of 0 disables the limit.
+            "COMMAND_RATE_LIMIT": config("COMMAND_RATE_LIMIT", default=10, cast=float),
+            "COMMAND_BURST": config("COMMAND_BURST", default=20, cast=int),
+            "SPECIAL_RATE_LIMIT": config("SPECIAL_RATE_LIMIT", default=2, cast=float),
+            "SPECIAL_BURST": config("SPECIAL_BURST", default=4, cast=int),
+
+            # JSON library used for socket.io packets: `orjson`, `ujson`, `json` or `auto` (fastest one installed)
+            "JSON_BACKEND": config("JSON_BACKEND", default="auto"),
+
+            # Expose Prometheus metrics on /metrics
+            "METRICS": config("METRICS", default="1", cast=bool),
+
+            # Time socket.io handlers and watch the event loop. Handlers slower than PROFILE_SLOW_HANDLER seconds and
+            # loop stalls longer than PROFILE_LOOP_STALL seconds are logged with a stack sample.
+            # Reports are logged on SIGUSR1 and served on /admin/profile if ADMIN_TOKEN is set.
+            "PROFILE": config("PROFILE", default="0", cast=bool),
+            "PROFILE_SLOW_HANDLER": config("PROFILE_SLOW_HANDLER", default=0.05, cast=float),
+            "PROFILE_LOOP_STALL": config("PROFILE_LOOP_STALL", default=0.1, cast=float),
+            "ADMIN_TOKEN": config("ADMIN_TOKEN", default=None),
+
             "SIO_HOST": config("SIO_HOST", default="0.0.0.0"),
             "SIO_PORT": config("SIO_PORT", default=os.environ.get('PORT', 4433), cast=int),
 
             "SSL_CERT": config("SSL_CERT", default="cert.crt"),
             "SSL_KEY": config("SSL_KEY", default="key.key"),
+
+            # Multi-worker mode. All workers listen on SIO_PORT and games are split between them.
+            # Connections are spread between workers by the kernel, so only the websocket transport is accepted.
+            # /metrics and /admin/profile report on a single worker: worker N serves them on METRICS_PORT + N.
+            "WORKERS": config("WORKERS", default=1, cast=int),
+            "WORKER_ID": config("WORKER_ID", default=None, cast=lambda x: None if x is None else int(x)),
+            "MESSAGE_BUS": config("MESSAGE_BUS", default="socket"),     # `socket`, or `local` (single worker only)
+            "MESSAGE_BUS_ADDRESS": config("MESSAGE_BUS_ADDRESS", default="127.0.0.1:4434"),
+            "METRICS_PORT": config("METRICS_PORT", default=9433, cast=int),
+
+            # Seconds during which `health_info`/`game_info` updates to the same room are merged. 0 disables it.
+            "EMIT_COALESCE_WINDOW": config("EMIT_COALESCE_WINDOW", default=0.05, cast=float),
         }
 
+        if self._config["WORKERS"] == 1:
+            # Single worker, no need to spawn workers
+            self._config["WORKER_ID"] = 0
+
         if not self._config["DEBUG"]:
             # Force debug options to off if debug mode is off
             self._config["SINGLE_PLAYER"] = False
@@ -0,0 +1,73 @@
+from singletons.config import Config
+from singletons.scheduler import Scheduler
+from singletons.sio import Sio
+from utils.singleton import singleton
+
+
+@singleton
+class EmitCoalescer:
+    """
+    Merges state update emits (like `health_info` and `game_info`) sent to the same room
+    within `EMIT_COALESCE_WINDOW` seconds, so only the latest state is sent.
+    """
+    def __init__(self):
+        self.window = Config()["EMIT_COALESCE_WINDOW"]
+        self._pending = {}      # room: {event: data}
+        self._timers = {}       # room: Timer
+        self.stats = {
+            "queued": 0,
+            "sent": 0,
+            "saved": 0,
+        }
+
+    async def emit(self, event, data, room):
+        """
+        Queues `event` for `room`, replacing any pending `event` for the same room.
+        Emits immediately if coalescing is disabled.
+        :param event: event name
+        :param data: event payload
+        :param room: sio room
+        :return:
+        """
+        self.stats["queued"] += 1
+        if self.window <= 0:
+            self.stats["sent"] += 1
+            await Sio().emit(event, data, room=room)
+            return
+
+        pending = self._pending.setdefault(room, {})
+        if event in pending:
+            self.stats["saved"] += 1
+        pending[event] = data
+        if room not in self._timers:
+            self._timers[room] = Scheduler().call_later(self.window, self.flush, room)
+
+    async def flush(self, room):
+        """
+        Sends all pending events for `room` right away
+        :param room: sio room
+        :return:
+        """
+        timer = self._timers.pop(room, None)
+        if timer is not None:
+            timer.cancel()
+        for event, data in self._pending.pop(room, {}).items():
+            self.stats["sent"] += 1
+            await Sio().emit(event, data, room=room)
+
+    def discard(self, room, event=None):
+        """
+        Drops pending events for `room` without sending them
+        :param room: sio room
+        :param event: event name to drop. If `None`, all pending events for `room` are dropped.
+        :return:
+        """
+        pending = self._pending.get(room, {})
+        if event is None:
+            pending.clear()
+        else:
+            pending.pop(event, None)
+        if not pending:
+            self._pending.pop(room, None)
+            if room in self._timers:
+                self._timers.pop(room).cancel()
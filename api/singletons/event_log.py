@@ -0,0 +1,165 @@
+import concurrent.futures
+import logging
+import os
+import time
+
+from singletons.config import Config
+from singletons.metrics import Metrics
+from singletons.scheduler import Scheduler
+from utils import event_log
+from utils.general import worker_path
+from utils.singleton import singleton
+
+logger = logging.getLogger(__name__)
+
+
+@singleton
+class EventLog:
+    """
+    Binary log of what happens in every game (see `utils.event_log` for the format), used to replay
+    production sessions offline with `python -m benchmark.replay`.
+    Events are queued in memory as they are and handed to a background thread, which encodes and writes them,
+    every `EVENT_LOG_FLUSH_INTERVAL` seconds or when `EVENT_LOG_BUFFER` events are pending,
+    so games never wait for the encoding or the disk.
+    The file is rotated when it reaches `EVENT_LOG_MAX_BYTES`, the previous one becomes `<file>.1`, and so on
+    up to `EVENT_LOG_BACKUPS`. A file left by a previous run is rotated on startup.
+    """
+    def __init__(self):
+        path = Config()["EVENT_LOG_FILE"]
+        self.path = worker_path(path, Config()["WORKER_ID"], Config()["WORKERS"]) if path else None
+        self.max_bytes = Config()["EVENT_LOG_MAX_BYTES"]
+        self.backups = Config()["EVENT_LOG_BACKUPS"]
+        self.flush_interval = Config()["EVENT_LOG_FLUSH_INTERVAL"]
+        self.buffer_size = Config()["EVENT_LOG_BUFFER"]
+
+        self.enabled = False
+        # (kind, `time.monotonic()`, game id, fields) tuples not written yet
+        self._pending = []
+        self._executor = None
+        self._timer = None
+
+        # Used by the writer thread only (or by `take`).
+        # `time.time()` the records are relative to and the matching `time.monotonic()`.
+        self._epoch = None
+        self._monotonic = None
+        self._file = None
+        self._file_epoch = None
+        self._size = 0
+
+    def start(self):
+        """
+        Starts logging game events to `EVENT_LOG_FILE`
+        :return:
+        """
+        if self.path is None or self.enabled:
+            return
+        self._new_epoch()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-log")
+        self._timer = Scheduler().call_every(self.flush_interval, self.flush)
+        self.enabled = True
+        logger.info("Logging game events to %s", self.path)
+
+    def capture(self):
+        """
+        Starts logging game events in memory only, they're read back with `take`
+        :return:
+        """
+        self._new_epoch()
+        self.enabled = True
+
+    def take(self):
+        """
+        Empties the queue, going through the binary format so fields have the precision they have in the file
+        :return: list of the queued events as `utils.event_log.Record`s
+        """
+        events, self._pending = self._pending, []
+        return list(event_log.decode(self._encode(events), self._epoch))
+
+    def record(self, game, kind, *fields):
+        """
+        Logs an event of `game`
+        :param game: `Game` object, registered in `LobbyManager`
+        :param kind: event kind, one of `utils.event_log.KINDS`
+        :param fields: fields of that kind
+        :return:
+        """
+        if not self.enabled:
+            return
+        self._pending.append((kind, time.monotonic(), game.uuid, fields))
+        if len(self._pending) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands the queued events to the writer thread
+        :return:
+        """
+        if not self._pending or self._executor is None:
+            return
+        events, self._pending = self._pending, []
+        Metrics().event_log_events.inc(len(events))
+        self._executor.submit(self._write, events)
+
+    def close(self):
+        """
+        Writes the queued events and closes the file
+        :return:
+        """
+        if self._executor is None:
+            return
+        self._timer.cancel()
+        self.flush()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        self.enabled = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _new_epoch(self):
+        self._epoch = time.time()
+        self._monotonic = time.monotonic()
+
+    def _encode(self, events):
+        data = bytearray()
+        for kind, t, game_id, fields in events:
+            event_log.encode(data, kind, int((t - self._monotonic) * 1000), game_id, fields)
+        return data
+
+    def _write(self, events):
+        try:
+            if (events[-1][1] - self._monotonic) * 1000 > 0xFFFFFFFF:
+                # Milliseconds don't fit in the records anymore (49 days), continue in a new file
+                self._epoch += events[0][1] - self._monotonic
+                self._monotonic = events[0][1]
+            data = self._encode(events)
+            if self._file is not None and (
+                self._epoch != self._file_epoch or self._size + len(data) > self.max_bytes
+            ):
+                self._file.close()
+                self._file = None
+            if self._file is None:
+                self._open()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+        except Exception:
+            logger.exception("Could not write game events to %s", self.path)
+
+    def _open(self):
+        if os.path.isfile(self.path) and os.path.getsize(self.path) > 0:
+            self._rotate()
+        self._file = open(self.path, "wb")
+        self._file.write(event_log.header(self._epoch))
+        self._file_epoch = self._epoch
+        self._size = event_log.HEADER.size
+
+    def _rotate(self):
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            src = "{}.{}".format(self.path, i)
+            if os.path.isfile(src):
+                os.replace(src, "{}.{}".format(self.path, i + 1))
+        os.replace(self.path, "{}.1".format(self.path))
@@ -0,0 +1,159 @@
+import bisect
+import itertools
+import logging
+import random
+from array import array
+
+from constants import layout_cells
+from utils.singleton import singleton
+
+logger = logging.getLogger(__name__)
+
+SIZE = 4
+
+
+def free_space_right(grid, y, x):
+    cnt = 0
+    for i in range(x, SIZE):
+        if grid[y][i] != layout_cells.EMPTY:
+            return cnt
+        cnt += 1
+    return cnt
+
+
+def cell_options(grid, y, x):
+    """
+    Returns all the shapes that can be placed on the empty cell `y, x`
+    :param grid: layout matrix
+    :param y:
+    :param x:
+    :return: list of `(probability, type, length)` tuples
+    """
+    fsr = free_space_right(grid, y, x)
+    if fsr == 1:
+        # No space left on x axis, only Squares and VerticalRectangles allowed
+        pool = [layout_cells.SQUARE, layout_cells.VERTICAL_RECTANGLE]
+    else:
+        # More space, everything can fit
+        pool = [
+            layout_cells.SQUARE, layout_cells.VERTICAL_RECTANGLE,
+            layout_cells.HORIZONTAL_RECTANGLE, layout_cells.BIG_SQUARE
+        ]
+    if y == SIZE - 1:
+        # No space left on y axis, remove VerticalRectangles and BigSquares from pool
+        pool = [z for z in pool if z not in (layout_cells.VERTICAL_RECTANGLE, layout_cells.BIG_SQUARE)]
+
+    options = []
+    for _type in pool:
+        if _type == layout_cells.HORIZONTAL_RECTANGLE:
+            lengths = [2, 3] if fsr > 2 else [2]
+        elif _type == layout_cells.VERTICAL_RECTANGLE:
+            lengths = [2, 3] if y <= 1 else [2]
+        elif _type == layout_cells.BIG_SQUARE:
+            lengths = [2]
+        else:
+            lengths = [1]
+        for length in lengths:
+            options.append((1 / len(pool) / len(lengths), _type, length))
+    return options
+
+
+def fill_cells(grid, y, x, _type, length):
+    """
+    Marks the cells covered by a shape in a layout matrix
+    :param grid: layout matrix
+    :param y:
+    :param x:
+    :param _type: `layout_cells` shape
+    :param length: shape length
+    :return:
+    """
+    grid[y][x] = _type
+    if length == 1:
+        return
+    if _type == layout_cells.VERTICAL_RECTANGLE:
+        for i in range(y + 1, y + length):
+            grid[i][x] = layout_cells.OCCUPIED
+    elif _type == layout_cells.HORIZONTAL_RECTANGLE:
+        for i in range(x + 1, x + length):
+            grid[y][i] = layout_cells.OCCUPIED
+    elif _type == layout_cells.BIG_SQUARE:
+        for i, j in itertools.product(range(y, y + length), range(x, x + length)):
+            if (i, j) != (y, x):
+                grid[i][j] = layout_cells.BIG_SQUARE
+
+
+def next_empty(grid):
+    for y in range(SIZE):
+        for x in range(SIZE):
+            if grid[y][x] == layout_cells.EMPTY:
+                return y, x
+    return None
+
+
+def pack(y, x, _type, length):
+    return y | x << 2 | _type << 4 | length << 7
+
+
+def unpack(v):
+    return v & 3, v >> 2 & 3, v >> 4 & 7, v >> 7
+
+
+@singleton
+class LayoutCatalogue:
+    """
+    All the layouts a grid can have, with their probability.
+    Grids are filled top to bottom, left to right, by picking a random shape
+    that fits in the next empty cell. Since the board is small, every possible outcome
+    of that process is enumerated once and grids are generated with a single weighted draw.
+    Shapes are packed in 16 bit integers: 2 bits for y, 2 for x, 3 for type and 2 for length.
+    """
+    def __init__(self):
+        self._shapes = array("H")
+        self._offsets = array("I", [0])
+        self._cumulative_weights = array("d")
+
+    @property
+    def loaded(self):
+        return len(self._cumulative_weights) > 0
+
+    def __len__(self):
+        return len(self._cumulative_weights)
+
+    def load(self):
+        weights = {}
+        # Depth first walk of all the choices, merging paths that lead to the same layout
+        stack = [([[layout_cells.EMPTY] * SIZE for _ in range(SIZE)], (), 1.0)]
+        while stack:
+            grid, shapes, probability = stack.pop()
+            cell = next_empty(grid)
+            if cell is None:
+                weights[shapes] = weights.get(shapes, 0) + probability
+                continue
+            y, x = cell
+            for p, _type, length in cell_options(grid, y, x):
+                new_grid = [row[:] for row in grid]
+                fill_cells(new_grid, y, x, _type, length)
+                stack.append((new_grid, shapes + (pack(y, x, _type, length),), probability * p))
+
+        total = 0
+        for shapes in sorted(weights):
+            self._shapes.extend(shapes)
+            self._offsets.append(len(self._shapes))
+            total += weights[shapes]
+            self._cumulative_weights.append(total)
+        logger.debug("Loaded %s grid layouts", len(self))
+
+    def sample(self, rng=random):
+        """
+        Picks a random layout
+        :param rng: random number generator
+        :return: list of `(y, x, type, length)` tuples, in filling order
+        """
+        if not self.loaded:
+            self.load()
+        i = min(
+            bisect.bisect_right(self._cumulative_weights, rng.random() * self._cumulative_weights[-1]),
+            len(self) - 1
+        )
+        return [unpack(v) for v in self._shapes[self._offsets[i]:self._offsets[i + 1]]]
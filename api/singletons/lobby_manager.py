@@ -1,15 +1,35 @@
 import logging
-import uuid
+import math
 
 import server.game
+from singletons.cluster import Cluster
+from singletons.config import Config
+from singletons.event_log import EventLog
+from singletons.scheduler import Scheduler
 from singletons.sio import Sio
+from utils import event_log, game_ids, json_backend
 from utils.singleton import singleton
 
+logger = logging.getLogger(__name__)
+
 
 @singleton
 class LobbyManager:
     def __init__(self):
         self._games_by_uuid = {}
+        self._game_ids = game_ids.GameIdAllocator(
+            Config()["WORKER_ID"], Config()["WORKERS"], Config()["GAME_ID_LENGTH"]
+        )
+
+        # Public games waiting for players, hosted by any worker. game_id: `Game.sio_lobby_info()` dict
+        self._lobby = {}
+        self._sorted_lobby = None   # `_lobby` values sorted by fill level, `None` if it changed
+        self._snapshots = {}        # page: serialized `lobby_snapshot` payload, cleared when the lobby changes
+
+        # Changes to the public games of this worker not sent yet. game_id: lobby info, or `None` if removed
+        self._lobby_changes = {}
+        self._announced = set()     # ids of the public games of this worker the lobby knows about
+        self._lobby_flush_timer = None
 
     async def add_game(self, game):
         """
@@ -20,14 +40,15 @@ class LobbyManager:
         if type(game) is not server.Game:
             raise TypeError("`game` is not a Game object")
 
-        # Generate UUID and register game
+        # Generate id and register game
         game.uuid = self.generate_uuid()
         self._games_by_uuid[game.uuid] = game
+        EventLog().record(game, event_log.CREATE, game.seed, game.public, game.max_players, game.name)
 
         # Notify lobby
         await game.notify_lobby()
 
-        logging.info("Registered game {}".format(game.uuid))
+        logger.info("Registered game %s (seed %s)", game.uuid, game.seed)
 
     async def remove_game(self, game):
         """
@@ -48,21 +69,165 @@ class LobbyManager:
 
         # Remove game
         del self._games_by_uuid[game.uuid]
+        self._game_ids.free(game.uuid)
+
+        logger.info("Removed game %s", game.uuid)
+
+    def snapshot(self):
+        """
+        :return: JSON serializable state of the games hosted by this worker, restored with `restore`
+        """
+        for game in self._games_by_uuid.values():
+            EventLog().record(game, event_log.SAVE)
+        return {
+            "game_ids": self._game_ids.snapshot(),
+            "games": [game.snapshot() for game in self._games_by_uuid.values()],
+        }
 
-        logging.info("Removed game {}".format(game.uuid))
+    async def restore(self, data, resume_timeout):
+        """
+        Registers the games of a snapshot with their previous ids
+        :param data: `snapshot` dict, taken by a worker with the same id and number of workers
+        :param resume_timeout: seconds players have to resume their sessions (see `Game.restore`)
+        :return: list of restored `Game` objects
+        """
+        self._game_ids.restore(data["game_ids"])
+        games = []
+        for x in data["games"]:
+            game = await server.game.Game.restore(x, resume_timeout)
+            self._games_by_uuid[game.uuid] = game
+            EventLog().record(game, event_log.RESTORE, game.seed)
+            if not game.playing:
+                await game.notify_lobby()
+            games.append(game)
+            logger.info("Restored game %s (seed %s)", game.uuid, game.seed)
+        return games
 
     def generate_uuid(self):
         """
-        Generates a valid and random UUID
+        Allocates an unused short game id, hosted by this worker
+        :return:
+        """
+        return self._game_ids.allocate()
+
+    def _set_lobby_game(self, info):
+        self._lobby[info["game_id"]] = info
+        self._sorted_lobby = None
+        self._snapshots.clear()
+
+    def _remove_lobby_game(self, game_id):
+        if self._lobby.pop(game_id, None) is not None:
+            self._sorted_lobby = None
+            self._snapshots.clear()
+
+    def update_lobby_game(self, info):
+        """
+        Adds or updates a public game of this worker in the lobby.
+        Lobby clients are notified with the next `lobby_delta`.
+        :param info: `Game.sio_lobby_info()` dict
+        :return:
+        """
+        self._set_lobby_game(info)
+        self._lobby_changes[info["game_id"]] = info
+        self._schedule_lobby_flush()
+
+    def remove_lobby_game(self, game_id):
+        """
+        Removes a game of this worker from the lobby, if it's there
+        :param game_id: game uuid
+        :return:
+        """
+        if game_id not in self._lobby and game_id not in self._lobby_changes:
+            return
+        self._remove_lobby_game(game_id)
+        self._lobby_changes[game_id] = None
+        self._schedule_lobby_flush()
+
+    def update_remote_lobby(self, added=(), updated=(), removed=()):
+        """
+        Applies a `lobby_delta` of another worker to the lobby index
+        :return:
+        """
+        for info in added:
+            self._set_lobby_game(info)
+        for info in updated:
+            self._set_lobby_game(info)
+        for game_id in removed:
+            self._remove_lobby_game(game_id)
+
+    def replace_remote_lobby(self, worker_id, infos):
+        """
+        Replaces the public games of another worker in the lobby index
+        :param worker_id: id of that worker
+        :param infos: list of lobby info dicts of all its public games
+        :return:
+        """
+        for game_id in [x for x in self._lobby if Cluster().owner_of(x) == worker_id]:
+            self._remove_lobby_game(game_id)
+        for info in infos:
+            self._set_lobby_game(info)
+
+    def local_lobby_infos(self):
+        return [info for game_id, info in self._lobby.items() if game_id in self._games_by_uuid]
+
+    def _schedule_lobby_flush(self):
+        interval = Config()["LOBBY_UPDATE_INTERVAL"]
+        if self._lobby_flush_timer is None:
+            self._lobby_flush_timer = Scheduler().call_later(max(0, interval), self.flush_lobby)
+
+    async def flush_lobby(self):
+        """
+        Sends the pending lobby changes of this worker's games in a single `lobby_delta` event,
+        to lobby clients and to the other workers
         :return:
         """
-        valid = False
-        _uuid = None
-        while not valid:
-            _uuid = str(uuid.uuid4())
-            if _uuid not in self._games_by_uuid:
-                valid = True
-        return _uuid
+        self._lobby_flush_timer = None
+        changes, self._lobby_changes = self._lobby_changes, {}
+        delta = {"added": [], "updated": [], "removed": []}
+        for game_id, info in changes.items():
+            if info is None:
+                if game_id in self._announced:
+                    self._announced.discard(game_id)
+                    delta["removed"].append(game_id)
+            elif game_id in self._announced:
+                delta["updated"].append(info)
+            else:
+                self._announced.add(game_id)
+                delta["added"].append(info)
+        if not any(delta.values()):
+            return
+        await Sio().emit("lobby_delta", json_backend.encode(delta), room="lobby")
+        Cluster().publish("lobby_delta", **delta)
+
+    def sorted_lobby(self):
+        """
+        :return: list of public games lobby info, joinable ones first, fullest first
+        """
+        if self._sorted_lobby is None:
+            self._sorted_lobby = sorted(self._lobby.values(), key=lambda x: (
+                x["players"] >= x["max_players"], -x["players"] / x["max_players"], x["name"], x["game_id"]
+            ))
+        return self._sorted_lobby
+
+    def lobby_snapshot(self, page=0):
+        """
+        Returns a page of the lobby, serialized once until the lobby changes
+        :param page: page number, starting from 0. Out of range pages are clamped.
+        :return: `RawJSON` `lobby_snapshot` payload
+        """
+        games = self.sorted_lobby()
+        page_size = Config()["LOBBY_PAGE_SIZE"]
+        pages = max(1, math.ceil(len(games) / page_size))
+        page = min(max(0, page), pages - 1)
+        payload = self._snapshots.get(page)
+        if payload is None:
+            payload = self._snapshots[page] = json_backend.encode({
+                "games": games[page * page_size:(page + 1) * page_size],
+                "page": page,
+                "pages": pages,
+                "total": len(games),
+            })
+        return payload
 
     def items(self):
         return self._games_by_uuid.items()
@@ -72,3 +237,6 @@ class LobbyManager:
 
     def __contains__(self, item):
         return item in self._games_by_uuid
+
+    def __len__(self):
+        return len(self._games_by_uuid)
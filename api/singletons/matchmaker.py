@@ -0,0 +1,148 @@
+import collections
+import logging
+import time
+
+import server.game
+from singletons.cluster import Cluster
+from singletons.lobby_manager import LobbyManager
+from singletons.metrics import Metrics
+from singletons.sio import Sio
+from utils.singleton import singleton
+
+logger = logging.getLogger(__name__)
+
+
+@singleton
+class Matchmaker:
+    """
+    Quick match queue.
+    A client asking for a quick match joins the fullest public game of the requested size with a free slot,
+    hosted by any worker. If there's none, it waits in the queue of that size until enough clients
+    connected to the same worker are waiting, then they're put in a new public game.
+    Games created by the matchmaker start as soon as they're full and everyone is ready,
+    games created by a player are still started by their host.
+    """
+    GAME_NAME = "Partita rapida"
+
+    def __init__(self):
+        # size: {sid: (`Client` object, time it started waiting)}, oldest first
+        self._queues = collections.defaultdict(collections.OrderedDict)
+        self._queued = {}   # sid: size
+        # Clients waiting for another worker to accept them in one of its games.
+        # sid: (size, ids of the games tried so far)
+        self._joining = {}
+
+    async def quick_match(self, client, size, tried=frozenset()):
+        """
+        Puts `client` in a game of `size` players, or in the queue if there's none to join
+        :param client: `Client` object, not in a game
+        :param size: number of players
+        :param tried: ids of games not to join, they turned out to be full
+        :return:
+        """
+        self.cancel(client)
+        if await self._join_lobby_game(client, size, tried):
+            return
+
+        queue = self._queues[size]
+        queue[client.sid] = (client, time.monotonic())
+        self._queued[client.sid] = size
+        logger.info("%s waiting for a quick match of %s players", client.sid, size)
+        if len(queue) < size:
+            await Sio().emit("quick_match_queued", {"size": size, "queued": len(queue)}, room=client.sid)
+            return
+
+        # Enough players waiting, make a new game
+        now = time.monotonic()
+        clients = []
+        for _ in range(size):
+            sid, (c, since) = queue.popitem(last=False)
+            del self._queued[sid]
+            Metrics().matchmaking_wait.observe(now - since)
+            clients.append(c)
+        match = server.game.Game(name=self.GAME_NAME, public=True)
+        match.max_players = size
+        match.auto_start = True
+        await LobbyManager().add_game(match)
+        for c in clients:
+            await match.join_client(c)
+        Metrics().quick_matches.inc(kind="created")
+        logger.info("Quick match %s created", match.uuid)
+
+    def joined(self, client):
+        """
+        Called when another worker accepted `client` in one of its games
+        :param client: `Client` object
+        :return:
+        """
+        if self._joining.pop(client.sid, None) is not None:
+            self._filled()
+
+    async def join_failed(self, client, game_id):
+        """
+        Called when another worker couldn't put `client` in `game_id` (full or gone in the meantime):
+        tries the next game, or queues the client
+        :param client: `Client` object
+        :param game_id: game id
+        :return:
+        """
+        entry = self._joining.pop(client.sid, None)
+        if entry is None:
+            # Quick match cancelled or disconnected in the meantime
+            return
+        size, tried = entry
+        await self.quick_match(client, size, tried | {game_id})
+
+    async def _join_lobby_game(self, client, size, tried):
+        """
+        Joins the fullest public game of `size` players with a free slot
+        :return: `True` if there was one (or if another worker has been asked to join one), `False` otherwise
+        """
+        for info in LobbyManager().sorted_lobby():
+            if info["players"] >= info["max_players"]:
+                # Joinable games come first
+                break
+            game_id = info["game_id"]
+            if info["max_players"] != size or game_id in tried:
+                continue
+            if not Cluster().is_local(game_id):
+                # Hosted by another worker, which may not have room anymore: it answers with `joined` or `join_failed`
+                self._joining[client.sid] = (size, tried)
+                Cluster().publish(
+                    "join", to=Cluster().owner_of(game_id), sid=client.sid, uid=client.uid,
+                    token=client.token, game_id=game_id, quick_match=True
+                )
+                return True
+            match = LobbyManager()[game_id]
+            if match.playing or len(match.slots) >= match.max_players:
+                continue
+            await match.join_client(client)
+            self._filled()
+            return True
+        return False
+
+    @staticmethod
+    def _filled():
+        Metrics().matchmaking_wait.observe(0)
+        Metrics().quick_matches.inc(kind="filled")
+
+    def cancel(self, client):
+        """
+        Removes `client` from the queue, if it's waiting
+        :param client: `Client` object
+        :return: `True` if it was waiting, `False` otherwise
+        """
+        if self._joining.pop(client.sid, None) is not None:
+            # Can't be undone if the other worker accepts it, but it won't try other games
+            return True
+        size = self._queued.pop(client.sid, None)
+        if size is None:
+            return False
+        del self._queues[size][client.sid]
+        return True
+
+    def __contains__(self, client):
+        return client.sid in self._queued
+
+    def __len__(self):
+        return len(self._queued)
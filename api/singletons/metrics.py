@@ -0,0 +1,115 @@
+import asyncio
+import logging
+
+from singletons.config import Config
+from utils.metrics import Counter, Gauge, Histogram
+from utils.singleton import singleton
+
+logger = logging.getLogger(__name__)
+
+
+@singleton
+class Metrics:
+    """
+    Server metrics, exposed in Prometheus text format on `/metrics`.
+    In multi-worker mode each worker exposes its own metrics with a `worker` label.
+    """
+    LOOP_LAG_INTERVAL = 0.5
+
+    def __init__(self):
+        self._metrics = []
+        self._loop_monitor = None
+
+        self.handler_latency = self.histogram(
+            "happycity_handler_seconds", "Time spent handling socket.io events", labels=("event",)
+        )
+        self.emits = self.counter("happycity_emits_total", "Events emitted", labels=("event",))
+        self.instructions_generated = self.counter(
+            "happycity_instructions_generated_total", "Instructions generated"
+        )
+        self.instructions_completed = self.counter(
+            "happycity_instructions_completed_total", "Instructions completed"
+        )
+        self.instructions_expired = self.counter(
+            "happycity_instructions_expired_total", "Instructions expired"
+        )
+        self.quick_matches = self.counter(
+            "happycity_quick_matches_total",
+            "Quick matches, by public games filled (`filled`) and new games made from the queue (`created`)",
+            labels=("kind",)
+        )
+        self.matchmaking_wait = self.histogram(
+            "happycity_matchmaking_wait_seconds", "Time spent by clients in the quick match queue",
+            buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+        )
+        self.reaped_games = self.counter(
+            "happycity_reaped_games_total", "Games disposed by the reaper, idle in the lobby or over",
+            labels=("reason",)
+        )
+        self.reaped_clients = self.counter("happycity_reaped_clients_total", "Idle clients disconnected by the reaper")
+        self.reclaimed_bytes = self.counter(
+            "happycity_reaper_reclaimed_bytes_total", "Estimated memory freed by the reaper"
+        )
+        self.rate_limited = self.counter(
+            "happycity_rate_limited_events_total", "Events dropped because a client sent too many", labels=("event",)
+        )
+        self.resumed_sessions = self.counter(
+            "happycity_resumed_sessions_total", "Players who got their slot back from a new socket"
+        )
+        self.expired_sessions = self.counter(
+            "happycity_expired_sessions_total", "Players who lost their slot, not back in time"
+        )
+        self.event_log_events = self.counter(
+            "happycity_event_log_events_total", "Game events handed to the event log writer"
+        )
+        self.loop_lag = self.histogram(
+            "happycity_event_loop_lag_seconds",
+            "Delay of a callback scheduled every {} seconds on the event loop".format(self.LOOP_LAG_INTERVAL)
+        )
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=(), function=None):
+        """
+        Registers a counter
+        :param name: metric name
+        :param documentation: help text
+        :param labels: label names
+        :param function: function returning the current value, called when metrics are rendered.
+                         If provided, the counter has no labels.
+        :return: `Counter` object
+        """
+        return self._register(Counter(name, documentation, labels, function))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        return self._register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name, documentation, labels=(), **kwargs):
+        return self._register(Histogram(name, documentation, labels, **kwargs))
+
+    def render(self):
+        """
+        :return: all metrics in Prometheus text format
+        """
+        const_labels = (("worker", Config()["WORKER_ID"]),) if Config()["WORKERS"] > 1 else ()
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render(const_labels)
+        return "\n".join(lines) + "\n"
+
+    def start_loop_monitor(self):
+        """
+        Starts measuring the event loop lag
+        :return:
+        """
+        if self._loop_monitor is None:
+            self._loop_monitor = asyncio.ensure_future(self._monitor_loop())
+
+    async def _monitor_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.LOOP_LAG_INTERVAL)
+            self.loop_lag.observe(max(0, loop.time() - start - self.LOOP_LAG_INTERVAL))
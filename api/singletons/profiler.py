@@ -0,0 +1,221 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from singletons.config import Config
+from utils.singleton import singleton
+
+logger = logging.getLogger(__name__)
+
+
+def current_task(loop):
+    if hasattr(asyncio, "current_task"):
+        return asyncio.current_task(loop)
+    return asyncio.Task.current_task(loop)
+
+
+def coroutine_stack(task):
+    """
+    Extracts the stack of a suspended task, following the chain of awaited coroutines
+    :param task: `asyncio.Task` object
+    :return: list of formatted frames, outermost first
+    """
+    frames = []
+    coro = getattr(task, "_coro", None)
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append((frame, frame.f_lineno))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return traceback.StackSummary.extract(frames).format()
+
+
+class HandlerCall:
+    """
+    Context manager timing a handler invocation.
+    If the call is still running after the slow threshold, the stack of its task is sampled.
+    """
+    def __init__(self, profiler, event, sid, game_id):
+        self.profiler = profiler
+        self.event = event
+        self.sid = sid
+        self.game_id = game_id
+        self.start = None
+        self.stack = None
+        self._sampler = None
+
+    def __enter__(self):
+        loop = asyncio.get_event_loop()
+        task = current_task(loop)
+        if task is not None:
+            self._sampler = loop.call_later(self.profiler.slow_threshold, self._sample, task)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        if self._sampler is not None:
+            self._sampler.cancel()
+        self.profiler.record(self, time.perf_counter() - self.start)
+
+    def _sample(self, task):
+        self._sampler = None
+        self.stack = coroutine_stack(task)
+
+
+@singleton
+class Profiler:
+    """
+    Opt-in (`PROFILE=1`) profiler for socket.io handlers and the event loop.
+    Handlers decorated with `utils.server.profile` are timed, calls slower than `PROFILE_SLOW_HANDLER`
+    are logged with their event name, game id and a sample of their stack.
+    A watchdog thread samples the stack of the event loop thread
+    when the loop doesn't run for more than `PROFILE_LOOP_STALL` seconds.
+    """
+    HEARTBEAT_INTERVAL = 0.05
+    MAX_SAMPLES = 50
+    TOP_STACKS = 10
+
+    def __init__(self):
+        self.enabled = Config()["PROFILE"]
+        self.slow_threshold = Config()["PROFILE_SLOW_HANDLER"]
+        self.stall_threshold = Config()["PROFILE_LOOP_STALL"]
+
+        self._loop = None
+        self._loop_thread = None
+        self._heartbeat = None
+        self._watchdog = None
+        self.reset()
+
+    def reset(self):
+        """
+        Clears all collected data
+        :return:
+        """
+        self.since = time.time()
+        self.handlers = {}      # event: {"calls", "total", "max", "slow"}
+        self.slow_calls = collections.deque(maxlen=self.MAX_SAMPLES)
+        self.slow_stacks = collections.Counter()
+        self.stalls = collections.deque(maxlen=self.MAX_SAMPLES)
+        self.stall_stacks = collections.Counter()
+        self.max_lag = 0
+
+    def call(self, event, sid, game_id=None):
+        """
+        :return: `HandlerCall` context manager timing a handler call
+        """
+        return HandlerCall(self, event, sid, game_id)
+
+    def record(self, call, duration):
+        stats = self.handlers.get(call.event)
+        if stats is None:
+            stats = self.handlers[call.event] = {"calls": 0, "total": 0, "max": 0, "slow": 0}
+        stats["calls"] += 1
+        stats["total"] += duration
+        stats["max"] = max(stats["max"], duration)
+        if duration < self.slow_threshold:
+            return
+
+        stats["slow"] += 1
+        self.slow_calls.append({
+            "time": time.time(),
+            "event": call.event,
+            "sid": call.sid,
+            "game_id": call.game_id,
+            "duration": duration,
+            "stack": call.stack,
+        })
+        if call.stack is not None:
+            self.slow_stacks["".join(call.stack)] += 1
+        logger.warning(
+            "Slow handler %s took %.1f ms (sid %s, game %s)", call.event, duration * 1000, call.sid, call.game_id
+        )
+
+    def start(self):
+        """
+        Starts the event loop heartbeat and the watchdog thread
+        :return:
+        """
+        if not self.enabled or self._watchdog is not None:
+            return
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._loop.call_soon(self._beat)
+        self._watchdog = threading.Thread(target=self._watch, name="profiler-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(
+            "Profiling handlers slower than %s ms and loop stalls longer than %s ms",
+            self.slow_threshold * 1000, self.stall_threshold * 1000
+        )
+
+    def _beat(self):
+        self._heartbeat = time.monotonic()
+        self._loop.call_later(self.HEARTBEAT_INTERVAL, self._beat)
+
+    def _watch(self):
+        sampled = None
+        while True:
+            time.sleep(self.HEARTBEAT_INTERVAL)
+            heartbeat = self._heartbeat
+            lag = time.monotonic() - heartbeat - self.HEARTBEAT_INTERVAL
+            self.max_lag = max(self.max_lag, lag)
+            if lag < self.stall_threshold or heartbeat == sampled:
+                continue
+
+            # The loop is blocked: sample what it's running, once per stall
+            sampled = heartbeat
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = traceback.format_stack(frame) if frame is not None else None
+            self.stalls.append({"time": time.time(), "lag": lag, "stack": stack})
+            if stack is not None:
+                self.stall_stacks["".join(stack)] += 1
+            logger.warning("Event loop blocked for at least %.1f ms", lag * 1000)
+
+    def report(self):
+        """
+        :return: aggregated report, JSON serializable
+        """
+        return {
+            "since": self.since,
+            "slow_threshold": self.slow_threshold,
+            "stall_threshold": self.stall_threshold,
+            "handlers": {
+                event: dict(stats, mean=stats["total"] / stats["calls"])
+                for event, stats in sorted(self.handlers.items(), key=lambda x: -x[1]["total"])
+            },
+            "slow_calls": list(self.slow_calls),
+            "slow_stacks": [{"count": c, "stack": s} for s, c in self.slow_stacks.most_common(self.TOP_STACKS)],
+            "loop": {
+                "max_lag": self.max_lag,
+                "stalls": list(self.stalls),
+                "stall_stacks": [
+                    {"count": c, "stack": s} for s, c in self.stall_stacks.most_common(self.TOP_STACKS)
+                ],
+            },
+        }
+
+    def format_report(self):
+        """
+        :return: aggregated report, as text
+        """
+        report = self.report()
+        lines = ["Profile since {}".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(report["since"])))]
+        lines.append("{:<24} {:>8} {:>10} {:>10} {:>10} {:>6}".format(
+            "event", "calls", "total ms", "mean ms", "max ms", "slow"
+        ))
+        for event, stats in report["handlers"].items():
+            lines.append("{:<24} {:>8} {:>10.1f} {:>10.2f} {:>10.2f} {:>6}".format(
+                event, stats["calls"], stats["total"] * 1000, stats["mean"] * 1000, stats["max"] * 1000, stats["slow"]
+            ))
+        lines.append("Event loop: max lag {:.1f} ms, {} stalls".format(
+            report["loop"]["max_lag"] * 1000, len(report["loop"]["stalls"])
+        ))
+        for title, stacks in (("slow handlers", report["slow_stacks"]), ("loop stalls", report["loop"]["stall_stacks"])):
+            for x in stacks:
+                lines.append("{} sample(s) of {}:\n{}".format(x["count"], title, x["stack"]))
+        return "\n".join(lines)
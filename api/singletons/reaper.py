@@ -0,0 +1,111 @@
+import logging
+
+import server.client
+import server.game
+import server.instruction
+from server.game_modifiers import GameModifier
+from singletons.client_manager import ClientManager
+from singletons.config import Config
+from singletons.lobby_manager import LobbyManager
+from singletons.metrics import Metrics
+from singletons.scheduler import Scheduler, Timer
+from singletons.sio import Sio
+from utils.command_name_generator import CommandNameGenerator
+from utils.grid import Grid, GridElement
+from utils.json_backend import RawJSON
+from utils.memory import footprint
+from utils.singleton import singleton
+from utils.special_commands import SpecialCommand
+from utils.word_sampler import WordPool
+
+logger = logging.getLogger(__name__)
+
+
+@singleton
+class Reaper:
+    """
+    Periodically (every `REAPER_INTERVAL` seconds) disposes games nobody plays anymore and
+    disconnects idle sockets, so long-running servers don't keep them forever:
+    - games in the lobby whose players haven't sent anything for `GAME_IDLE_TTL` seconds (or empty for that long)
+    - games over for more than `GAME_FINISHED_TTL` seconds
+    - clients not in a game that haven't sent anything for `CLIENT_IDLE_TTL` seconds
+    A TTL of 0 disables that check. Players of a reaped game get `game_expired`, idle clients `idle_disconnect`.
+    """
+    def __init__(self):
+        self.interval = Config()["REAPER_INTERVAL"]
+        self.game_idle_ttl = Config()["GAME_IDLE_TTL"]
+        self.game_finished_ttl = Config()["GAME_FINISHED_TTL"]
+        self.client_idle_ttl = Config()["CLIENT_IDLE_TTL"]
+        self._timer = None
+
+        # Objects owned by a game, freed when it's disposed (see `utils.memory.footprint`)
+        self.game_types = (
+            server.game.Game, server.game.Slot, server.instruction.Instruction, Grid, GridElement,
+            CommandNameGenerator, WordPool, GameModifier, SpecialCommand, Timer, RawJSON
+        )
+
+    def start(self):
+        """
+        Starts sweeping every `REAPER_INTERVAL` seconds
+        :return:
+        """
+        if self.interval <= 0 or self._timer is not None:
+            return
+        self._timer = Scheduler().call_every(self.interval, self.sweep)
+        logger.info(
+            "Reaping lobby games idle for %ss, games over for %ss and clients idle for %ss (0 = never)",
+            self.game_idle_ttl, self.game_finished_ttl, self.client_idle_ttl
+        )
+
+    def expired(self, game, now):
+        """
+        :param game: `Game` object
+        :param now: `Scheduler().time()` value
+        :return: `idle` or `finished` if `game` must be disposed, `None` otherwise
+        """
+        if game.finished_at is not None:
+            if self.game_finished_ttl > 0 and now - game.finished_at >= self.game_finished_ttl:
+                return "finished"
+        elif not game.playing and self.game_idle_ttl > 0:
+            # Games left empty (e.g. the host never joined) count from their creation
+            if now - max((x.client.last_activity for x in game.slots), default=game.created_at) >= self.game_idle_ttl:
+                return "idle"
+        return None
+
+    async def sweep(self):
+        """
+        Disposes expired games and disconnects idle clients
+        :return: `(games, clients, bytes)` tuple, number of reaped games and clients
+                 and estimated memory reclaimed
+        """
+        now = Scheduler().time()
+        games = clients = reclaimed = 0
+
+        for _, game in list(LobbyManager().items()):
+            reason = self.expired(game, now)
+            if reason is None or game.disposing:
+                continue
+            size = footprint(game, self.game_types)
+            await Sio().emit("game_expired", {"reason": reason}, room=game.sio_room)
+            await game.dispose()
+            Metrics().reaped_games.inc(reason=reason)
+            logger.info("Reaped %s game %s (%s bytes)", reason, game.uuid, size)
+            games += 1
+            reclaimed += size
+
+        if self.client_idle_ttl > 0:
+            for sid, client in list(ClientManager().items()):
+                if client.is_proxy or client.is_in_game or now - client.last_activity < self.client_idle_ttl:
+                    continue
+                size = footprint(client, (server.client.Client,))
+                await Sio().emit("idle_disconnect", room=sid)
+                await Sio().disconnect(sid)
+                Metrics().reaped_clients.inc()
+                logger.info("Disconnected idle client %s", sid)
+                clients += 1
+                reclaimed += size
+
+        if games or clients:
+            Metrics().reclaimed_bytes.inc(reclaimed)
+            logger.info("Reaped %s games and %s clients, about %s KiB reclaimed", games, clients, reclaimed // 1024)
+        return games, clients, reclaimed
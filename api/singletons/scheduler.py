@@ -0,0 +1,297 @@
+import asyncio
+import heapq
+import itertools
+import logging
+
+from utils.singleton import singleton
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    """
+    A callback scheduled on the `Scheduler`.
+    Timers are never removed from the heap directly: cancelling, pausing or rescheduling
+    a timer just bumps its sequence number, so stale heap entries are skipped when popped.
+    """
+    def __init__(self, scheduler, callback, args, interval=None):
+        self.scheduler = scheduler
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.deadline = None
+        self.seq = None
+        self.cancelled = False
+        # Seconds that were left when the timer was paused, `None` if it's not paused
+        self.paused_remaining = None
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+    def reschedule(self, delay):
+        self.scheduler.reschedule(self, delay)
+
+    def pause(self):
+        self.scheduler.pause(self)
+
+    def resume(self):
+        self.scheduler.resume(self)
+
+    @property
+    def remaining(self):
+        """
+        Seconds left before this timer fires, frozen while it's paused
+        :return: remaining seconds, or `None` if the timer is not pending
+        """
+        if self.paused_remaining is not None:
+            return self.paused_remaining
+        if self.cancelled or self.seq is None:
+            return None
+        return max(0, self.deadline - self.scheduler.time())
+
+
+@singleton
+class Scheduler:
+    """
+    Process-wide deadline heap that runs every game timer
+    (instruction expiries, health drains, game modifier ticks...)
+    from a single dispatcher task, instead of one asyncio Task sleeping per timer.
+    Coroutine callbacks get their own task once due, so a slow one (e.g. an emit to a congested client)
+    doesn't hold back the timers of other games. The task does nothing if the timer is cancelled, paused
+    or rescheduled before it gets to run.
+    """
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._stale = 0
+
+        self._loop = None
+        self._dispatcher = None
+        self._waiter = None
+        self._wakeup_handle = None
+        self._wakeup_at = None
+        # Tasks of the coroutine callbacks still running, referenced until they're done
+        self._tasks = set()
+
+        # Current time when timers run on a virtual clock (see `use_virtual_clock`), `None` otherwise
+        self._now = None
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        return self._loop
+
+    def time(self):
+        """
+        :return: current time of the timers, `loop.time()` unless they run on a virtual clock
+        """
+        return self.loop.time() if self._now is None else self._now
+
+    def use_virtual_clock(self, start=0):
+        """
+        Runs timers on a virtual clock instead of the event loop: time only moves and timers only fire
+        when `advance` is called, so games can be replayed faster than real time (see `benchmark.replay`).
+        Must be called before scheduling anything.
+        :param start: initial time of the clock
+        :return:
+        """
+        if self._heap:
+            raise RuntimeError("Timers already scheduled")
+        self._now = start
+
+    async def advance(self, until):
+        """
+        Moves the virtual clock to `until` and runs the timers due by then in order, like an event loop
+        that was busy until `until` would: timers they schedule count from `until`, not from their deadline.
+        Coroutine callbacks are awaited one at a time, so the order of what they do is reproducible.
+        :param until: new time of the clock
+        :return:
+        """
+        if self._now is None:
+            raise RuntimeError("Timers are not running on a virtual clock")
+        self._now = max(self._now, until)
+        timer = self._pop_due()
+        while timer is not None:
+            task = self._run(timer)
+            if task is not None:
+                await asyncio.wait([task])
+            timer = self._pop_due()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Schedules `callback(*args)` to be called once after `delay` seconds.
+        `callback` can be a regular function or a coroutine function.
+        :param delay: seconds to wait
+        :param callback: function to call
+        :param args: positional arguments for `callback`
+        :return: `Timer` object
+        """
+        timer = Timer(self, callback, args)
+        self._push(timer, delay)
+        return timer
+
+    def call_every(self, interval, callback, *args, delay=None):
+        """
+        Schedules `callback(*args)` to be called every `interval` seconds until the timer is cancelled
+        :param interval: seconds between two calls
+        :param callback: function to call
+        :param args: positional arguments for `callback`
+        :param delay: seconds to wait before the first call. Defaults to `interval`.
+        :return: `Timer` object
+        """
+        timer = Timer(self, callback, args, interval=interval)
+        self._push(timer, interval if delay is None else delay)
+        return timer
+
+    def reschedule(self, timer, delay):
+        """
+        Moves `timer` to `delay` seconds from now. Works on cancelled and already fired timers too.
+        :param timer: `Timer` object
+        :param delay: seconds to wait
+        :return:
+        """
+        if timer.seq is not None and not timer.cancelled:
+            self._stale += 1
+        timer.cancelled = False
+        timer.paused_remaining = None
+        self._push(timer, delay)
+
+    def pause(self, timer):
+        """
+        Stops the countdown of `timer`, `resume` restarts it with the time it had left.
+        Does nothing if the timer is not pending.
+        :param timer: `Timer` object
+        :return:
+        """
+        if timer.cancelled or timer.seq is None:
+            return
+        timer.paused_remaining = max(0, timer.deadline - self.time())
+        timer.seq = None
+        self._stale += 1
+        self._compact()
+
+    def resume(self, timer):
+        """
+        Restarts the countdown of a paused `timer`. Does nothing if the timer is not paused.
+        :param timer: `Timer` object
+        :return:
+        """
+        if timer.paused_remaining is None:
+            return
+        delay, timer.paused_remaining = timer.paused_remaining, None
+        self._push(timer, delay)
+
+    def cancel(self, timer):
+        """
+        Cancels `timer`. Does nothing if the timer has already been cancelled.
+        :param timer: `Timer` object
+        :return:
+        """
+        if timer.cancelled:
+            return
+        timer.cancelled = True
+        timer.paused_remaining = None
+        if timer.seq is not None:
+            self._stale += 1
+            timer.seq = None
+        self._compact()
+
+    def __len__(self):
+        return len(self._heap) - self._stale
+
+    def _push(self, timer, delay):
+        timer.deadline = self.time() + delay
+        timer.seq = next(self._seq)
+        heapq.heappush(self._heap, (timer.deadline, timer.seq, timer))
+        if self._now is not None:
+            # Virtual clock, run by `advance`
+            return
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        elif self._waiter is not None and (self._wakeup_at is None or timer.deadline < self._wakeup_at):
+            # The dispatcher is sleeping and this timer is the new head
+            self._arm(timer.deadline)
+
+    def _compact(self):
+        # Rebuild the heap when more than half of it is made of stale entries
+        if self._stale > 64 and self._stale > len(self._heap) // 2:
+            self._heap = [x for x in self._heap if x[1] == x[2].seq]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def _arm(self, deadline):
+        if self._wakeup_handle is not None:
+            self._wakeup_handle.cancel()
+        self._wakeup_at = deadline
+        self._wakeup_handle = self.loop.call_at(deadline, self._wake)
+
+    def _wake(self):
+        self._wakeup_handle = None
+        self._wakeup_at = None
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _pop_due(self):
+        now = self.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, timer = heapq.heappop(self._heap)
+            if seq != timer.seq:
+                # Cancelled or rescheduled
+                self._stale -= 1
+                continue
+            if timer.interval is None:
+                timer.seq = None
+            else:
+                # Periodic timer, push it back before running it so the callback can cancel it
+                timer.seq = next(self._seq)
+                timer.deadline += timer.interval
+                heapq.heappush(self._heap, (timer.deadline, timer.seq, timer))
+            return timer
+        return None
+
+    def _run(self, timer):
+        """
+        Calls the callback of `timer`
+        :param timer: due `Timer` object
+        :return: task running the callback if it returned a coroutine, `None` otherwise
+        """
+        try:
+            result = timer.callback(*timer.args)
+        except Exception:
+            logger.exception("Unhandled exception in scheduled callback %s", timer.callback)
+            return None
+        if not asyncio.iscoroutine(result):
+            return None
+        task = self.loop.create_task(self._run_coroutine(timer, timer.seq, result))
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    @staticmethod
+    async def _run_coroutine(timer, seq, coroutine):
+        if timer.cancelled or timer.seq != seq:
+            # Cancelled, paused or rescheduled since it was due (e.g. the instruction it would expire
+            # has been completed and replaced in the meantime)
+            coroutine.close()
+            return
+        await coroutine
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Unhandled exception in scheduled callback", exc_info=task.exception())
+
+    async def _dispatch(self):
+        while True:
+            timer = self._pop_due()
+            while timer is not None:
+                self._run(timer)
+                timer = self._pop_due()
+
+            # Sleep until the next deadline or until an earlier timer is pushed
+            self._waiter = self.loop.create_future()
+            if self._heap:
+                self._arm(self._heap[0][0])
+            await self._waiter
+            self._waiter = None
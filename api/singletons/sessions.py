@@ -0,0 +1,74 @@
+import logging
+
+from singletons.metrics import Metrics
+from singletons.scheduler import Scheduler
+from utils.singleton import singleton
+
+logger = logging.getLogger(__name__)
+
+
+@singleton
+class Sessions:
+    """
+    Clients that hold a slot in a game but have no socket: players who lost their connection during a game
+    (see `Game.detach_client`) and players of games restored from a snapshot (see `utils.snapshot`).
+    A client that sends `resume` with the token of one of these sessions takes its place in the game.
+    Sessions not resumed in time leave their game.
+    """
+    def __init__(self):
+        # token: (`Client` object, expiry `Timer`)
+        self._detached = {}
+
+    def detach(self, client, timeout):
+        """
+        Keeps `client` in its game for `timeout` seconds, waiting for it to resume its session
+        :param client: `Client` object, in a game hosted by this worker
+        :param timeout: seconds before it leaves its game
+        :return:
+        """
+        self.cancel(client.token)
+        self._detached[client.token] = (client, Scheduler().call_later(timeout, self.expire, client))
+        logger.debug("Session of %s detached for %ss", client.uid, timeout)
+
+    async def expire(self, client):
+        """
+        Removes `client` from its game, its session hasn't been resumed in time
+        :param client: `Client` object
+        :return:
+        """
+        entry = self._detached.get(client.token)
+        if entry is None or entry[0] is not client:
+            return
+        del self._detached[client.token]
+        Metrics().expired_sessions.inc()
+        logger.info("Session of %s expired", client.uid)
+        await client.leave_game()
+
+    def take(self, token):
+        """
+        Takes the detached session with this token, so a new socket can resume it
+        :param token: reconnect token
+        :return: `Client` object, or `None` if there's no such session
+        """
+        entry = self._detached.pop(token, None)
+        if entry is None:
+            return None
+        client, timer = entry
+        timer.cancel()
+        return client
+
+    def cancel(self, token):
+        """
+        Forgets the detached session with this token, if any, without removing it from its game
+        :param token: reconnect token
+        :return:
+        """
+        entry = self._detached.pop(token, None)
+        if entry is not None:
+            entry[1].cancel()
+
+    def __contains__(self, token):
+        return token in self._detached
+
+    def __len__(self):
+        return len(self._detached)
@@ -1,8 +1,43 @@
+import time
+
 import socketio
 
+from singletons.metrics import Metrics
+from utils.json_backend import get_backend
 from utils.singleton import singleton
 
 
 @singleton
 class Sio(socketio.AsyncServer):
-    pass
\ No newline at end of file
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("json", get_backend())
+        super().__init__(*args, **kwargs)
+        # Coroutine function called with the event name and handler arguments before every event.
+        # If it returns `True`, the event has been handled elsewhere and local handlers are skipped.
+        self.event_router = None
+
+    async def trigger_event(self, event, sid, data=None):
+        """
+        Runs the local handler of `event` as if `sid` had sent it
+        :param event: event name
+        :param sid: client sid
+        :param data: event data
+        :return:
+        """
+        return await super()._trigger_event(event, "/", sid, data)
+
+    async def emit(self, event, *args, **kwargs):
+        Metrics().emits.inc(event=event)
+        return await super().emit(event, *args, **kwargs)
+
+    async def _trigger_event(self, event, namespace, *args):
+        start = time.perf_counter()
+        try:
+            if self.event_router is not None and await self.event_router(event, *args):
+                return None
+            return await super()._trigger_event(event, namespace, *args)
+        finally:
+            # Event names come from the clients: one label for all the unhandled ones, or any client could
+            # create as many histograms as it wants
+            label = event if event in self.handlers.get(namespace, {}) else "unknown"
+            Metrics().handler_latency.observe(time.perf_counter() - start, event=label)
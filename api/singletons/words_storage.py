@@ -1,4 +1,11 @@
+import logging
+
+from singletons.config import Config
+from utils import wordlist
 from utils.singleton import singleton
+from utils.word_sampler import WordSampler
+
+logger = logging.getLogger(__name__)
 
 
 @singleton
@@ -10,89 +17,54 @@ class WordsStorage:
             "pseudo", "thermo", "turbo", "infra", "astro", "macro", "spectra", "tele"
         ]
 
-        self.ROLE_0 = {
-            "rare_nouns": [],
-            "rare_adjectives": [],
-            "nouns": [],
-            "adjectives": []
-        }
-
-        self.ROLE_1 = {
-            "rare_nouns": [],
-            "rare_adjectives": [],
-            "nouns": [],
-            "adjectives": []
-        }
-
-        self.ROLE_2 = {
-            "rare_nouns": [],
-            "rare_adjectives": [],
-            "nouns": [],
-            "adjectives": []
-        }
+        # {(kind, role): WordSampler}, see `load`
+        self.samplers = {}
+        self._compiled = None
 
-        self.ROLE_3 = {
-            "rare_nouns": [],
-            "rare_adjectives": [],
-            "nouns": [],
-            "adjectives": []
+    def load_text(self, directory):
+        """
+        Builds the samplers from the text wordlists
+        :param directory: text wordlists directory
+        :return:
+        """
+        self.samplers = {
+            k: WordSampler.from_lists(common, rare) for k, (common, rare) in wordlist.read_text(directory).items()
         }
 
-        self.VERBS = []
-
-    def load_nouns(self):
-        lines = []
-        with open("words/nouns.txt", "r") as f:
-            lines += [(x.lower().strip(), False) for x in f.readlines()]
-        with open("words/rare_nouns.txt", "r") as f:
-            lines += [(x.lower().strip(), True) for x in f.readlines()]
-
-        for (line, rare) in lines:
-            parts = line.split(",")
-            if len(parts) == 2:
-                noun, role = parts
-                if role == "0":
-                    dest_list = self.ROLE_0["{}nouns".format("rare_" if rare else "")]
-                elif role == "1":
-                    dest_list = self.ROLE_1["{}nouns".format("rare_" if rare else "")]
-                elif role == "2":
-                    dest_list = self.ROLE_2["{}nouns".format("rare_" if rare else "")]
-                elif role == "3":
-                    dest_list = self.ROLE_3["{}nouns".format("rare_" if rare else "")]
-                dest_list.append(noun)
-
-            else:
-                print(f"Warning: The word '{line}' in the {'RARE' if rare else ''} NOUNS wordlist wasn't configured correctly! Ensure each entry has a comma followed by its role.")
-
-    def load_adjectives(self):
-        lines = []
-        with open("words/adjectives.txt", "r") as f:
-            lines += [(x.lower().strip(), False) for x in f.readlines()]
-        with open("words/rare_adjectives.txt", "r") as f:
-            lines += [(x.lower().strip(), True) for x in f.readlines()]
-
-        for (line, rare) in lines:
-            parts = line.split(",")
-            if len(parts) == 2:
-                noun, role = parts
-                if role == "0":
-                    dest_list = self.ROLE_0["{}adjectives".format("rare_" if rare else "")]
-                elif role == "1":
-                    dest_list = self.ROLE_1["{}adjectives".format("rare_" if rare else "")]
-                elif role == "2":
-                    dest_list = self.ROLE_2["{}adjectives".format("rare_" if rare else "")]
-                elif role == "3":
-                    dest_list = self.ROLE_3["{}adjectives".format("rare_" if rare else "")]
-                dest_list.append(noun)
-
-            else:
-                print(f"Warning: The word '{line}' in the {'RARE' if rare else ''} ADJECTIVES wordlist wasn't configured correctly! Ensure each entry has a comma followed by its role.")
+    def load_compiled(self, path):
+        """
+        Builds the samplers from a memory-mapped compiled wordlist
+        :param path: compiled wordlist path
+        :return:
+        """
+        self._compiled, sections = wordlist.open_compiled(path)
+        self.samplers = {k: WordSampler(words, common_count) for k, (words, common_count) in sections.items()}
 
-    def load_verbs(self):
-        with open("words/verbs.txt", "r") as f:
-            self.VERBS = [x.lower().strip() for x in f.readlines()]
+    def sampler(self, kind, role=None):
+        """
+        Returns the `WordSampler` of a word kind for a role.
+        Roles without words of that kind get the sampler with the words of all roles.
+        :param kind: `nouns`, `adjectives` or `verbs`
+        :param role: role number, or `None` for all roles
+        :return: `WordSampler` object
+        """
+        sampler = self.samplers.get((kind, role))
+        if sampler is None or len(sampler) == 0:
+            sampler = self.samplers[(kind, None)]
+        return sampler
 
     def load(self):
-        self.load_nouns()
-        self.load_adjectives()
-        self.load_verbs()
\ No newline at end of file
+        """
+        Loads the compiled wordlist if it's up to date and valid, the text wordlists otherwise
+        :return:
+        """
+        directory, path = Config()["WORDS_DIR"], Config()["WORDS_FILE"]
+        if wordlist.is_up_to_date(directory, path):
+            try:
+                self.load_compiled(path)
+                logger.debug("Loaded compiled wordlist %s", path)
+                return
+            except ValueError as e:
+                logger.warning("Can't load compiled wordlist (%s), compile it again with `python -m utils.wordlist`", e)
+        self.load_text(directory)
+        logger.debug("Loaded text wordlists from %s (compile them with `python -m utils.wordlist`)", directory)
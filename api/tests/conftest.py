@@ -0,0 +1,43 @@
+import asyncio
+import os
+
+import pytest
+
+from utils.singleton import destroy_all
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# `asyncio.Task.all_tasks` before Python 3.7
+all_tasks = getattr(asyncio, "all_tasks", None) or asyncio.Task.all_tasks
+
+
+@pytest.fixture
+def loop():
+    """
+    New event loop for each test, closed with its pending tasks afterwards.
+    Singletons are reset too, so nothing (schedulers, game ids...) leaks between tests.
+    """
+    # Importing some modules (e.g. `server`) creates singletons
+    destroy_all()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    tasks = [x for x in all_tasks(loop) if not x.done()]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+    asyncio.set_event_loop(None)
+    destroy_all()
+
+
+@pytest.fixture
+def environment(loop, monkeypatch):
+    """
+    Words and layouts loaded and sio emits replaced with no-ops, like the benchmarks (see `benchmark.micro`)
+    """
+    from benchmark.micro import setup_environment
+
+    monkeypatch.chdir(API_DIR)
+    setup_environment()
+    return loop
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from utils.bus_client_manager import BusClientManager
+from utils.message_bus import MessageBus
+
+
+class RecordingBus(MessageBus):
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish(self, message):
+        self.published.append(message["data"])
+
+
+class Server:
+    def __init__(self):
+        self.emitted = []
+
+    def _emit_internal(self, sid, event, data, namespace=None, id=None):
+        self.emitted.append((sid, event))
+        # A future rather than a coroutine, python-socketio passes them to `asyncio.wait`
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(None)
+        return future
+
+
+@pytest.fixture
+def manager(loop):
+    manager = BusClientManager(RecordingBus(), owns_room=lambda room: room.startswith("game/"))
+    manager.set_server(Server())
+    manager.connect("local", "/")
+    return manager
+
+
+def published_emits(manager, loop, room):
+    manager.bus.published.clear()
+    loop.run_until_complete(manager.emit("event", {}, namespace="/", room=room))
+    return [x["room"] for x in manager.bus.published if x["method"] == "emit"]
+
+
+def test_emits_to_local_sids_and_owned_rooms_stay_local(loop, manager):
+    manager.enter_room("local", "/", "game/A")
+    assert published_emits(manager, loop, "local") == []
+    assert published_emits(manager, loop, "game/A") == []
+    assert manager.server.emitted == [("local", "event"), ("local", "event")]
+
+
+def test_emits_reaching_other_workers_are_published(loop, manager):
+    manager.enter_room("local", "/", "lobby")
+    assert published_emits(manager, loop, "lobby") == ["lobby"]
+    assert published_emits(manager, loop, None) == [None]
+    # Sid of a socket connected to another worker
+    assert published_emits(manager, loop, "remote") == ["remote"]
+
+    # Remote player of a game of this worker
+    manager.enter_room("remote", "/", "game/A")
+    assert published_emits(manager, loop, "game/A") == ["game/A"]
+    manager.leave_room("remote", "/", "game/A")
+    assert published_emits(manager, loop, "game/A") == []
+
+
+def test_local_message_bus_needs_a_single_worker(loop, monkeypatch):
+    from singletons import cluster
+
+    monkeypatch.setenv("MESSAGE_BUS", "local")
+    monkeypatch.setenv("WORKERS", "2")
+    monkeypatch.setenv("WORKER_ID", "0")
+    with pytest.raises(ValueError):
+        cluster.check_config()
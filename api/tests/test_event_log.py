@@ -0,0 +1,48 @@
+import pytest
+
+from utils import event_log
+
+EPOCH = 1700000000.0
+RECORDS = [
+    (event_log.CREATE, 0, "ABCDE", (123456789, True, 4, "partita")),
+    (event_log.JOIN, 5, "ABCDE", (7,)),
+    (event_log.COMMAND, 10, "ABCDE", (7, "spinotto", None)),
+    (event_log.COMMAND, 11, "ABCDE", (7, "leva", True)),
+    (event_log.COMMAND, 12, "ABCDE", (7, "manopola", -3)),
+    (event_log.COMMAND, 13, "ABCDE", (7, "pulsante", "è")),
+    (event_log.INSTRUCTION, 20, "ABCDE", (7, None, "leva", False)),
+    (event_log.HEALTH, 30, "ABCDE", (42.5, 10.0)),
+    (event_log.LEVEL, 40, "FGHIJ", (2, "")),
+]
+
+
+def encode(records):
+    data = bytearray(event_log.header(EPOCH))
+    for x in records:
+        event_log.encode(data, *x)
+    return bytes(data)
+
+
+def decoded(records):
+    return [(kind, EPOCH + ms / 1000, game_id, fields) for kind, ms, game_id, fields in records]
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "events.log"
+    path.write_bytes(encode(RECORDS))
+    assert [tuple(x) for x in event_log.read(str(path))] == decoded(RECORDS)
+
+
+def test_truncated_tail_is_skipped():
+    data = encode(RECORDS)
+    last = len(encode(RECORDS[:-1]))
+    for end in range(last, len(data)):
+        records = event_log.decode(data[:end], EPOCH, event_log.HEADER.size)
+        assert [tuple(x) for x in records] == decoded(RECORDS[:-1])
+
+
+def test_not_an_event_log(tmp_path):
+    path = tmp_path / "events.log"
+    path.write_bytes(b"nope" + encode(RECORDS)[4:])
+    with pytest.raises(event_log.EventLogError):
+        list(event_log.read(str(path)))
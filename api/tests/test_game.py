@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from benchmark.micro import make_game
+from singletons.scheduler import Scheduler
+from utils.special_commands import DummyAsteroidCommand, DummyBlackHoleCommand
+
+
+@pytest.fixture
+def game(environment):
+    Scheduler().use_virtual_clock(0)
+    return make_game(environment)
+
+
+def test_detached_players_are_not_targeted(loop, game):
+    source, away = game.slots
+    loop.run_until_complete(game.detach_client(away.client))
+    assert away.detached
+    for _ in range(20):
+        loop.run_until_complete(game.generate_instruction(source))
+        assert source.instruction.target is source
+
+
+def test_detached_players_do_not_hold_back_black_holes(loop, game):
+    source, away = game.slots
+    game.difficulty["black_hole_chance"] = 1
+    loop.run_until_complete(game.generate_instruction(source))
+    assert isinstance(source.instruction.target_command, DummyBlackHoleCommand)
+
+    loop.run_until_complete(game.detach_client(away.client))
+    loop.run_until_complete(game.defeat_special(source.client, black_hole=True))
+    assert game.instructions_by_special_command[DummyBlackHoleCommand] == []
+    assert not isinstance(source.instruction.target_command, DummyBlackHoleCommand)
+
+
+def test_commands_instructed_twice_stay_indexed(loop, game):
+    # A single command in every grid, so the fallback gives both instructions the same one
+    command = game.slots[0].grid.objects[0]
+    for slot in game.slots:
+        slot.grid.objects = [command]
+    game.difficulty["asteroid_chance"] = game.difficulty["black_hole_chance"] = 0
+    for slot in game.slots:
+        loop.run_until_complete(game.generate_instruction(slot))
+    assert game.instructed_commands[command] == 2
+
+    game.remove_instruction(game.slots[0].instruction)
+    assert command in game.instructed_commands
+    game.remove_instruction(game.slots[1].instruction)
+    assert command not in game.instructed_commands
+
+
+def test_game_info_payload_follows_changes(loop, environment):
+    import json
+
+    from server.client import Client
+    from server.game import Game
+    from singletons.client_manager import ClientManager
+    from singletons.lobby_manager import LobbyManager
+
+    def info():
+        return json.loads(match.game_info_payload().text)
+
+    match = Game(name="lobby", public=False)
+    loop.run_until_complete(LobbyManager().add_game(match))
+    clients = [Client("sid{}".format(i)) for i in range(2)]
+    for client in clients:
+        ClientManager().add_client(client)
+        loop.run_until_complete(match.join_client(client))
+    payload = match.game_info_payload()
+    assert match.game_info_payload() is payload
+    assert [x["ready"] for x in info()["slots"]] == [False, False]
+
+    loop.run_until_complete(match.ready(clients[1]))
+    assert [x["ready"] for x in info()["slots"]] == [False, True]
+    loop.run_until_complete(match.update_settings(size=3, public=True))
+    assert (info()["max_players"], info()["public"], info()["slots"][2]) == (3, True, None)
+    loop.run_until_complete(match.remove_client(clients[0]))
+    assert [(x["uid"], x["host"]) for x in info()["slots"] if x is not None] == [(clients[1].uid, True)]
+
+
+def test_instruction_completed_while_its_expiry_is_due(loop, game):
+    game.difficulty["asteroid_chance"] = game.difficulty["black_hole_chance"] = 0
+    for x in game.slots:
+        loop.run_until_complete(game.generate_instruction(x))
+    slot = game.slots[0]
+    instruction = slot.instruction
+    scheduler = Scheduler()
+    scheduler._now = slot.next_generation_timer.deadline
+    # Run everything due before the expiry
+    timer = scheduler._pop_due()
+    while timer is not slot.next_generation_timer:
+        task = scheduler._run(timer)
+        if task is not None:
+            loop.run_until_complete(task)
+        timer = scheduler._pop_due()
+
+    # The player completes the instruction in a handler that runs before the expiry task starts
+    target = instruction.target if instruction.target is not None else slot
+    health = game.health
+    command = loop.create_task(
+        game.do_command(target.client, instruction.target_command.name, instruction.value)
+    )
+    expiry = scheduler._run(timer)
+    loop.run_until_complete(asyncio.gather(command, expiry))
+    assert slot.instruction is not instruction and slot.instruction in game.instructions
+    assert game.health == health
+
+
+def test_specials_completed_after_next_level_are_not_replaced(loop, game):
+    game.difficulty["asteroid_chance"] = 1
+    for slot in game.slots:
+        loop.run_until_complete(game.generate_instruction(slot))
+    assert len(game.instructions_by_special_command[DummyAsteroidCommand]) == 2
+
+    # The first completed asteroid instruction moves to the next level, which clears the others
+    game.health = 100
+    level = game.level
+    for slot in game.slots:
+        loop.run_until_complete(game.defeat_special(slot.client, black_hole=False))
+    assert game.level == level + 1
+    assert not game.instructions
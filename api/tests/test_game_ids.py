@@ -0,0 +1,41 @@
+import pytest
+
+from utils import game_ids
+
+
+@pytest.mark.parametrize("size", [1, 2, 31, 32, 1000, 32 ** 3 // 3])
+def test_permutation_is_a_bijection(size):
+    permutation = game_ids.Permutation(size, key=42)
+    values = [permutation(x) for x in range(size)]
+    assert sorted(values) == list(range(size))
+    assert [permutation.inverse(x) for x in values] == list(range(size))
+
+
+def test_permutation_depends_on_key():
+    size = 32 ** 3
+    a, b = game_ids.Permutation(size, key=1), game_ids.Permutation(size, key=2)
+    assert [a(x) for x in range(100)] != [b(x) for x in range(100)]
+
+
+def test_encode_decode():
+    for value in (0, 1, 31, 32, 12345, 32 ** 5 - 1):
+        code = game_ids.encode(value, 5)
+        assert len(code) == 5
+        assert game_ids.decode(code) == value
+    assert game_ids.decode(game_ids.normalize(" o1li2 ")) == game_ids.decode("01112")
+    assert game_ids.decode("AB!CD") is None
+
+
+def test_allocator_codes_are_owned_by_their_worker():
+    allocators = [game_ids.GameIdAllocator(worker_id=i, workers=3, length=2, key=7) for i in range(3)]
+    codes = [[x.allocate() for _ in range(x.capacity)] for x in allocators]
+    for worker_id, worker_codes in enumerate(codes):
+        assert len(set(worker_codes)) == len(worker_codes)
+        assert all(game_ids.decode(x) % 3 == worker_id for x in worker_codes)
+    with pytest.raises(RuntimeError):
+        allocators[0].allocate()
+
+    # Freed codes are reused oldest first
+    allocators[0].free(codes[0][5])
+    allocators[0].free(codes[0][2])
+    assert [allocators[0].allocate() for _ in range(2)] == [codes[0][5], codes[0][2]]
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from benchmark.micro import make_game
+from utils import json_backend
+from utils.json_backend import RawJSON
+
+
+def installed(name):
+    try:
+        return json_backend.load_backend(name)
+    except ImportError:
+        pytest.skip("{} is not installed".format(name))
+
+
+@pytest.fixture(params=["json", "orjson", "ujson"])
+def backend(request):
+    return installed(request.param)
+
+
+def splice(obj, backend):
+    """
+    Replaces the values under `"raw"` keys with `RawJSON` objects
+    """
+    if type(obj) is dict:
+        return {k: RawJSON(backend.dumps(v)) if k == "raw" else splice(v, backend) for k, v in obj.items()}
+    if type(obj) is list:
+        return [splice(x, backend) for x in obj]
+    return obj
+
+
+PAYLOADS = [
+    {"raw": {"a": 1}},
+    {"raw": [1, "two", None, 3.5, True]},
+    {"a": {"b": {"raw": {"c": [1, 2, {"d": "é\"\n"}]}}, "e": [{"raw": []}, {"raw": {}}]}},
+    [{"raw": "text"}, [{"raw": 0}, [{"x": {"raw": {"y": None}}}]]],
+    ["event", {"raw": {"objects": [{"name": "a", "value": 1}]}}, {"id": 1}],
+]
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_spliced_payload_matches_json_dumps(backend, payload):
+    text = backend.dumps(splice(payload, backend))
+    assert json.loads(text) == payload
+    # The standard library formatting, when it's the backend
+    if backend.name == "json":
+        assert text == json.dumps(payload, separators=(",", ":"))
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_default_expands_raw_json(backend, payload):
+    assert json.loads(json.dumps(splice(payload, backend), default=json_backend.default)) == payload
+
+
+@pytest.fixture
+def game(environment):
+    return make_game(environment)
+
+
+def test_grid_payloads(game):
+    for slot in game.slots:
+        payload = slot.grid.payload()
+        assert type(payload) is RawJSON
+        assert json.loads(payload.text) == json.loads(json.dumps(slot.grid.to_payload()))
+        # As a socket.io packet, and nested in another payload
+        packet = json_backend.get_backend().dumps(["grid", payload])
+        assert json.loads(packet) == ["grid", slot.grid.to_payload()]
+        nested = json_backend.get_backend().dumps({"grids": [payload]})
+        assert json.loads(nested) == {"grids": [slot.grid.to_payload()]}
+
+
+def test_grid_payload_is_invalidated(game):
+    grid = game.slots[0].grid
+    before = grid.payload()
+    assert grid.payload() is before
+    o = grid.objects[0]
+    grid.rename_object(o, o.name + "x")
+    assert grid.payload() is not before
+    assert json.loads(grid.payload().text) == json.loads(json.dumps(grid.to_payload()))
+
+
+def test_game_info_payload(game):
+    payload = game.game_info_payload()
+    assert json.loads(payload.text) == json.loads(json.dumps(game.sio_game_info()))
+    packet = json_backend.get_backend().dumps(["game_info", payload])
+    assert json.loads(packet) == ["game_info", json.loads(json.dumps(game.sio_game_info()))]
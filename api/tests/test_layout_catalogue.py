@@ -0,0 +1,99 @@
+import collections
+import math
+import random
+
+import pytest
+
+from constants import layout_cells
+from singletons.layout_catalogue import LayoutCatalogue, fill_cells, free_space_right, next_empty, unpack
+
+SAMPLES = 20000
+
+
+def old_layout(rng):
+    """
+    Grid layout drawn cell by cell, like `Grid` did before the catalogue
+    :return: list of `(y, x, type, length)` tuples, in filling order
+    """
+    grid = [[layout_cells.EMPTY] * 4 for _ in range(4)]
+    shapes = []
+    while next_empty(grid) is not None:
+        y, x = next_empty(grid)
+        fsr = free_space_right(grid, y, x)
+        if fsr == 1:
+            pool = [layout_cells.SQUARE, layout_cells.VERTICAL_RECTANGLE]
+        else:
+            pool = [
+                layout_cells.SQUARE, layout_cells.VERTICAL_RECTANGLE,
+                layout_cells.HORIZONTAL_RECTANGLE, layout_cells.BIG_SQUARE
+            ]
+        if y == 3:
+            pool = list(filter(lambda z: z not in [layout_cells.VERTICAL_RECTANGLE, layout_cells.BIG_SQUARE], pool))
+        length = 1
+        _type = rng.choice(pool) if len(pool) != 0 else layout_cells.SQUARE
+        if _type == layout_cells.HORIZONTAL_RECTANGLE:
+            length = rng.randint(2, 3) if fsr > 2 else 2
+        if _type == layout_cells.VERTICAL_RECTANGLE:
+            length = rng.randint(2, 3) if y <= 1 else 2
+        if _type == layout_cells.BIG_SQUARE:
+            length = 2
+        fill_cells(grid, y, x, _type, length)
+        shapes.append((y, x, _type, length))
+    return shapes
+
+
+@pytest.fixture(scope="module")
+def catalogue():
+    catalogue = LayoutCatalogue()
+    catalogue.load()
+    layouts = []
+    previous = 0
+    for i, cumulative in enumerate(catalogue._cumulative_weights):
+        shapes = [unpack(v) for v in catalogue._shapes[catalogue._offsets[i]:catalogue._offsets[i + 1]]]
+        layouts.append((shapes, cumulative - previous))
+        previous = cumulative
+    return layouts
+
+
+def assert_same_distribution(expected, observed):
+    """
+    :param expected: outcome: probability
+    :param observed: outcome: count in `SAMPLES` draws
+    """
+    assert set(observed) <= set(expected)
+    for outcome, p in expected.items():
+        frequency = observed.get(outcome, 0) / SAMPLES
+        # 5 standard deviations, with a floor for outcomes too rare to be drawn
+        assert abs(frequency - p) <= max(5 * math.sqrt(p * (1 - p) / SAMPLES), 1 / SAMPLES), outcome
+
+
+def marginals(catalogue, key):
+    expected = collections.Counter()
+    for shapes, weight in catalogue:
+        expected[key(shapes)] += weight
+    rng = random.Random(1234)
+    observed = collections.Counter(key(old_layout(rng)) for _ in range(SAMPLES))
+    return expected, observed
+
+
+def test_weights_sum_to_one(catalogue):
+    assert math.fsum(weight for _, weight in catalogue) == pytest.approx(1)
+
+
+def test_layout_count_marginal(catalogue):
+    assert_same_distribution(*marginals(catalogue, len))
+
+
+def test_first_shape_marginal(catalogue):
+    assert_same_distribution(*marginals(catalogue, lambda shapes: shapes[0][2:]))
+
+
+def test_samples_are_valid_layouts(catalogue):
+    rng = random.Random(1)
+    for _ in range(200):
+        shapes = LayoutCatalogue().sample(rng)
+        grid = [[layout_cells.EMPTY] * 4 for _ in range(4)]
+        for y, x, _type, length in shapes:
+            assert grid[y][x] == layout_cells.EMPTY
+            fill_cells(grid, y, x, _type, length)
+        assert next_empty(grid) is None
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from utils import game_ids
+
+
+def lobby_manager():
+    # Not imported at the top, `singletons.lobby_manager` must be imported after `server` (like in happycity.py)
+    import server.game  # noqa: F401
+    from singletons.lobby_manager import LobbyManager
+    return LobbyManager()
+
+
+@pytest.fixture
+def cluster(loop, monkeypatch):
+    # Worker 0 of 2, the bus is not started
+    monkeypatch.setenv("WORKERS", "2")
+    monkeypatch.setenv("WORKER_ID", "0")
+
+
+def info(value, players=1, max_players=2):
+    return {
+        "game_id": game_ids.encode(value, 5), "name": "game {}".format(value),
+        "players": players, "max_players": max_players, "public": True,
+    }
+
+
+def lobby_ids():
+    return sorted(x["game_id"] for x in lobby_manager().sorted_lobby())
+
+
+def test_replace_remote_lobby(cluster):
+    # Odd values are hosted by worker 1
+    lobby_manager().update_remote_lobby(added=[info(1), info(3), info(2)])
+    lobby_manager().replace_remote_lobby(1, [info(5), info(3, players=2)])
+    assert lobby_ids() == sorted(game_ids.encode(x, 5) for x in (2, 3, 5))
+    assert {x["game_id"]: x["players"] for x in lobby_manager().sorted_lobby()}[game_ids.encode(3, 5)] == 2
+
+
+@pytest.fixture
+def deltas(loop, monkeypatch):
+    from singletons.sio import Sio
+
+    emitted = []
+
+    async def emit(event, data=None, **kwargs):
+        emitted.append((event, json.loads(data.text)))
+
+    lobby_manager()
+    monkeypatch.setattr(Sio(), "emit", emit)
+    return emitted
+
+
+def test_lobby_changes_are_coalesced(loop, deltas):
+    manager = lobby_manager()
+    manager.update_lobby_game(info(1))
+    manager.update_lobby_game(info(1, players=2))
+    manager.update_lobby_game(info(2))
+    manager.remove_lobby_game(info(2)["game_id"])
+    loop.run_until_complete(manager.flush_lobby())
+    assert deltas == [("lobby_delta", {"added": [info(1, players=2)], "updated": [], "removed": []})]
+
+    manager.update_lobby_game(info(1))
+    loop.run_until_complete(manager.flush_lobby())
+    manager.remove_lobby_game(info(1)["game_id"])
+    loop.run_until_complete(manager.flush_lobby())
+    assert deltas[1:] == [
+        ("lobby_delta", {"added": [], "updated": [info(1)], "removed": []}),
+        ("lobby_delta", {"added": [], "updated": [], "removed": [info(1)["game_id"]]}),
+    ]
+    # Nothing left to send
+    loop.run_until_complete(manager.flush_lobby())
+    assert len(deltas) == 3
+
+
+def test_remote_lobby_deltas(loop):
+    manager = lobby_manager()
+    manager.update_remote_lobby(added=[info(1), info(2), info(3, players=2)])
+    # Joinable games first, fullest first
+    assert [x["game_id"] for x in manager.sorted_lobby()] == [game_ids.encode(x, 5) for x in (1, 2, 3)]
+
+    manager.update_remote_lobby(updated=[info(2, players=2, max_players=4)], removed=[info(1)["game_id"]])
+    assert [(x["game_id"], x["players"]) for x in manager.sorted_lobby()] == [
+        (game_ids.encode(2, 5), 2), (game_ids.encode(3, 5), 2)
+    ]
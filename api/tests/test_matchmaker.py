@@ -0,0 +1,64 @@
+import pytest
+
+from tests.test_lobby import info, lobby_manager
+from utils import game_ids
+
+
+@pytest.fixture
+def cluster(loop, monkeypatch):
+    # Worker 0 of 2, messages to the other worker are recorded instead of published
+    monkeypatch.setenv("WORKERS", "2")
+    monkeypatch.setenv("WORKER_ID", "0")
+
+
+@pytest.fixture
+def published(cluster, environment, monkeypatch):
+    from singletons.cluster import Cluster
+
+    messages = []
+    monkeypatch.setattr(Cluster(), "publish", lambda _type, to=None, **data: messages.append((_type, to, data)))
+    return messages
+
+
+def quick_match(loop, **kwargs):
+    lobby_manager()
+    from server.client import Client
+    from singletons.client_manager import ClientManager
+    from singletons.matchmaker import Matchmaker
+
+    client = Client("sid")
+    ClientManager().add_client(client)
+    loop.run_until_complete(Matchmaker().quick_match(client, 2, **kwargs))
+    return client
+
+
+def test_remote_join_failure_tries_next_game(loop, published):
+    # Odd values are hosted by worker 1
+    lobby_manager().update_remote_lobby(added=[info(1), info(3)])
+    from singletons.matchmaker import Matchmaker
+
+    client = quick_match(loop)
+    first = published[-1][2]["game_id"]
+    assert published[-1][0] == "join"
+
+    loop.run_until_complete(Matchmaker().join_failed(client, first))
+    second = published[-1][2]["game_id"]
+    assert published[-1][0] == "join"
+    assert {first, second} == {game_ids.encode(1, 5), game_ids.encode(3, 5)}
+
+    # No games left: the client waits in the queue
+    loop.run_until_complete(Matchmaker().join_failed(client, second))
+    assert len(published) == 2
+    assert Matchmaker().cancel(client)
+
+
+def test_host_created_games_are_not_auto_started(loop, published):
+    lobby_manager()
+    from server.game import Game
+
+    match = Game(name="host", public=True)
+    match.max_players = 2
+    loop.run_until_complete(lobby_manager().add_game(match))
+    quick_match(loop)
+    assert len(match.slots) == 1
+    assert not match.auto_start
@@ -0,0 +1,90 @@
+import asyncio
+import socket
+
+import pytest
+
+from utils.message_bus import SocketMessageBus
+
+
+@pytest.fixture
+def port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(loop, condition, timeout=5):
+    async def wait():
+        while not condition():
+            await asyncio.sleep(0.01)
+    loop.run_until_complete(asyncio.wait_for(wait(), timeout))
+
+
+def test_messages_reach_every_worker(loop, port):
+    hub, worker = SocketMessageBus("127.0.0.1", port, hub=True), SocketMessageBus("127.0.0.1", port)
+    received = []
+    hub.subscribe(lambda x: received.append(("hub", x)))
+    worker.subscribe(lambda x: received.append(("worker", x)))
+    loop.run_until_complete(hub.start())
+    loop.run_until_complete(worker.start())
+    worker.publish({"n": 1})
+    wait_for(loop, lambda: len(received) == 2)
+    assert sorted(received) == [("hub", {"n": 1}), ("worker", {"n": 1})]
+    loop.run_until_complete(worker.close())
+    loop.run_until_complete(hub.close())
+
+
+def test_reconnects_when_the_hub_restarts(loop, port, monkeypatch):
+    monkeypatch.setattr(SocketMessageBus, "RECONNECT_MAX_DELAY", 0.2)
+    hub, worker = SocketMessageBus("127.0.0.1", port, hub=True), SocketMessageBus("127.0.0.1", port)
+    received, reconnected = [], []
+    worker.subscribe(received.append)
+    worker.on_reconnect(lambda: reconnected.append(True))
+    loop.run_until_complete(hub.start())
+    loop.run_until_complete(worker.start())
+    assert worker.connected
+
+    # Worker 0 goes away
+    loop.run_until_complete(hub.close())
+    wait_for(loop, lambda: not worker.connected)
+    worker.publish({"lost": True})
+    assert worker.dropped == 1
+    loop.run_until_complete(asyncio.sleep(0.5))
+    assert not worker.connected
+
+    # And comes back
+    hub = SocketMessageBus("127.0.0.1", port, hub=True)
+    loop.run_until_complete(hub.start())
+    wait_for(loop, lambda: worker.connected)
+    assert reconnected == [True]
+    assert worker.dropped == 0
+    worker.publish({"n": 2})
+    wait_for(loop, lambda: received)
+    assert received == [{"n": 2}]
+    loop.run_until_complete(worker.close())
+    loop.run_until_complete(hub.close())
+
+
+def test_hub_disconnects_workers_that_dont_read(loop, port, monkeypatch):
+    monkeypatch.setattr(SocketMessageBus, "PEER_BUFFER_LIMIT", 2 ** 16)
+    hub, worker = SocketMessageBus("127.0.0.1", port, hub=True), SocketMessageBus("127.0.0.1", port)
+    loop.run_until_complete(hub.start())
+    loop.run_until_complete(worker.start())
+    # A worker stuck without reading its connection
+    stuck = loop.run_until_complete(asyncio.open_connection("127.0.0.1", port))[1]
+    wait_for(loop, lambda: len(hub._peers) == 3)
+
+    received = []
+    hub.subscribe(received.append)
+    message = {"data": "x" * 2 ** 14}
+    for _ in range(2000):
+        worker.publish(message)
+        loop.run_until_complete(asyncio.sleep(0))
+        if len(hub._peers) == 2:
+            break
+    assert len(hub._peers) == 2
+    assert worker.connected
+    wait_for(loop, lambda: received)
+    stuck.close()
+    loop.run_until_complete(worker.close())
+    loop.run_until_complete(hub.close())
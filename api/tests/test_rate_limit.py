@@ -0,0 +1,32 @@
+import pytest
+
+from utils.rate_limit import TokenBucket, allow
+
+
+def test_burst_then_drop():
+    bucket = TokenBucket(rate=10, burst=3, now=0)
+    assert [bucket.take(0) for _ in range(4)] == [True, True, True, False]
+
+
+def test_refill():
+    bucket = TokenBucket(rate=10, burst=3, now=0)
+    for _ in range(3):
+        bucket.take(0)
+    # One token every 0.1s
+    assert not bucket.take(0.05)
+    assert bucket.take(0.1)
+    assert not bucket.take(0.1)
+    # Never more than `burst` tokens, however long the client waited
+    assert [bucket.take(100) for _ in range(4)] == [True, True, True, False]
+    assert bucket.tokens == pytest.approx(0)
+
+
+def test_allow_keeps_a_bucket_per_event():
+    class Client:
+        rate_limits = None
+
+    client = Client()
+    assert allow(client, "command", 1, 1, now=0)
+    assert not allow(client, "command", 1, 1, now=0.5)
+    assert allow(client, "defeat_asteroid", 1, 1, now=0.5)
+    assert allow(client, "command", 1, 1, now=1)
@@ -0,0 +1,155 @@
+import pytest
+
+from benchmark.micro import make_game
+from singletons.scheduler import Scheduler
+
+INTERVAL = 10
+GAME_IDLE_TTL = 60
+GAME_FINISHED_TTL = 30
+CLIENT_IDLE_TTL = 100
+
+
+@pytest.fixture
+def ttls(loop, monkeypatch):
+    # Before `environment` reads the config
+    monkeypatch.setenv("REAPER_INTERVAL", str(INTERVAL))
+    monkeypatch.setenv("GAME_IDLE_TTL", str(GAME_IDLE_TTL))
+    monkeypatch.setenv("GAME_FINISHED_TTL", str(GAME_FINISHED_TTL))
+    monkeypatch.setenv("CLIENT_IDLE_TTL", str(CLIENT_IDLE_TTL))
+
+
+@pytest.fixture
+def reaper(ttls, environment):
+    """
+    Reaper sweeping on a virtual clock, with the events it emits and the sockets it disconnects in `reaper.sent`
+    """
+    import server
+    from singletons.reaper import Reaper
+    from singletons.sio import Sio
+
+    Scheduler().use_virtual_clock(0)
+    sent = []
+
+    async def emit(event, *args, room=None, **kwargs):
+        if event in ("game_expired", "idle_disconnect"):
+            sent.append((event, room))
+
+    async def disconnect(sid, **kwargs):
+        sent.append(("disconnect", sid))
+        # Like the `disconnect` handler
+        await server.disconnect(sid)
+
+    sio = Sio()
+    sio.emit = emit
+    sio.disconnect = disconnect
+    reaper = Reaper()
+    reaper.sent = sent
+    reaper.start()
+    return reaper
+
+
+def advance(loop, until):
+    loop.run_until_complete(Scheduler().advance(until))
+
+
+def connected():
+    from singletons.client_manager import ClientManager
+
+    return dict(ClientManager().items())
+
+
+def new_client(sid):
+    from server.client import Client
+    from singletons.client_manager import ClientManager
+
+    client = Client(sid)
+    ClientManager().add_client(client)
+    return client
+
+
+def test_idle_client_is_disconnected(loop, reaper):
+    idle = new_client("idle")
+    active = new_client("active")
+    for t in range(INTERVAL, CLIENT_IDLE_TTL, INTERVAL):
+        advance(loop, t)
+        # An event received from the client
+        active.last_activity = Scheduler().time()
+    assert reaper.sent == []
+
+    advance(loop, CLIENT_IDLE_TTL)
+    assert reaper.sent == [("idle_disconnect", "idle"), ("disconnect", "idle")]
+    assert "idle" not in connected()
+    assert active.sid in connected()
+
+    # Quiet since its last event
+    last_activity = active.last_activity
+    advance(loop, last_activity + CLIENT_IDLE_TTL - INTERVAL)
+    assert active.sid in connected()
+    advance(loop, last_activity + CLIENT_IDLE_TTL)
+    assert active.sid not in connected()
+
+
+def test_players_are_not_disconnected(loop, reaper):
+    game = make_game(loop)
+    advance(loop, CLIENT_IDLE_TTL * 2)
+    assert not game.disposing
+    assert all(x.client.sid in connected() for x in game.slots)
+    assert reaper.sent == []
+
+
+def lobby_game(loop, *clients):
+    from server.game import Game
+    from singletons.lobby_manager import LobbyManager
+
+    game = Game(name="lobby", public=True)
+    loop.run_until_complete(LobbyManager().add_game(game))
+    for client in clients:
+        loop.run_until_complete(game.join_client(client))
+    return game
+
+
+def test_abandoned_lobby_game_is_disposed(loop, reaper):
+    from singletons.lobby_manager import LobbyManager
+
+    host, guest = new_client("host"), new_client("guest")
+    abandoned = lobby_game(loop, host)
+    active = lobby_game(loop, guest)
+    for t in range(INTERVAL, GAME_IDLE_TTL, INTERVAL):
+        advance(loop, t)
+        guest.last_activity = Scheduler().time()
+    assert abandoned.uuid in LobbyManager()
+
+    advance(loop, GAME_IDLE_TTL)
+    assert ("game_expired", abandoned.sio_room) in reaper.sent
+    assert abandoned.disposing
+    assert abandoned.uuid not in LobbyManager()
+    assert not host.is_in_game
+    assert active.uuid in LobbyManager()
+    assert guest.game is active
+    # Back in the lobby, it's disconnected only once idle for `CLIENT_IDLE_TTL`
+    assert ("disconnect", "host") not in reaper.sent
+
+
+def test_empty_lobby_game_is_disposed(loop, reaper):
+    from singletons.lobby_manager import LobbyManager
+
+    game = lobby_game(loop)
+    advance(loop, GAME_IDLE_TTL - INTERVAL)
+    assert game.uuid in LobbyManager()
+    advance(loop, GAME_IDLE_TTL)
+    assert game.uuid not in LobbyManager()
+
+
+def test_finished_game_is_disposed(loop, reaper):
+    from singletons.lobby_manager import LobbyManager
+
+    game = make_game(loop)
+    loop.run_until_complete(LobbyManager().add_game(game))
+    advance(loop, INTERVAL)
+    loop.run_until_complete(game.game_over())
+    advance(loop, INTERVAL + GAME_FINISHED_TTL - 1)
+    assert game.uuid in LobbyManager()
+    advance(loop, INTERVAL + GAME_FINISHED_TTL)
+    assert ("game_expired", game.sio_room) in reaper.sent
+    assert game.uuid not in LobbyManager()
+    assert not any(x.is_in_game for x in connected().values())
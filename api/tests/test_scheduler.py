@@ -0,0 +1,201 @@
+import asyncio
+
+import pytest
+
+from singletons.scheduler import Scheduler
+
+
+@pytest.fixture
+def scheduler(loop):
+    scheduler = Scheduler()
+    scheduler.use_virtual_clock(0)
+    return scheduler
+
+
+def advance(loop, until):
+    loop.run_until_complete(Scheduler().advance(until))
+
+
+def test_timers_fire_in_deadline_order(loop, scheduler):
+    fired = []
+    scheduler.call_later(3, fired.append, "c")
+    scheduler.call_later(1, fired.append, "a")
+    scheduler.call_later(2, fired.append, "b")
+    advance(loop, 2.5)
+    assert fired == ["a", "b"]
+    advance(loop, 10)
+    assert fired == ["a", "b", "c"]
+    assert len(scheduler) == 0
+
+
+def test_same_deadline_keeps_scheduling_order(loop, scheduler):
+    fired = []
+    for x in range(5):
+        scheduler.call_later(1, fired.append, x)
+    advance(loop, 1)
+    assert fired == list(range(5))
+
+
+def test_cancel(loop, scheduler):
+    fired = []
+    timer = scheduler.call_later(1, fired.append, "a")
+    scheduler.call_later(2, fired.append, "b")
+    timer.cancel()
+    timer.cancel()
+    assert len(scheduler) == 1
+    assert timer.remaining is None
+    advance(loop, 5)
+    assert fired == ["b"]
+
+
+def test_reschedule(loop, scheduler):
+    fired = []
+    timer = scheduler.call_later(1, fired.append, "a")
+    scheduler.call_later(2, fired.append, "b")
+    advance(loop, 0.5)
+    timer.reschedule(2)
+    assert timer.remaining == 2
+    assert len(scheduler) == 2
+    advance(loop, 2)
+    assert fired == ["b"]
+    advance(loop, 2.5)
+    assert fired == ["b", "a"]
+
+
+def test_reschedule_fired_and_cancelled_timers(loop, scheduler):
+    fired = []
+    timer = scheduler.call_later(1, fired.append, "a")
+    advance(loop, 1)
+    timer.reschedule(1)
+    advance(loop, 2)
+    timer.cancel()
+    timer.reschedule(1)
+    advance(loop, 3)
+    assert fired == ["a", "a", "a"]
+
+
+def test_call_every(loop, scheduler):
+    fired = []
+    timer = scheduler.call_every(1, lambda: fired.append(scheduler.time()), delay=0.5)
+    advance(loop, 3)
+    # Run at the time the clock was moved to, like a busy event loop
+    assert fired == [3, 3, 3]
+    assert timer.remaining == 0.5
+    timer.cancel()
+    advance(loop, 10)
+    assert len(fired) == 3
+
+
+def test_periodic_callback_can_cancel_its_timer(loop, scheduler):
+    fired = []
+
+    def callback():
+        fired.append(None)
+        if len(fired) == 2:
+            timer.cancel()
+
+    timer = scheduler.call_every(1, callback)
+    advance(loop, 10)
+    assert len(fired) == 2
+    assert len(scheduler) == 0
+
+
+def test_coroutine_callbacks_are_awaited_in_order(loop, scheduler):
+    fired = []
+
+    async def callback(x):
+        await asyncio.sleep(0)
+        fired.append(x)
+
+    scheduler.call_later(2, callback, "b")
+    scheduler.call_later(1, callback, "a")
+    advance(loop, 2)
+    assert fired == ["a", "b"]
+
+
+def test_failing_callback_does_not_stop_others(loop, scheduler):
+    fired = []
+
+    async def fail():
+        raise ValueError()
+
+    scheduler.call_later(1, fail)
+    scheduler.call_later(1, lambda: 1 / 0)
+    scheduler.call_later(2, fired.append, "a")
+    advance(loop, 2)
+    assert fired == ["a"]
+
+
+def test_virtual_clock_needs_empty_heap(loop):
+    Scheduler().call_later(1, print)
+    with pytest.raises(RuntimeError):
+        Scheduler().use_virtual_clock()
+
+
+def test_slow_callback_does_not_delay_other_timers(loop):
+    fired = {}
+
+    async def slow():
+        await asyncio.sleep(1)
+        fired["slow"] = loop.time()
+
+    async def fast():
+        fired["fast"] = loop.time()
+
+    start = loop.time()
+    # Like the health drain of a game stuck on an emit, then the instruction expiry of another game
+    Scheduler().call_later(0.01, slow)
+    Scheduler().call_later(0.02, fast)
+    loop.run_until_complete(asyncio.sleep(0.2))
+    assert "slow" not in fired
+    assert fired["fast"] - start < 0.2
+
+
+def test_pause_and_resume(loop, scheduler):
+    fired = []
+    timer = scheduler.call_later(2, fired.append, "a")
+    advance(loop, 0.5)
+    timer.pause()
+    assert timer.remaining == 1.5
+    assert len(scheduler) == 0
+    advance(loop, 10)
+    assert fired == []
+    assert timer.remaining == 1.5
+    timer.resume()
+    advance(loop, 11)
+    assert fired == []
+    advance(loop, 11.5)
+    assert fired == ["a"]
+
+
+def test_paused_timer_can_be_cancelled(loop, scheduler):
+    fired = []
+    timer = scheduler.call_every(1, fired.append, "a")
+    timer.pause()
+    timer.cancel()
+    timer.resume()
+    assert timer.remaining is None
+    advance(loop, 10)
+    assert fired == []
+
+
+@pytest.mark.parametrize("change", ["reschedule", "cancel"])
+def test_due_coroutine_skipped_if_timer_changed_before_running(loop, scheduler, change):
+    fired = []
+
+    async def callback():
+        fired.append(scheduler.time())
+
+    timer = scheduler.call_later(1, callback)
+    scheduler._now = 1
+    # Due and handed to a task, which hasn't started yet
+    task = scheduler._run(scheduler._pop_due())
+    if change == "reschedule":
+        timer.reschedule(5)
+    else:
+        timer.cancel()
+    loop.run_until_complete(task)
+    assert fired == []
+
+    advance(loop, 10)
+    assert fired == ([10] if change == "reschedule" else [])
@@ -0,0 +1,64 @@
+import itertools
+import random
+
+import pytest
+
+from singletons.scheduler import Scheduler
+
+
+@pytest.fixture
+def play(environment):
+    from server.client import Client
+    from server.game import Game
+    from singletons.client_manager import ClientManager
+
+    Scheduler().use_virtual_clock(0)
+    loop = environment
+    sids = itertools.count()
+
+    async def run(seed, global_seed):
+        # Anything else drawing from the global generator must not change the game
+        random.seed(global_seed)
+        game = Game(name="seeded", public=False, seed=seed)
+        for _ in range(2):
+            client = Client("sid{}".format(next(sids)))
+            ClientManager().add_client(client)
+            await game.join_client(client)
+        game.playing = True
+        game.difficulty["game_modifier_chance"] = 0.5
+        levels = []
+        for _ in range(4):
+            random.random()
+            await game.next_level()
+            instructions = []
+            for i in range(10):
+                random.random()
+                slot = game.slots[i % 2]
+                await game.generate_instruction(slot)
+                instruction = slot.instruction
+                instructions.append((
+                    game.slots.index(slot),
+                    game.slots.index(instruction.target) if instruction.target is not None else None,
+                    instruction.command_name, instruction.value,
+                ))
+            levels.append((
+                type(game.game_modifier).__name__,
+                [slot.grid.to_payload() for slot in game.slots],
+                instructions,
+            ))
+        game.cancel_timers()
+        return levels
+
+    return lambda seed, global_seed: loop.run_until_complete(run(seed, global_seed))
+
+
+def test_same_seed_same_game(play):
+    a = play(1234, global_seed=1)
+    b = play(1234, global_seed=2)
+    assert a == b
+    # Several game modifiers came up
+    assert len({modifier for modifier, _, _ in a}) > 1
+
+
+def test_different_seeds_different_games(play):
+    assert play(1, global_seed=1) != play(2, global_seed=1)
@@ -0,0 +1,59 @@
+import pytest
+
+
+@pytest.fixture
+def emitted(environment, monkeypatch):
+    from singletons.sio import Sio
+
+    events = []
+
+    async def emit(event, data=None, room=None, **kwargs):
+        events.append((event, room))
+
+    monkeypatch.setattr(Sio(), "emit", emit)
+    return events
+
+
+def register(**kwargs):
+    import server  # noqa: F401, registers the handlers like happycity.py
+    from singletons.sio import Sio
+    from utils import server as utils_server
+
+    calls = []
+
+    @utils_server.handler("test_event", **kwargs)
+    async def handle(sid, data, client):
+        calls.append((client.sid, data))
+    return Sio().handlers["/"]["test_event"], calls
+
+
+def connect(sid):
+    from server.client import Client
+    from singletons.client_manager import ClientManager
+
+    client = Client(sid)
+    ClientManager().add_client(client)
+    return client
+
+
+def test_arguments_are_validated_and_converted(loop, emitted):
+    pipeline, calls = register(args=(("size", int), ("public", bool), ("name", str, True)))
+    connect("a")
+    loop.run_until_complete(pipeline("a", {"size": "3", "public": True, "name": ""}))
+    assert calls == [("a", {"size": 3, "public": True, "name": ""})]
+
+    loop.run_until_complete(pipeline("a", {"size": "three", "public": True}))
+    loop.run_until_complete(pipeline("a", None))
+    assert len(calls) == 1
+    assert emitted == [("error_missing_arguments", "a")] * 2
+
+
+def test_requirements_and_unknown_clients(loop, emitted):
+    from utils import server as utils_server
+
+    pipeline, calls = register(requires=(utils_server.IN_GAME,))
+    loop.run_until_complete(pipeline("nobody", {}))
+    connect("a")
+    loop.run_until_complete(pipeline("a", {}))
+    assert calls == []
+    assert emitted == [("error_unlinkable_client", "nobody"), ("error_not_in_game", "a")]
@@ -0,0 +1,15 @@
+from singletons.metrics import Metrics
+from singletons.sio import Sio
+
+
+def test_unhandled_events_share_a_latency_label(loop):
+    sio = Sio()
+
+    @sio.on("ready")
+    async def ready(sid, data=None):
+        pass
+
+    for event in ("ready", "ready", "x", "y" * 100, "z"):
+        loop.run_until_complete(sio._trigger_event(event, "/", "sid", None))
+    counts = {key: sum(counts) for key, (counts, _) in Metrics().handler_latency._values.items()}
+    assert counts == {("ready",): 2, ("unknown",): 3}
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from benchmark.micro import make_game
+from server.game import Game
+from singletons.lobby_manager import LobbyManager
+from singletons.scheduler import Scheduler
+
+RESUME_TIMEOUT = 60
+
+
+@pytest.fixture
+def game(environment):
+    loop = environment
+    Scheduler().use_virtual_clock(0)
+    game = make_game(loop)
+    loop.run_until_complete(LobbyManager().add_game(game))
+    loop.run_until_complete(game.warmup_done())
+    loop.run_until_complete(Scheduler().advance(3))
+    return game
+
+
+def restore(loop, game):
+    # Through JSON, like the snapshot file
+    data = json.loads(json.dumps(LobbyManager().snapshot()))
+    loop.run_until_complete(game.dispose())
+    restored, = loop.run_until_complete(LobbyManager().restore(data, RESUME_TIMEOUT))
+    return data["games"][0], restored
+
+
+def test_round_trip(loop, game):
+    health = game.health
+    grids = [x.grid.to_payload() for x in game.slots]
+    instructions = {x.target_command.name for x in game.instructions}
+    data, restored = restore(loop, game)
+    assert restored.uuid == data["id"]
+    assert restored.snapshot() == data
+    assert restored.health == health
+    assert [x.grid.to_payload() for x in restored.slots] == grids
+    assert {x.target_command.name for x in restored.instructions} == instructions
+
+
+def test_restored_game_is_paused_until_a_player_resumes(loop, game):
+    _, restored = restore(loop, game)
+    health = restored.health
+    instructions = {x.target_command.name for x in restored.instructions}
+    loop.run_until_complete(Scheduler().advance(3 + RESUME_TIMEOUT - 1))
+    assert restored.health == health
+    assert {x.target_command.name for x in restored.instructions} == instructions
+
+    loop.run_until_complete(restored.resume_client(restored.slots[0].client))
+    assert not restored.paused
+    loop.run_until_complete(Scheduler().advance(3 + RESUME_TIMEOUT + Game.HEALTH_LOOP_RATE))
+    assert restored.health < health
+    assert not restored.disposing
+
+
+def test_restored_game_is_disposed_if_nobody_resumes(loop, game):
+    _, restored = restore(loop, game)
+    loop.run_until_complete(Scheduler().advance(3 + RESUME_TIMEOUT))
+    assert restored.disposing
+    assert restored.uuid not in LobbyManager()
@@ -0,0 +1,76 @@
+import os
+import shutil
+
+import pytest
+
+from tests.conftest import API_DIR
+from utils import wordlist
+from utils.word_sampler import WordSampler
+
+
+@pytest.fixture
+def words_dir(tmp_path):
+    directory = tmp_path / "words"
+    directory.mkdir()
+    for name in wordlist.TEXT_FILES:
+        shutil.copy(os.path.join(API_DIR, "words", name), str(directory / name))
+    return str(directory)
+
+
+@pytest.fixture
+def storage(loop, monkeypatch, words_dir):
+    from singletons.words_storage import WordsStorage
+
+    monkeypatch.setenv("WORDS_DIR", words_dir)
+    monkeypatch.setenv("WORDS_FILE", os.path.join(words_dir, "words.bin"))
+    return WordsStorage()
+
+
+def test_compiled_matches_text(words_dir):
+    path = os.path.join(words_dir, "words.bin")
+    wordlist.compile_wordlists(words_dir, path)
+    buffer, sections = wordlist.open_compiled(path)
+    text = {k: WordSampler.from_lists(common, rare) for k, (common, rare) in wordlist.read_text(words_dir).items()}
+    assert set(sections) == set(text)
+    for key, (words, common_count) in sections.items():
+        assert list(words) == list(text[key].words), key
+        assert common_count == text[key].common_count, key
+    buffer.close()
+
+
+def test_stale_compiled_file_is_ignored(storage, words_dir):
+    path = os.path.join(words_dir, "words.bin")
+    wordlist.compile_wordlists(words_dir, path)
+    storage.load()
+    assert storage._compiled is not None
+
+    # A text wordlist edited after compiling
+    compiled = os.path.getmtime(path)
+    os.utime(os.path.join(words_dir, "nouns.txt"), (compiled + 10, compiled + 10))
+    assert not wordlist.is_up_to_date(words_dir, path)
+    storage._compiled = None
+    storage.load()
+    assert storage._compiled is None
+    assert len(storage.sampler("nouns")) > 0
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: b"",
+    lambda data: b"nope" + data[4:],
+    lambda data: data[:wordlist.HEADER.size - 1],
+    lambda data: data[:-1],
+])
+def test_corrupt_compiled_file_falls_back_to_text(storage, words_dir, corrupt):
+    path = os.path.join(words_dir, "words.bin")
+    wordlist.compile_wordlists(words_dir, path)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(corrupt(data))
+    assert wordlist.is_up_to_date(words_dir, path)
+    with pytest.raises(ValueError):
+        wordlist.open_compiled(path)
+
+    storage.load()
+    assert storage._compiled is None
+    assert len(storage.sampler("nouns")) > 0
@@ -0,0 +1,113 @@
+import asyncio
+
+from socketio.asyncio_pubsub_manager import AsyncPubSubManager
+
+
+class BusClientManager(AsyncPubSubManager):
+    """
+    python-socketio client manager that shares emits between workers through a `MessageBus`,
+    so emits to a room reach the sockets connected to any worker.
+    Room changes for sockets connected to other workers are published on the bus as well.
+    Emits that can only reach sockets of this worker (a local sid, or a room owned by this worker
+    without members connected elsewhere) are not published.
+    """
+    name = "happycitybus"
+
+    def __init__(self, bus, channel="socketio", owns_room=None):
+        """
+        :param bus: `MessageBus` object
+        :param channel: message type of the messages of this manager on the bus
+        :param owns_room: function that takes a room name and returns `True` if only this worker puts sockets
+                          in that room, or `None` if there are no such rooms
+        """
+        super(BusClientManager, self).__init__(channel=channel)
+        self.bus = bus
+        self.bus.subscribe(self._on_message)
+        self.owns_room = owns_room
+        self._queue = None
+        # (namespace, room): sids connected to other workers put in that room by this worker
+        self._remote_members = {}
+
+    @property
+    def queue(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    def _on_message(self, message):
+        if message.get("type") == self.channel:
+            self.queue.put_nowait(message["data"])
+
+    def _is_local(self, sid, namespace, room):
+        return room is None or room == sid or self.is_connected(sid, namespace) \
+            or sid in self.rooms.get(namespace, {}).get(room, {})
+
+    def _is_local_only(self, namespace, room):
+        """
+        :return: `True` if an emit to `room` can only reach sockets connected to this worker
+        """
+        if room is None:
+            return False
+        if self.is_connected(room, namespace):
+            # Sid of a local socket
+            return True
+        if self.owns_room is None or not self.owns_room(room):
+            # Sockets connected to other workers can be in it (e.g. the lobby), or it's a remote sid
+            return False
+        return not self._remote_members.get((namespace, room))
+
+    def enter_room(self, sid, namespace, room):
+        if self._is_local(sid, namespace, room):
+            super(BusClientManager, self).enter_room(sid, namespace, room)
+        else:
+            self._remote_members.setdefault((namespace, room), set()).add(sid)
+            self.bus.publish({"type": self.channel, "data": {
+                "method": "enter_room", "sid": sid, "namespace": namespace, "room": room
+            }})
+
+    def leave_room(self, sid, namespace, room):
+        if self._is_local(sid, namespace, room):
+            super(BusClientManager, self).leave_room(sid, namespace, room)
+        else:
+            members = self._remote_members.get((namespace, room))
+            if members is not None:
+                members.discard(sid)
+                if not members:
+                    del self._remote_members[(namespace, room)]
+            self.bus.publish({"type": self.channel, "data": {
+                "method": "leave_room", "sid": sid, "namespace": namespace, "room": room
+            }})
+
+    async def emit(self, event, data, namespace=None, room=None, skip_sid=None, callback=None, **kwargs):
+        if callback is not None or kwargs.get("ignore_queue"):
+            return await super(BusClientManager, self).emit(
+                event, data, namespace=namespace, room=room, skip_sid=skip_sid, callback=callback, **kwargs
+            )
+        # Emit to local sockets right away, so room changes that follow the emit
+        # (eg: a game being disposed) don't affect delivery on this worker
+        await super(BusClientManager, self).emit(
+            event, data, namespace=namespace, room=room, skip_sid=skip_sid, ignore_queue=True
+        )
+        if self._is_local_only(namespace or "/", room):
+            return
+        await self._publish({
+            "method": "emit", "event": event, "data": data, "namespace": namespace or "/", "room": room,
+            "skip_sid": skip_sid, "callback": None, "host_id": self.host_id, "origin": self.host_id
+        })
+
+    async def _publish(self, data):
+        self.bus.publish({"type": self.channel, "data": data})
+
+    async def _listen(self):
+        while True:
+            data = await self.queue.get()
+            if data.get("origin") == self.host_id:
+                # Already emitted locally
+                continue
+            method = data.get("method")
+            if method in ("enter_room", "leave_room"):
+                # Only the worker the socket is connected to tracks its rooms
+                if self.is_connected(data["sid"], data["namespace"]):
+                    getattr(super(BusClientManager, self), method)(data["sid"], data["namespace"], data["room"])
+                continue
+            return data
@@ -1,53 +1,61 @@
+import logging
 import random
 
 from singletons.words_storage import WordsStorage
 
+logger = logging.getLogger(__name__)
+
 
 class CommandNameGenerator:
-    def __init__(self, words_storage=None):
+    def __init__(self, words_storage=None, rng=random):
+        """
+        :param words_storage: `WordsStorage` object, the singleton if `None`
+        :param rng: random number generator (the game's one, see `Game.rng`)
+        """
         if words_storage is None:
             words_storage = WordsStorage()
         self.words_storage = words_storage
-        self.used_nouns = []
-        self.used_adjectives = []
-        self.used_verbs = []
+        self.rng = rng
+        self.used_nouns = set()
+        self.used_adjectives = set()
+        self.used_verbs = set()
+        self._pools = {}    # (kind, role): WordPool
+
+    def draw(self, kind, role, used):
+        """
+        Draws an unused word and marks it as used.
+        If all the words of `role` have been used, the words of any role are used.
+        :param kind: `nouns`, `adjectives` or `verbs`
+        :param role: role number, or `None` for all roles
+        :param used: set of used words of that kind
+        :return: word
+        """
+        pool = self._pools.get((kind, role))
+        if pool is None:
+            pool = self._pools[(kind, role)] = self.words_storage.sampler(kind, role).pool()
+        while True:
+            word = pool.draw(self.rng)
+            if word is None:
+                if role is None:
+                    raise RuntimeError("All {} have been used".format(kind))
+                return self.draw(kind, None, used)
+            if word not in used:
+                used.add(word)
+                return word
 
     def random_noun(self, role=0):
-        print(f"NOUN: ROLE IS {role}")
-        if role == 0:
-            nouns = random.choice([self.words_storage.ROLE_0["nouns"] * 4, self.words_storage.ROLE_0["rare_nouns"]])
-        elif role == 1:
-            nouns = random.choice([self.words_storage.ROLE_1["nouns"] * 4, self.words_storage.ROLE_1["rare_nouns"]])
-        elif role == 2:
-            nouns = random.choice([self.words_storage.ROLE_2["nouns"] * 4, self.words_storage.ROLE_2["rare_nouns"]])
-        elif role == 3:
-            nouns = random.choice([self.words_storage.ROLE_3["nouns"] * 4, self.words_storage.ROLE_3["rare_nouns"]])
-        noun = random.choice(nouns).lower()
-        print (f"NOUN: Picked '{noun}' for role {role}.")
+        noun = self.draw("nouns", role, self.used_nouns)
+        logger.debug("Picked noun '%s' for role %s", noun, role)
         return noun
 
     def random_adjective(self, role=0):
-        print(f"ADJ: ROLE IS {role}")
-        if role == 0:
-            adjectives = random.choice([self.words_storage.ROLE_0["adjectives"] * 4, self.words_storage.ROLE_0["rare_adjectives"]])
-        elif role == 1:
-            adjectives = random.choice([self.words_storage.ROLE_1["adjectives"] * 4, self.words_storage.ROLE_1["rare_adjectives"]])
-        elif role == 2:
-            adjectives = random.choice([self.words_storage.ROLE_2["adjectives"] * 4, self.words_storage.ROLE_2["rare_adjectives"]])
-        elif role == 3:
-            adjectives = random.choice([self.words_storage.ROLE_3["adjectives"] * 4, self.words_storage.ROLE_3["rare_adjectives"]])
-        adjective = random.choice(adjectives).lower()
-        print (f"ADJECTIVE: Picked '{adjective}' for role {role}.")
+        adjective = self.draw("adjectives", role, self.used_adjectives)
+        logger.debug("Picked adjective '%s' for role %s", adjective, role)
         return adjective
 
     def generate_compound_noun(self, role):
-        prefix = random.choice(self.words_storage.PREFIXES).lower()
-
-        while True:
-            noun = self.random_noun(role)
-            if noun not in self.used_nouns:
-                break
-        self.used_nouns.append(noun)
+        prefix = self.rng.choice(self.words_storage.PREFIXES).lower()
+        noun = self.random_noun(role)
 
         if prefix.endswith(noun[0]):
             prefix += "-"
@@ -56,27 +64,15 @@ class CommandNameGenerator:
         return "{}{}".format(prefix, noun)
 
     def generate_adjective_noun(self, role):
-        while True:
-            # role = random.getrandbits(1)
-            noun = self.random_noun(role)
-            adjective = self.random_adjective(role)
-            if noun not in self.used_nouns and adjective not in self.used_adjectives:
-                break
-        self.used_nouns.append(noun)
-        self.used_adjectives.append(adjective)
-
+        noun = self.random_noun(role)
+        adjective = self.random_adjective(role)
         return "{} {}".format(adjective, noun)
 
     def generate_command_name(self, role=0):
-        if random.randint(0, 2) == 0:
+        if self.rng.randint(0, 2) == 0:
             return self.generate_adjective_noun(role)
         else:
             return self.generate_compound_noun(role)
 
     def generate_action(self):
-        while True:
-            verb = random.choice(self.words_storage.VERBS)
-            if verb not in self.used_verbs:
-                break
-        self.used_verbs.append(verb)
-        return verb
+        return self.draw("verbs", None, self.used_verbs)
@@ -0,0 +1,263 @@
+"""
+Binary format of the game event log written by `singletons.event_log.EventLog` and read by `benchmark.replay`.
+
+A file starts with a header: magic, format version and the wall clock time (double) its records are relative to.
+Each record is its kind (u8), the milliseconds since that time (u32), the fixed size fields of that kind,
+the game id and the variable size fields of that kind (fixed size fields always come first in `KINDS`):
+    u8   1 byte
+    u32  4 bytes
+    f32  4 bytes, health values
+    bool 1 byte
+    str  u8 length and UTF-8 bytes, cut at 255 bytes
+    uid  u32 client uid, 0xFFFFFFFF for `None`
+    val  command value: u8 tag (`None`, `False`, `True`, int, str), then an i32 or a str for ints and strings.
+         Anything else is logged as a str.
+
+Input events are replayed on the game, output events are what the game did and are compared with the replay.
+"""
+import collections
+import struct
+
+MAGIC = b"HCEL"
+VERSION = 1
+HEADER = struct.Struct("<4sBd")
+RECORD_FORMAT = "<BI"
+RECORD = struct.Struct(RECORD_FORMAT)
+
+# Inputs (player actions and game lifecycle)
+CREATE = 1
+JOIN = 2
+LEAVE = 3
+SETTINGS = 4
+READY = 5
+START = 6
+INTRO_DONE = 7
+COMMAND = 8
+DEFEAT = 9
+DETACH = 10
+RESUME = 11
+DISPOSE = 12
+SAVE = 13
+RESTORE = 14
+# Outputs (decided by the game, its timers and its random number generator)
+INSTRUCTION = 20
+EXPIRE = 21
+HEALTH = 22
+LEVEL = 23
+GAME_OVER = 24
+
+# kind: (name, field types)
+KINDS = {
+    CREATE: ("create", ("u32", "bool", "u8", "str")),          # seed, public, max players, name
+    JOIN: ("join", ("uid",)),
+    LEAVE: ("leave", ("uid",)),
+    SETTINGS: ("settings", ("u8", "bool")),                     # max players, public
+    READY: ("ready", ("uid",)),
+    START: ("start", ()),
+    INTRO_DONE: ("intro_done", ("uid",)),
+    COMMAND: ("command", ("uid", "str", "val")),                # client, command name, value
+    DEFEAT: ("defeat", ("uid", "bool")),                        # client, black hole
+    DETACH: ("detach", ("uid",)),
+    RESUME: ("resume", ("uid",)),
+    DISPOSE: ("dispose", ()),
+    SAVE: ("save", ()),                                         # saved to a snapshot on shutdown
+    RESTORE: ("restore", ("u32",)),                             # seed, restored from a snapshot after a restart
+    INSTRUCTION: ("instruction", ("uid", "uid", "str", "val")),  # source, target, command name, value
+    EXPIRE: ("expire", ("uid",)),
+    HEALTH: ("health", ("f32", "f32")),                         # health, death limit
+    LEVEL: ("level", ("u32", "str")),                           # level, game modifier name or ""
+    GAME_OVER: ("game_over", ("u32",)),                         # level
+}
+OUTPUTS = frozenset((INSTRUCTION, EXPIRE, HEALTH, LEVEL, GAME_OVER))
+
+NO_UID = 0xFFFFFFFF
+VALUE_NONE, VALUE_FALSE, VALUE_TRUE, VALUE_INT, VALUE_STR = range(5)
+
+U8 = struct.Struct("<B")
+U32 = struct.Struct("<I")
+I32 = struct.Struct("<i")
+F32 = struct.Struct("<f")
+
+FIXED = {"u8": "B", "u32": "I", "f32": "f", "bool": "?", "uid": "I"}
+
+Record = collections.namedtuple("Record", ("kind", "time", "game_id", "fields"))
+
+
+class EventLogError(Exception):
+    pass
+
+
+def _encode_str(buffer, value):
+    data = value.encode("utf-8")
+    if len(data) > 255:
+        data = data[:255]
+    buffer.append(len(data))
+    buffer += data
+
+
+def _encode_value(buffer, value):
+    if value is None:
+        buffer.append(VALUE_NONE)
+    elif value is True or value is False:
+        buffer.append(VALUE_TRUE if value else VALUE_FALSE)
+    elif type(value) is int and -0x80000000 <= value <= 0x7FFFFFFF:
+        buffer.append(VALUE_INT)
+        buffer += I32.pack(value)
+    else:
+        buffer.append(VALUE_STR)
+        _encode_str(buffer, str(value))
+
+
+VARIABLE_ENCODERS = {"str": _encode_str, "val": _encode_value}
+
+
+def _fixed_format(types):
+    """
+    :param types: field types of a kind, fixed size ones first
+    :return: `struct` format of the fixed size fields, without byte order
+    """
+    fixed = [x for x in types if x in FIXED]
+    if list(types[:len(fixed)]) != fixed:
+        raise ValueError("Fixed size fields must come first")
+    return "".join(FIXED[x] for x in fixed)
+
+
+def _encoder(types):
+    """
+    :param types: field types of a kind
+    :return: `Struct` of the record header and the fixed size fields, number of fixed size fields
+             and encoders of the variable size fields
+    """
+    fixed = _fixed_format(types)
+    return (
+        struct.Struct(RECORD_FORMAT + fixed), len(fixed), tuple(VARIABLE_ENCODERS[x] for x in types[len(fixed):])
+    )
+
+
+# kind: `_encoder` tuple
+_ENCODERS = {kind: _encoder(types) for kind, (_, types) in KINDS.items()}
+
+
+def header(epoch):
+    """
+    :param epoch: `time.time()` value the records of the file are relative to
+    :return: file header bytes
+    """
+    return HEADER.pack(MAGIC, VERSION, epoch)
+
+
+def encode(buffer, kind, ms, game_id, fields):
+    """
+    Appends a record to `buffer`
+    :param buffer: `bytearray`
+    :param kind: event kind, one of `KINDS`
+    :param ms: milliseconds since the epoch of the file
+    :param game_id: game id
+    :param fields: tuple of fields, as many as the kind has
+    :return:
+    """
+    head, n, encoders = _ENCODERS[kind]
+    fixed = fields[:n]
+    if None in fixed:
+        # `None` uids
+        fixed = tuple(NO_UID if x is None else x for x in fixed)
+    buffer += head.pack(kind, ms, *fixed)
+    _encode_str(buffer, game_id)
+    for encoder, x in zip(encoders, fields[n:]):
+        encoder(buffer, x)
+
+
+class _Reader:
+    __slots__ = ("data", "offset")
+
+    def __init__(self, data, offset):
+        self.data = data
+        self.offset = offset
+
+    def unpack(self, s):
+        value = s.unpack_from(self.data, self.offset)[0]
+        self.offset += s.size
+        return value
+
+    def str(self):
+        length = self.data[self.offset]
+        end = self.offset + 1 + length
+        if end > len(self.data):
+            raise IndexError("Truncated string")
+        value = self.data[self.offset + 1:end].decode("utf-8", errors="replace")
+        self.offset = end
+        return value
+
+    def value(self):
+        tag = self.unpack(U8)
+        if tag == VALUE_NONE:
+            return None
+        if tag in (VALUE_FALSE, VALUE_TRUE):
+            return tag == VALUE_TRUE
+        if tag == VALUE_INT:
+            return self.unpack(I32)
+        return self.str()
+
+
+VARIABLE_DECODERS = {"str": _Reader.str, "val": _Reader.value}
+
+
+def _decoder(types):
+    """
+    :param types: field types of a kind
+    :return: `Struct` of the fixed size fields, indexes of the uid fields and decoders of the variable size fields
+    """
+    fixed = _fixed_format(types)
+    return (
+        struct.Struct("<" + fixed),
+        tuple(i for i, x in enumerate(types) if x == "uid"),
+        tuple(VARIABLE_DECODERS[x] for x in types[len(fixed):]),
+    )
+
+
+# kind: `_decoder` tuple
+_DECODERS = {kind: _decoder(types) for kind, (_, types) in KINDS.items()}
+
+
+def decode(data, epoch, offset=0):
+    """
+    Decodes the records in `data`. A truncated last record (the server was killed while writing it) is skipped.
+    :param data: `bytes` object
+    :param epoch: `time.time()` value the records are relative to
+    :param offset: position of the first record in `data`
+    :return: iterator of `Record`s, with absolute times
+    """
+    reader = _Reader(data, offset)
+    while reader.offset < len(data):
+        try:
+            kind, ms = RECORD.unpack_from(data, reader.offset)
+            reader.offset += RECORD.size
+            if kind not in _DECODERS:
+                raise EventLogError("Unknown event kind {} at offset {}".format(kind, reader.offset - RECORD.size))
+            fixed, uids, decoders = _DECODERS[kind]
+            fields = fixed.unpack_from(data, reader.offset)
+            reader.offset += fixed.size
+            if uids:
+                fields = tuple(None if i in uids and x == NO_UID else x for i, x in enumerate(fields))
+            game_id = reader.str()
+            fields += tuple(x(reader) for x in decoders)
+        except (struct.error, IndexError):
+            return
+        yield Record(kind, epoch + ms / 1000, game_id, fields)
+
+
+def read(path):
+    """
+    :param path: event log file
+    :return: iterator of the `Record`s in `path`
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise EventLogError("{} is not an event log".format(path))
+    magic, version, epoch = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise EventLogError("{} is not an event log".format(path))
+    if version != VERSION:
+        raise EventLogError("{} has format version {}, expected {}".format(path, version, VERSION))
+    return decode(data, epoch, HEADER.size)
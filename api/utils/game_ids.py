@@ -0,0 +1,178 @@
+"""
+Short game ids: fixed-length Crockford base32 codes (`GAME_ID_LENGTH` characters, case insensitive,
+`O`, `I` and `L` are read as `0`, `1` and `1`) that players can type.
+
+The code space is split between workers: the owner of a code is its value modulo the number
+of workers, so `Cluster.owner_of` doesn't need to ask anyone. Each worker walks its own share
+of the space in a random order (a keyed permutation), so codes are neither sequential nor reused
+until the whole share has been allocated once.
+Legacy uuid4 ids are still accepted everywhere a game id is.
+"""
+import collections
+import secrets
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+VALUES = {c: i for i, c in enumerate(ALPHABET)}
+LOOKALIKES = str.maketrans("OIL", "011")
+UUID_LENGTH = 36
+
+
+def is_uuid(game_id):
+    return len(game_id) == UUID_LENGTH
+
+
+def normalize(game_id):
+    """
+    Returns the canonical form of a game id typed by a player
+    :param game_id: short code or uuid
+    :return: uppercase short code or lowercase uuid
+    """
+    game_id = game_id.strip()
+    if is_uuid(game_id):
+        return game_id.lower()
+    return game_id.upper().translate(LOOKALIKES)
+
+
+def encode(value, length):
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def decode(code):
+    """
+    :param code: normalized short code
+    :return: code value, or `None` if `code` is not a valid short code
+    """
+    value = 0
+    for c in code:
+        digit = VALUES.get(c)
+        if digit is None:
+            return None
+        value = value * 32 + digit
+    return value
+
+
+class Permutation:
+    """
+    Keyed bijection of `range(size)`: a 4 rounds Feistel network on the smallest
+    even number of bits that fits `size`, with cycle walking for values out of range
+    """
+    ROUNDS = 4
+
+    def __init__(self, size, key=None):
+        self.size = size
+        self.half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.half_mask = (1 << self.half_bits) - 1
+        rng = secrets.SystemRandom() if key is None else None
+        self.keys = [
+            (rng.getrandbits(32) if rng is not None else (key * 0x9E3779B1 + i) & 0xFFFFFFFF)
+            for i in range(self.ROUNDS)
+        ]
+
+    def _round(self, x, key):
+        x = ((x ^ key) * 0x45D9F3B) & 0xFFFFFFFF
+        x ^= x >> 16
+        return x & self.half_mask
+
+    def _permute(self, x):
+        left, right = x >> self.half_bits, x & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << self.half_bits) | right
+
+    def _unpermute(self, x):
+        left, right = x >> self.half_bits, x & self.half_mask
+        for key in reversed(self.keys):
+            left, right = right ^ self._round(left, key), left
+        return (left << self.half_bits) | right
+
+    def __call__(self, x):
+        x = self._permute(x)
+        while x >= self.size:
+            x = self._permute(x)
+        return x
+
+    def inverse(self, x):
+        x = self._unpermute(x)
+        while x >= self.size:
+            x = self._unpermute(x)
+        return x
+
+
+class GameIdAllocator:
+    """
+    Allocates the short codes owned by a worker.
+    Fresh codes are used first, freed codes are reused oldest first once all of them have been used.
+    Allocating and freeing are O(1).
+    """
+    def __init__(self, worker_id=0, workers=1, length=5, key=None):
+        """
+        :param worker_id: id of this worker
+        :param workers: number of workers
+        :param length: code length
+        :param key: permutation key, random if `None`
+        """
+        self.worker_id = worker_id
+        self.workers = workers
+        self.length = length
+        self.capacity = 32 ** length // workers
+        self._permutation = Permutation(self.capacity, key)
+        self._next = 0
+        self._free = collections.deque()
+        self._allocated = set()
+
+    def allocate(self):
+        """
+        :return: an unused short code owned by this worker
+        """
+        if self._next < self.capacity:
+            index = self._next
+            self._next += 1
+        elif self._free:
+            index = self._free.popleft()
+        else:
+            raise RuntimeError("No game ids left")
+        self._allocated.add(index)
+        return encode(self._permutation(index) * self.workers + self.worker_id, self.length)
+
+    def free(self, code):
+        """
+        Makes `code` available again. Does nothing for uuids and codes not allocated by this allocator.
+        :param code: short code
+        :return:
+        """
+        value = decode(code) if len(code) == self.length else None
+        if value is None or value % self.workers != self.worker_id:
+            return
+        index = self._permutation.inverse(value // self.workers)
+        if index in self._allocated:
+            self._allocated.remove(index)
+            self._free.append(index)
+
+    def snapshot(self):
+        """
+        :return: JSON serializable state of this allocator, restored with `restore`
+        """
+        return {
+            "keys": self._permutation.keys,
+            "next": self._next,
+            "free": list(self._free),
+            "allocated": sorted(self._allocated),
+        }
+
+    def restore(self, data):
+        """
+        Restores the state saved by `snapshot`, so restored games keep their codes and new ones don't collide
+        :param data: `snapshot` dict, of an allocator with the same worker id, number of workers and length
+        :return:
+        """
+        self._permutation.keys = list(data["keys"])
+        self._next = data["next"]
+        self._free = collections.deque(data["free"])
+        self._allocated = set(data["allocated"])
+
+    def __len__(self):
+        return len(self._allocated)
@@ -1,6 +1,22 @@
+import os
+
+
 def str_to_bool(s):
     return s.strip().lower() if type(s) is str else s in ["true", "1", 1]
 
 
 def str_is_bool(s):
     return s.strip().lower() if type(s) is str else s in ["true", "false", "1", "0", 1, 0]
+
+
+def worker_path(path, worker_id, workers):
+    """
+    :param path: file name from the config
+    :param worker_id: id of this worker
+    :param workers: number of workers
+    :return: `path` in single worker mode, `<name>.<worker id><ext>` otherwise, so workers don't share files
+    """
+    if workers > 1:
+        root, ext = os.path.splitext(path)
+        path = "{}.{}{}".format(root, worker_id, ext)
+    return path
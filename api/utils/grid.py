@@ -1,9 +1,15 @@
+import logging
+import operator
 import random
 import json
 
 from json import JSONEncoder
 
 from constants import layout_cells
+from singletons.layout_catalogue import LayoutCatalogue, fill_cells
+from utils import json_backend
+
+logger = logging.getLogger(__name__)
 
 NORMAL = 0
 BIG_CELLS = 1
@@ -11,12 +17,14 @@ BIG_CELLS = 1
 
 class GridJSONEncoder(JSONEncoder):
     def default(self, o):
-        if hasattr(o, "__dict__"):
-            return o.__dict__()
+        if hasattr(o, "to_payload"):
+            return o.to_payload()
         return JSONEncoder.default(self, o)
 
 
 class GridElement:
+    __slots__ = ("x", "y", "w", "h", "name", "additional_data")
+
     def __init__(self, name, x, y, w, h):
         self.x = x
         self.y = y
@@ -25,70 +33,94 @@ class GridElement:
         self.name = name
         self.additional_data = {}     # other stuff that will be json serialized along with everything else
 
-    def __dict__(self):
+    def to_payload(self):
+        """
+        :return: dict sent to the client in the `grid` event
+        """
         _dict = {
-            **{
-                "x": self.x,
-                "y": self.y,
-                "w": self.w,
-                "h": self.h,
-                "name": self.name,
-            },
-            **self.additional_data
+            "x": self.x,
+            "y": self.y,
+            "w": self.w,
+            "h": self.h,
+            "name": self.name,
         }
-        if type(self) in TYPES:
-            _dict["type"] = TYPES[type(self)]
+        if self.additional_data:
+            _dict.update(self.additional_data)
+        _type = TYPES.get(type(self))
+        if _type is not None:
+            _dict["type"] = _type
+        return _dict
+
+    def snapshot(self):
+        """
+        :return: JSON serializable state of this element (including values), restored with `GridElement.restore`
+        """
+        fields, get = FIELDS[type(self)]
+        _dict = dict(zip(fields, get(self)))
+        _dict["type"] = TYPES[type(self)]
         return _dict
 
+    @staticmethod
+    def restore(data):
+        """
+        :param data: `GridElement.snapshot` dict
+        :return: `GridElement` subclass object
+        """
+        o = CLASSES[data["type"]].__new__(CLASSES[data["type"]])
+        for name, value in data.items():
+            if name != "type":
+                setattr(o, name, value)
+        return o
+
 
 class SliderLikeElement(GridElement):
+    __slots__ = ("min", "max", "value")
+
     def __init__(self, name, x, y, w, h, min_value, max_value):
         super(SliderLikeElement, self).__init__(name, x, y, w, h)
         self.min = min_value
         self.max = max_value
         self.value = self.min
 
-    def __dict__(self):
-        return {
-            **super(SliderLikeElement, self).__dict__(),
-            **{
-                "min": self.min,
-                "max": self.max
-            }
-        }
+    def to_payload(self):
+        _dict = super(SliderLikeElement, self).to_payload()
+        _dict["min"] = self.min
+        _dict["max"] = self.max
+        return _dict
 
 
 class Button(GridElement):
-    pass
+    __slots__ = ()
 
 
 class Slider(SliderLikeElement):
-    pass
+    __slots__ = ()
 
 
 class CircularSlider(SliderLikeElement):
-    pass
+    __slots__ = ()
 
 
 class ButtonsSlider(SliderLikeElement):
-    pass
+    __slots__ = ()
 
 
 class Actions(GridElement):
+    __slots__ = ("actions",)
+
     def __init__(self, name, x, y, w, h, actions):
         super(Actions, self).__init__(name, x, y, w, h)
         self.actions = actions
 
-    def __dict__(self):
-        return {
-            **super(Actions, self).__dict__(),
-            **{
-                "actions": self.actions
-            }
-        }
+    def to_payload(self):
+        _dict = super(Actions, self).to_payload()
+        _dict["actions"] = self.actions
+        return _dict
 
 
 class Switch(GridElement):
+    __slots__ = ("toggled",)
+
     def __init__(self, name, x, y, w, h):
         super(Switch, self).__init__(name, x, y, w, h)
         self.toggled = False
@@ -101,112 +133,35 @@ TYPES = {
     ButtonsSlider: "buttons_slider",
     Switch: "switch"
 }
+CLASSES = {v: k for k, v in TYPES.items()}
+# type: (slots of the class and its bases, getter returning their values), used by `GridElement.snapshot`
+FIELDS = {
+    t: (fields, operator.attrgetter(*fields))
+    for t, fields in (
+        (t, tuple(name for cls in t.__mro__ for name in getattr(cls, "__slots__", ()))) for t in TYPES
+    )
+}
 
 
 # we will be using a y,x coordinate system;
 # so they will be looking at our grid left to right first,
 # top to bottom after that.
 class Grid:
-    def __init__(self, command_name_generator, role=0, pool_config=NORMAL):
+    def __init__(self, command_name_generator, role=0, pool_config=NORMAL, rng=random):
         self.grid = [[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]]
         self.objects = []
+        self.objects_by_name = {}
         self.command_name_generator = command_name_generator
         self.role = role
+        self._payload = None
 
-        while True:
-            print(self.grid)
-            y, x = self.get_next_empty()
-            if y < 0 and x < 0:
-                break
-            print("next empties are: %s, %s" % (y, x))
-            self.add_random_element(y, x)
-
-    def get_next_empty(self):
-        for y in range(4):
-            for x in range(4):
-                if self.grid[y][x] == layout_cells.EMPTY:
-                    return y, x
-        return -1, -1
-
-    def add_random_element(self, y, x):
-        fsr = self.free_space_right(y, x)
-
-        print("for %s, %s; there's %s spaces to the right." % (y, x, fsr))
-
-        if fsr == 1:
-            # No space left on x axis, only Squares and VerticalRectangles allowed
-            pool = [layout_cells.SQUARE, layout_cells.VERTICAL_RECTANGLE]
-        else:
-            # More space, everything can fit
-            pool = [
-                layout_cells.SQUARE, layout_cells.VERTICAL_RECTANGLE,
-                layout_cells.HORIZONTAL_RECTANGLE, layout_cells.BIG_SQUARE
-            ]
-
-        # Remove elements already present in that row
-        # for element in self.grid[y]:
-        #     pool = list(filter(lambda z: z != element, pool))
-
-        if y == 3:
-            # No space left on y axis, remove VerticalRectangles and BigSquares from pool
-            pool = list(filter(lambda z: z not in [layout_cells.VERTICAL_RECTANGLE, layout_cells.BIG_SQUARE], pool))
-
-        # Default size is 1
-        length = 1
-
-        # pick something from the pool, or if nothing's left pick a square
-        _type = random.choice(pool) if len(pool) != 0 else layout_cells.SQUARE
-        print("we picked to insert a type %s object there" % _type)
-
-        # if fsr is > 2 and you picked a horizontalrectangle, decide how long it will be.
-        if _type == layout_cells.HORIZONTAL_RECTANGLE:
-            if fsr > 2:
-                length = random.randint(2, 3)
-            else:
-                length = 2
+        for y, x, _type, length in LayoutCatalogue().sample(rng):
+            self.insert_object(y, x, _type, length, rng)
 
-        # if you picked a verticalrectangle, decide how long it will be.
-        if _type == layout_cells.VERTICAL_RECTANGLE:
-            if y <= 1:
-                length = random.randint(2, 3)
-            else:
-                length = 2
+    def insert_object(self, y, x, _type, length, rng=random):
+        logger.debug("Inserting a type %s object of length %s to %s, %s", _type, length, y, x)
 
-        # if you picked a bigsquare, decide how big it will be.
-        if _type == layout_cells.BIG_SQUARE:
-            # if y <= 1 and fsr >= 1 and x <= 1:
-            #     length = random.randint(2, 3)
-            # else:
-            #     length = 2
-            length = 2
-
-        print("and the length will be %s" % length)
-
-        # insert the object
-        self.insert_object(y, x, _type, length)
-
-    def insert_object(self, y, x, _type, length):
-        print("inserting a _type %s object of length %s to %s, %s" % (_type, length, y, x))
-
-        # Only the
-        self.grid[y][x] = _type
-
-        if length != 1:
-            if _type == layout_cells.VERTICAL_RECTANGLE:
-                for i in range(y + 1, y + length):
-                    self.grid[i][x] = layout_cells.OCCUPIED
-            elif _type == layout_cells.HORIZONTAL_RECTANGLE:
-                for i in range(x + 1, x + length):
-                    self.grid[y][i] = layout_cells.OCCUPIED
-            elif _type == layout_cells.BIG_SQUARE:
-                self.grid[y + 1][x] = layout_cells.BIG_SQUARE
-                self.grid[y][x + 1] = layout_cells.BIG_SQUARE
-                self.grid[y + 1][x + 1] = layout_cells.BIG_SQUARE
-                if length == 3:
-                    for i in range(3):
-                        self.grid[y + 2][x + i] = layout_cells.BIG_SQUARE
-                    for i in range(3):
-                        self.grid[y + i][x + 2] = layout_cells.BIG_SQUARE
+        fill_cells(self.grid, y, x, _type, length)
 
         pool = []
         if _type in [layout_cells.SQUARE, layout_cells.BIG_SQUARE]:
@@ -224,7 +179,7 @@ class Grid:
             for _ in range(2):
                 pool.append(ButtonsSlider)
 
-        _object = random.choice(pool)
+        _object = rng.choice(pool)
 
         init_kwargs = {
             "x": x,
@@ -250,35 +205,90 @@ class Grid:
         if _object in [Slider, ButtonsSlider]:
             # Special kwargs for Sliders
             init_kwargs["min_value"] = 0
-            init_kwargs["max_value"] = random.randint(3, 5)
+            init_kwargs["max_value"] = rng.randint(3, 5)
         elif _object is CircularSlider:
             # Special kwargs for Sliders (different values)
             init_kwargs["min_value"] = 0
-            init_kwargs["max_value"] = random.randint(4, 7)
+            init_kwargs["max_value"] = rng.randint(4, 7)
         elif _object is Actions:
             # Special kwargs for Action
             init_kwargs["actions"] = [
-                self.command_name_generator.generate_action() for _ in range(random.randint(2, 4))
+                self.command_name_generator.generate_action() for _ in range(rng.randint(2, 4))
             ]
 
-        self.objects.append(_object(**init_kwargs))
-
-    def free_space_right(self, y, x):
-        cnt = 0
-        for i in range(x, 4):
-            if self.grid[y][i] != layout_cells.EMPTY:
-                return cnt
-            cnt += 1
-        return cnt
+        self.add_object(_object(**init_kwargs))
+
+    def add_object(self, o):
+        self.objects.append(o)
+        self.objects_by_name[o.name] = o
+        self._payload = None
+
+    def get_object(self, name):
+        """
+        Returns the `GridElement` called `name`
+        :param name: command name
+        :return: `GridElement` object or `None` if there's no such command in this grid
+        """
+        return self.objects_by_name.get(name)
+
+    def rename_object(self, o, name):
+        """
+        Changes the name of a `GridElement` in this grid, keeping the name index up to date
+        :param o: `GridElement` object
+        :param name: new name
+        :return:
+        """
+        if self.objects_by_name.get(o.name) is o:
+            del self.objects_by_name[o.name]
+        o.name = name
+        self.objects_by_name[name] = o
+        self._payload = None
 
     def jsonify(self):
         return json.dumps(self.objects, cls=GridJSONEncoder)
 
-    def __dict__(self):
-        result = []
-        for i in self.objects:
-            result.append(i.__dict__())
-        return result
+    def to_payload(self):
+        return [i.to_payload() for i in self.objects]
+
+    def payload(self):
+        """
+        Returns the `grid` event payload, serialized once.
+        Call `invalidate_payload` after changing an object without `add_object` or `rename_object`.
+        :return: `RawJSON` object
+        """
+        if self._payload is None:
+            self._payload = json_backend.encode(self.to_payload())
+        return self._payload
+
+    def invalidate_payload(self):
+        self._payload = None
+
+    def snapshot(self):
+        """
+        :return: JSON serializable state of this grid, restored with `Grid.restore`
+        """
+        return {
+            "role": self.role,
+            "grid": self.grid,
+            "objects": [x.snapshot() for x in self.objects],
+        }
+
+    @classmethod
+    def restore(cls, data):
+        """
+        :param data: `Grid.snapshot` dict
+        :return: `Grid` object, without a command name generator
+        """
+        g = cls.__new__(cls)
+        g.grid = data["grid"]
+        g.role = data["role"]
+        g.command_name_generator = None
+        g.objects = []
+        g.objects_by_name = {}
+        g._payload = None
+        for x in data["objects"]:
+            g.add_object(GridElement.restore(x))
+        return g
 
 # if __name__ == "__main__":
 #     print(Grid().jsonify())
@@ -0,0 +1,145 @@
+"""
+JSON backends for socket.io packets.
+`orjson` or `ujson` are used if installed, the standard library otherwise (`JSON_BACKEND` config).
+
+Payloads that are emitted many times (grids, lobby and game info) can be serialized
+once with `encode`: the resulting `RawJSON` object is inserted as-is in the packets.
+"""
+import json
+import logging
+
+from singletons.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class RawJSON:
+    """
+    A payload already serialized to JSON
+    """
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return "RawJSON({})".format(self.text)
+
+
+class JSONBackend:
+    """
+    `json`-like module used by python-socketio to encode and decode packets
+    """
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self._dumps = dumps
+        self._loads = loads
+
+    def dumps(self, obj, **_):
+        """
+        Serializes `obj`. `RawJSON` objects are inserted as-is if they are `obj`
+        or items of `obj` (socket.io event packets are `[event, *args]` lists).
+        `RawJSON` objects nested deeper are spliced too, on a slower path.
+        :param obj: object to serialize
+        :return: JSON string
+        """
+        if type(obj) is RawJSON:
+            return obj.text
+        if type(obj) in (list, tuple) and any(type(x) is RawJSON for x in obj):
+            return "[" + ",".join(x.text if type(x) is RawJSON else self._dumps(x) for x in obj) + "]"
+        try:
+            return self._dumps(obj)
+        except TypeError:
+            # `orjson.JSONEncodeError` is a `TypeError` too
+            return self._splice(obj)
+
+    def _splice(self, obj):
+        """
+        Serializes `obj`, inserting `RawJSON` objects at any depth as-is
+        :param obj: object to serialize
+        :return: JSON string
+        """
+        if type(obj) is RawJSON:
+            return obj.text
+        if type(obj) is dict:
+            return "{" + ",".join(
+                self._dumps(k if type(k) is str else str(k)) + ":" + self._splice(v) for k, v in obj.items()
+            ) + "}"
+        if type(obj) in (list, tuple):
+            return "[" + ",".join(self._splice(x) for x in obj) + "]"
+        return self._dumps(obj)
+
+    def loads(self, s, **_):
+        return self._loads(s)
+
+
+def _orjson():
+    import orjson
+    return JSONBackend(
+        "orjson", lambda x: orjson.dumps(x, option=orjson.OPT_NON_STR_KEYS).decode("utf-8"), orjson.loads
+    )
+
+
+def _ujson():
+    import ujson
+    return JSONBackend("ujson", lambda x: ujson.dumps(x, ensure_ascii=False), ujson.loads)
+
+
+def _stdlib():
+    return JSONBackend("json", lambda x: json.dumps(x, separators=(",", ":")), json.loads)
+
+
+BACKENDS = {
+    "orjson": _orjson,
+    "ujson": _ujson,
+    "json": _stdlib,
+}
+
+
+def load_backend(name="auto"):
+    """
+    :param name: `orjson`, `ujson`, `json` or `auto` for the fastest one installed
+    :return: `JSONBackend` object
+    """
+    if name == "auto":
+        for x in ("orjson", "ujson"):
+            try:
+                return BACKENDS[x]()
+            except ImportError:
+                continue
+        return _stdlib()
+    if name not in BACKENDS:
+        raise ValueError("Unknown JSON backend {}".format(name))
+    return BACKENDS[name]()
+
+
+_backend = None
+
+
+def get_backend():
+    """
+    :return: the `JSONBackend` configured with `JSON_BACKEND`
+    """
+    global _backend
+    if _backend is None:
+        _backend = load_backend(Config()["JSON_BACKEND"])
+        logger.debug("Using %s JSON backend", _backend.name)
+    return _backend
+
+
+def encode(obj):
+    """
+    Serializes `obj` once, to be emitted many times
+    :param obj: object to serialize
+    :return: `RawJSON` object
+    """
+    return RawJSON(get_backend().dumps(obj))
+
+
+def default(o):
+    """
+    `default` function for the standard library `json.dumps`, expanding `RawJSON` objects
+    """
+    if type(o) is RawJSON:
+        return json.loads(o.text)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(o).__name__))
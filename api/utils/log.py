@@ -0,0 +1,67 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+
+# Attributes every `LogRecord` has, anything else has been passed with `extra`
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line.
+    Values passed with `extra` are added as fields.
+    """
+    def format(self, record):
+        data = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for k, v in vars(record).items():
+            if k not in RECORD_ATTRIBUTES:
+                data[k] = v
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records in a queue, with arguments and exception already formatted
+    so the listener thread doesn't touch objects owned by the event loop
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level, json_format=False):
+    """
+    Configures the root logger. Records are put in a queue and written to stderr
+    by a background thread, so logging never blocks the event loop on I/O.
+    :param level: root logger level
+    :param json_format: if `True`, write JSON lines instead of plain text
+    :return: `QueueListener` object, stopped automatically at exit
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter() if json_format else logging.Formatter(logging.BASIC_FORMAT))
+
+    records = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(records)]
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,32 @@
+import gc
+import sys
+
+CONTAINERS = (dict, list, tuple, set, frozenset)
+LEAVES = (str, bytes, int, float)
+
+
+def footprint(root, owned_types=()):
+    """
+    Estimates the memory retained by `root`: the size of `root`, of the containers and
+    `owned_types` instances reachable from it, and of the strings and numbers they reference.
+    Other objects (classes, functions, singletons, anything not owned) are neither counted nor followed,
+    so shared objects are left out. Interned strings and small ints are counted anyway, it's an estimate.
+    :param root: object to measure
+    :param owned_types: tuple of the types of the objects owned by `root`
+    :return: size in bytes
+    """
+    seen = {id(root)}
+    stack = [root]
+    total = 0
+    while stack:
+        o = stack.pop()
+        total += sys.getsizeof(o)
+        if type(o) in LEAVES:
+            continue
+        for x in gc.get_referents(o):
+            if id(x) in seen:
+                continue
+            if type(x) in LEAVES or type(x) in CONTAINERS or isinstance(x, owned_types):
+                seen.add(id(x))
+                stack.append(x)
+    return total
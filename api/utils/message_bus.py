@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+
+from utils import json_backend
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBus:
+    """
+    Broadcasts JSON-serializable dicts to every worker process.
+    Messages are delivered to all subscribers, including the ones of the publishing worker.
+    """
+    def __init__(self):
+        self._subscribers = []
+        self._reconnect_callbacks = []
+
+    def subscribe(self, callback):
+        """
+        Registers a callback that will be called with every message
+        :param callback: regular function that takes a message dict
+        :return:
+        """
+        self._subscribers.append(callback)
+
+    def on_reconnect(self, callback):
+        """
+        Registers a callback that will be called when the bus is connected again after losing its connection.
+        Messages published meanwhile are lost.
+        :param callback: regular function without arguments
+        :return:
+        """
+        self._reconnect_callbacks.append(callback)
+
+    @property
+    def connected(self):
+        return True
+
+    async def start(self):
+        return
+
+    async def close(self):
+        return
+
+    def publish(self, message):
+        """
+        Publishes `message`. Messages from the same worker are delivered in publishing order.
+        :param message: JSON-serializable dict
+        :return:
+        """
+        raise NotImplementedError()
+
+    def deliver(self, message):
+        for callback in self._subscribers:
+            try:
+                callback(message)
+            except Exception:
+                logger.exception("Unhandled exception in message bus subscriber")
+
+
+class LocalMessageBus(MessageBus):
+    """
+    In-process bus, for a single worker
+    """
+    def publish(self, message):
+        asyncio.get_event_loop().call_soon(self.deliver, message)
+
+
+class SocketMessageBus(MessageBus):
+    """
+    Bus over a local TCP socket. One worker hosts a hub that relays
+    every newline-delimited JSON message to all the connected workers.
+    """
+    LINE_LIMIT = 2 ** 24
+    CONNECT_RETRIES = 50
+    CONNECT_RETRY_DELAY = 0.1
+    # Backoff between reconnection attempts when the connection to the hub is lost (e.g. worker 0 restarted)
+    RECONNECT_DELAY = 0.1
+    RECONNECT_MAX_DELAY = 5
+    # Bytes the hub buffers for a worker that doesn't read fast enough before disconnecting it,
+    # instead of buffering without limit. The worker reconnects and resyncs (see `on_reconnect`).
+    PEER_BUFFER_LIMIT = 2 ** 26
+
+    def __init__(self, host, port, hub=False):
+        super(SocketMessageBus, self).__init__()
+        self.host = host
+        self.port = port
+        self.hub = hub
+
+        self._server = None
+        self._peers = set()
+        self._writer = None
+        self._reader_task = None
+        # Messages published while disconnected
+        self.dropped = 0
+
+    async def start(self):
+        if self.hub:
+            self._server = await asyncio.start_server(self._serve_peer, self.host, self.port, limit=self.LINE_LIMIT)
+            logger.info("Message bus hub listening on %s:%s", self.host, self.port)
+
+        # Connect to the hub, which may still be starting in another process
+        for _ in range(self.CONNECT_RETRIES):
+            try:
+                reader, self._writer = await asyncio.open_connection(self.host, self.port, limit=self.LINE_LIMIT)
+                break
+            except OSError:
+                await asyncio.sleep(self.CONNECT_RETRY_DELAY)
+        else:
+            raise ConnectionError("Cannot connect to message bus hub on {}:{}".format(self.host, self.port))
+        self._reader_task = asyncio.ensure_future(self._read(reader))
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._server is not None:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def publish(self, message):
+        if self._writer is None:
+            if self._reader_task is None:
+                raise RuntimeError("The message bus is not started")
+            # Reconnecting
+            self.dropped += 1
+            return
+        self._writer.write(json.dumps(message, default=json_backend.default).encode() + b"\n")
+
+    async def _read(self, reader):
+        while True:
+            try:
+                line = await reader.readline()
+            except (OSError, asyncio.IncompleteReadError):
+                line = b""
+            if line:
+                self.deliver(json.loads(line.decode()))
+                continue
+            logger.error("Lost connection to message bus hub on %s:%s, reconnecting", self.host, self.port)
+            self._writer.close()
+            self._writer = None
+            reader = await self._reconnect()
+            logger.info(
+                "Reconnected to message bus hub on %s:%s, %s messages dropped meanwhile", self.host, self.port, self.dropped
+            )
+            self.dropped = 0
+            for callback in self._reconnect_callbacks:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("Unhandled exception in message bus reconnect callback")
+
+    async def _reconnect(self):
+        """
+        Connects to the hub again, retrying with exponential backoff until it's back
+        :return: `StreamReader` of the new connection
+        """
+        delay = self.RECONNECT_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                reader, self._writer = await asyncio.open_connection(self.host, self.port, limit=self.LINE_LIMIT)
+                return reader
+            except OSError:
+                delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+
+    async def _serve_peer(self, reader, writer):
+        self._peers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for peer in list(self._peers):
+                    if peer.transport.get_write_buffer_size() > self.PEER_BUFFER_LIMIT:
+                        logger.error("Message bus peer %s is too slow, disconnecting it", peer.get_extra_info("peername"))
+                        self._peers.discard(peer)
+                        # Drops the buffered messages, `close` would wait to send them
+                        peer.transport.abort()
+                        continue
+                    peer.write(line)
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+
+def make_message_bus(kind, address, hub=False):
+    """
+    Creates a message bus
+    :param kind: `local` or `socket`
+    :param address: `host:port` of the hub (`socket` bus only)
+    :param hub: whether this worker hosts the hub (`socket` bus only)
+    :return: `MessageBus` object
+    """
+    if kind == "local":
+        return LocalMessageBus()
+    elif kind == "socket":
+        host, port = address.rsplit(":", 1)
+        return SocketMessageBus(host, int(port), hub=hub)
+    raise ValueError("Unknown message bus {}".format(kind))
@@ -0,0 +1,126 @@
+"""
+Minimal metrics with Prometheus text exposition (format 0.0.4).
+Each metric keeps one value per label values tuple.
+"""
+import bisect
+
+# Seconds, from half a millisecond to 5 seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def format_labels(names, values, extra=()):
+    """
+    Formats label pairs as `{a="1",b="2"}`
+    :param names: label names
+    :param values: label values, same order as `names`
+    :param extra: additional `(name, value)` pairs
+    :return: formatted labels, or an empty string if there are no labels
+    """
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in pairs
+    ) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """
+    Base metric. If `function` is provided, the metric has no labels
+    and its value is read from `function()` when rendered.
+    """
+    TYPE = None
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.function = function
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError("{} expects labels {}".format(self.name, self.label_names))
+        return tuple(labels[x] for x in self.label_names)
+
+    def samples(self):
+        """
+        :return: iterable of `(suffix, label values, extra label pairs, value)` tuples
+        """
+        if self.function is not None:
+            yield "", (), (), self.function()
+            return
+        for key, value in self._values.items():
+            yield "", key, (), value
+
+    def render(self, const_labels=()):
+        """
+        Renders this metric in Prometheus text format
+        :param const_labels: `(name, value)` pairs added to every sample
+        :return: list of lines
+        """
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.TYPE),
+        ]
+        for suffix, key, extra, value in self.samples():
+            lines.append("{}{}{} {}".format(
+                self.name, suffix, format_labels(self.label_names, key, tuple(extra) + tuple(const_labels)),
+                format_value(value)
+            ))
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels, function)
+        if not self.label_names:
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        data = self._values.get(key)
+        if data is None:
+            # Per-bucket counts (the last one is +Inf), sum
+            data = self._values[key] = [[0] * (len(self.buckets) + 1), 0]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+
+    def samples(self):
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", key, (("le", format_value(float(bound))),), cumulative
+            yield "_sum", key, (), total
+            yield "_count", key, (), cumulative
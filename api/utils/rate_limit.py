@@ -0,0 +1,52 @@
+"""
+Token buckets limiting the events accepted from each client (see `utils.server.handler`)
+"""
+
+
+class TokenBucket:
+    """
+    Holds up to `burst` tokens, refilled at `rate` tokens per second. Each event takes one token,
+    events arriving when the bucket is empty are dropped.
+    """
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        """
+        :param rate: tokens added per second
+        :param burst: bucket size, starts full
+        :param now: `time.monotonic()` value
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        """
+        :param now: `time.monotonic()` value
+        :return: `True` if there was a token, `False` if the event must be dropped
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def allow(client, event, rate, burst, now):
+    """
+    Takes a token from the bucket of `client` for `event`, creating it on the first event
+    :param client: `Client` object
+    :param event: event name
+    :param rate: events per second
+    :param burst: events accepted at once
+    :param now: `time.monotonic()` value
+    :return: `True` if the event can be handled, `False` if it must be dropped
+    """
+    if client.rate_limits is None:
+        client.rate_limits = {}
+    bucket = client.rate_limits.get(event)
+    if bucket is None:
+        bucket = client.rate_limits[event] = TokenBucket(rate, burst, now)
+    return bucket.take(now)
@@ -1,140 +1,220 @@
 import logging
+import time
 
 import exceptions
 from singletons.client_manager import ClientManager
+from singletons.metrics import Metrics
+from singletons.profiler import Profiler
+from singletons.scheduler import Scheduler
 from singletons.sio import Sio
 from utils.general import str_to_bool, str_is_bool
+from utils.rate_limit import allow
 
+logger = logging.getLogger(__name__)
 
-def args(*required_args):
+
+def _check_int(*_):
+    return lambda x: type(x) is int or (type(x) is str and x.isnumeric())
+
+
+def _check_str(accept_empty=None, *_):
+    if accept_empty:
+        return lambda x: type(x) is str
+    return lambda x: type(x) is str and len(x.strip()) > 0
+
+
+def _check_bool(*_):
+    return lambda x: type(x) in (str, int, bool) and str_is_bool(str(x))
+
+
+def _check_list(*_):
+    return lambda x: type(x) is list
+
+
+# type: (checker factory, called with the extra items of the spec tuple, pre-processor)
+ARG_TYPES = {
+    int: (_check_int, int),
+    str: (_check_str, None),
+    bool: (_check_bool, str_to_bool),
+    list: (_check_list, None),
+    None: (None, None),
+}
+
+
+def compile_args(required_args):
     """
-    Decorator that makes checking for required GET/POST
-    argument easier.
-    The decorator will look for arguments in the right
-    dictionary according to the request's method.
-    If at least one argument is missing, a
-    `exceptions.ApiMissingArgumentsError` is raised.
-    You must required arguments to the decorator, like so:
-    ```
-    @api.errors
-    @api.args("arg1", "arg2")
-    def handle(request):
-        ...
-    ```
-    -   It's highly recommended to put the `errors` decorator
-        **before** the `args` one, because this decorator will
-        raise an exceptions if at least one argument is missing,
-        and by using the `errors` decorator, the server will
-        return a 400 response with a valid JSON body
-        rather than returning an Exception.
-
-    :param required_args: required arguments
+    Compiles an `args` spec into a validator, so the spec is parsed only once
+    :param required_args: `args` spec, argument names or `(name, type, *checker_args)` tuples
+    :return: function that validates and pre-processes `data` in place,
+             raising `exceptions.SocketMissingArgumentsError` if an argument is missing or invalid
+    """
+    fields = []
+    for arg in required_args:
+        if type(arg) is tuple:
+            arg_name, arg_type, *checker_args = arg
+        else:
+            arg_name, arg_type, checker_args = arg, None, ()
+        if arg_type not in ARG_TYPES:
+            raise TypeError("Unsupported type {} for argument {}".format(arg_type, arg_name))
+        checker_factory, pre_processor = ARG_TYPES[arg_type]
+        fields.append((
+            arg_name,
+            checker_factory(*checker_args) if checker_factory is not None else None,
+            pre_processor,
+            "{} ({})".format(arg_name, arg_type.__name__) if arg_type is not None else arg_name
+        ))
+    fields = tuple(fields)
+
+    def validate(data):
+        if type(data) is not dict:
+            raise exceptions.SocketMissingArgumentsError(
+                "Missing argument(s): {}".format(", ".join(x[3] for x in fields))
+            )
+        invalid = None
+        for arg_name, checker, pre_processor, description in fields:
+            if arg_name in data and (checker is None or checker(data[arg_name])):
+                if pre_processor is not None:
+                    data[arg_name] = pre_processor(data[arg_name])
+            else:
+                if invalid is None:
+                    invalid = []
+                invalid.append(description)
+        if invalid is not None:
+            raise exceptions.SocketMissingArgumentsError("Missing argument(s): {}".format(", ".join(invalid)))
+    return validate
+
+
+# Exception: (log description, event emitted to the client)
+ERRORS = {
+    exceptions.SocketMissingArgumentsError: ("missing arguments", "error_missing_arguments"),
+    exceptions.SocketInvalidArgumentsError: ("invalid arguments", "error_invalid_arguments"),
+    exceptions.SocketUnlinkableClientError: ("unlinkable client", "error_unlinkable_client"),
+    exceptions.SocketNotInGameError: ("not in game", "error_not_in_game"),
+    exceptions.SocketInGameError: ("in game", "error_in_game"),
+    exceptions.SocketIsNotHostError: ("is not host", "error_is_not_host"),
+}
+ERROR_TYPES = tuple(ERRORS)
+
+
+async def emit_error(sid, e):
+    """
+    Logs a client error and notifies the client
+    :param sid: client sid
+    :param e: exception, one of `ERRORS`
+    :return:
+    """
+    description, event = ERRORS[type(e)]
+    if str(e):
+        logger.error("%s raised %s: %s", sid, description, e)
+    else:
+        logger.error("%s raised %s", sid, description)
+    await Sio().emit(event, room=sid)
+
+
+def profile(event):
+    """
+    Decorator that times the handler of `event` with the `Profiler`.
+    Does nothing unless profiling is enabled (`PROFILE=1`).
+    Put it right after `sio.on` so the whole handler is timed.
+    :param event: event name
     :return:
     """
     def decorator(f):
+        if not Profiler().enabled:
+            return f
+
         async def wrapper(sid, data=None, *args, **kwargs):
-            missing = []
-            for arg in required_args:
-                if type(arg) is tuple:
-                    if len(arg) == 2:
-                        arg_name, arg_type, *checker_args = arg + (None,)
-                    else:
-                        arg_name, arg_type, *checker_args = arg
-                else:
-                    arg_name, arg_type, *checker_args = arg, None, None
-
-                checkers = {
-                    int: lambda x, *_: type(x) is int or (type(x) is str and x.isnumeric()),
-                    str: lambda x, accept_empty: type(x) is str and (len(x.strip()) > 0 or accept_empty),
-                    bool: lambda x, *_: type(x) in [str, int, bool] and str_is_bool(str(x)),
-                    list: lambda x, *_: type(x) is list,
-                    None: lambda x, *_: True
-                }
-
-                pre_processors = {
-                    int: lambda x: int(x),
-                    bool: lambda x: str_to_bool(x)
-                }
-
-                if arg_name not in data or not checkers[arg_type](data[arg_name], *checker_args):
-                    missing.append(arg_name)
-
-                if arg_type in pre_processors and arg_name in data:
-                    data[arg_name] = pre_processors[arg_type](data[arg_name])
-
-            if missing:
-                raise exceptions.SocketMissingArgumentsError("Missing argument(s): {}".format(missing))
-            return await f(sid, data, *args, **kwargs)
+            try:
+                client = ClientManager()[sid]
+                game_id = client.game.uuid if client.game is not None else client.remote_game_id
+            except KeyError:
+                game_id = None
+            with Profiler().call(event, sid, game_id):
+                return await f(sid, data, *args, **kwargs)
         return wrapper
     return decorator
 
 
-def errors(f):
-    async def wrapper(sid, data=None, *args, **kwargs):
-        try:
-            await f(sid, data, *args, **kwargs)
-        except exceptions.SocketMissingArgumentsError:
-            logging.error("{} raised missing arguments".format(sid))
-            await Sio().emit('error_missing_arguments', room=sid)
-        except exceptions.SocketInvalidArgumentsError:
-            logging.error("{} raised invalid arguments".format(sid))
-            await Sio().emit('error_invalid_arguments', room=sid)
-        except exceptions.SocketUnlinkableClientError:
-            logging.error("{} raised unlinkable client".format(sid))
-            await Sio().emit('error_unlinkable_client', room=sid)
-        except exceptions.SocketNotInGameError:
-            logging.error("{} raised not in game".format(sid))
-            await Sio().emit('error_not_in_game', room=sid)
-        except exceptions.SocketInGameError:
-            logging.error("{} raised in game".format(sid))
-            await Sio().emit('error_in_game', room=sid)
-        except exceptions.SocketIsNotHostError:
-            logging.error("{} raised is not host".format(sid))
-            await Sio().emit('error_is_not_host', room=sid)
-    return wrapper
-
-
-def link_client(f):
-    async def wrapper(sid, data=None, *args, **kwargs):
-        try:
-            client = ClientManager()[sid]
-        except ValueError:
-            raise exceptions.SocketUnlinkableClientError()
-        return await f(sid, data, client, *args, **kwargs)
-    return wrapper
-
-
-def client_in_game(f):
-    async def wrapper(sid, data=None, client=None, *args, **kwargs):
-        if client is None or not client.is_in_game:
-            raise exceptions.SocketNotInGameError()
-        return await f(sid, data, client, *args, **kwargs)
-    return wrapper
-
-
-def client_not_in_game(f):
-    async def wrapper(sid, data=None, client=None, *args, **kwargs):
-        if client is None or client.is_in_game:
-            raise exceptions.SocketInGameError()
-        return await f(sid, data, client, *args, **kwargs)
-    return wrapper
-
-
-def client_is_host(f):
-    async def wrapper(sid, data=None, client=None, *args, **kwargs):
-        if client is None or not client.is_host:
-            raise exceptions.SocketIsNotHostError()
-        return await f(sid, data, client, *args, **kwargs)
-    return wrapper
-
-
-def client_in_game_in_progress(f):
-    async def wrapper(sid, data=None, client=None, *args, **kwargs):
-        if client is None or not client.is_in_game or not client.game.playing:
-            raise exceptions.SocketNotInGameError()
-        return await f(sid, data, client, *args, **kwargs)
-    return wrapper
-
-
-def base(f):
-    return errors(f)
+# Client requirements for `handler`
+IN_GAME = "in_game"
+NOT_IN_GAME = "not_in_game"
+IN_PROGRESS = "in_progress"
+HOST = "host"
+
+# Requirement: (check, exception raised if the check fails)
+REQUIREMENTS = {
+    IN_GAME: (lambda client: client.is_in_game, exceptions.SocketNotInGameError),
+    NOT_IN_GAME: (lambda client: not client.is_in_game, exceptions.SocketInGameError),
+    IN_PROGRESS: (
+        lambda client: client.game is not None and client.game.playing, exceptions.SocketNotInGameError
+    ),
+    HOST: (lambda client: client.is_host, exceptions.SocketIsNotHostError),
+}
+
+
+# event: (events per second, burst) of the handlers registered with a `rate_limit`
+RATE_LIMITS = {}
+
+
+def rate_limited(client, event):
+    """
+    Checks the rate limit of `event` for `client`, counting dropped events
+    :param client: `Client` object
+    :param event: event name
+    :return: `True` if the event must be dropped
+    """
+    limit = RATE_LIMITS.get(event)
+    if limit is None or allow(client, event, limit[0], limit[1], time.monotonic()):
+        return False
+    Metrics().rate_limited.inc(event=event)
+    logger.debug("%s sent too many %s events, dropped", client.sid, event)
+    return True
+
+
+def handler(event, requires=(), args=(), rate_limit=None):
+    """
+    Decorator that registers `f(sid, data, client)` as the handler of `event`.
+    Client linking, requirements, argument validation (see `compile_args`), rate limiting and error handling
+    are composed into a single coroutine when the handler is registered:
+    ```
+    @server.handler("command", requires=(server.IN_PROGRESS,), args=(("name", str),))
+    async def command(sid, data, client):
+        ...
+    ```
+    :param event: event name
+    :param requires: requirements checked in order (`IN_GAME`, `NOT_IN_GAME`, `IN_PROGRESS`, `HOST`)
+    :param args: argument names or `(name, type)` tuples (`int`, `str`, `bool`, `list` or `None` for any type).
+                 `int` and `bool` arguments are converted. `str` arguments can't be empty
+                 unless a third item `True` is passed, e.g. `("name", str, True)`.
+    :param rate_limit: `(events per second, burst)` accepted from each client, events over the limit are dropped.
+                       `None` or a rate of 0 disables it.
+    :return:
+    """
+    checks = tuple(REQUIREMENTS[x] for x in requires)
+    validate = compile_args(args) if args else None
+    limited = rate_limit is not None and rate_limit[0] > 0
+    if limited:
+        RATE_LIMITS[event] = rate_limit
+
+    def decorator(f):
+        async def pipeline(sid, data=None):
+            try:
+                try:
+                    client = ClientManager()[sid]
+                except KeyError:
+                    raise exceptions.SocketUnlinkableClientError()
+                client.last_activity = Scheduler().time()
+                if limited and rate_limited(client, event):
+                    return
+                for check, exception in checks:
+                    if not check(client):
+                        raise exception()
+                if validate is not None:
+                    validate(data)
+                await f(sid, data, client)
+            except ERROR_TYPES as e:
+                await emit_error(sid, e)
+
+        Sio().on(event, profile(event)(pipeline))
+        return f
+    return decorator
@@ -0,0 +1,108 @@
+"""
+Snapshot of the games hosted by a worker, saved to `SNAPSHOT_FILE` on shutdown and restored on startup,
+so a restart doesn't end the matches in progress.
+
+Games are restored with their timers, but their players have no socket anymore: each of them
+is detached (see `singletons.sessions`) and can get its slot back by sending `resume`
+with the reconnect token it got in `welcome` within `RESUME_TIMEOUT` seconds.
+"""
+import logging
+import os
+import time
+
+from singletons.client_manager import ClientManager
+from singletons.config import Config
+from singletons.lobby_manager import LobbyManager
+from singletons.sessions import Sessions
+from utils import json_backend
+from utils.general import worker_path
+
+logger = logging.getLogger(__name__)
+
+VERSION = 2
+
+
+def snapshot_path():
+    """
+    :return: snapshot file of this worker, or `None` if snapshots are disabled
+    """
+    path = Config()["SNAPSHOT_FILE"]
+    if not path:
+        return None
+    return worker_path(path, Config()["WORKER_ID"], Config()["WORKERS"])
+
+
+def metadata():
+    """
+    :return: settings a snapshot depends on. Snapshots taken with different settings can't be restored.
+    """
+    return {
+        "version": VERSION,
+        "worker_id": Config()["WORKER_ID"],
+        "workers": Config()["WORKERS"],
+        "game_id_length": Config()["GAME_ID_LENGTH"],
+    }
+
+
+def take():
+    """
+    :return: JSON serializable snapshot of this worker
+    """
+    return {
+        "meta": metadata(),
+        "time": time.time(),
+        "last_uid": ClientManager().last_uid,
+        "lobby": LobbyManager().snapshot(),
+    }
+
+
+def save(path):
+    """
+    Writes the snapshot of this worker to `path`. The file is replaced atomically.
+    :param path: snapshot file
+    :return: number of saved games
+    """
+    data = take()
+    tmp = "{}.tmp".format(path)
+    with open(tmp, "w") as f:
+        f.write(json_backend.get_backend().dumps(data))
+    os.replace(tmp, path)
+    return len(data["lobby"]["games"])
+
+
+def load(path):
+    """
+    :param path: snapshot file
+    :return: snapshot dict, or `None` if there's none or it can't be restored
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        data = json_backend.get_backend().loads(f.read())
+    if data.get("meta") != metadata():
+        logger.warning("Ignoring snapshot %s, taken with different settings (%s)", path, data.get("meta"))
+        return None
+    return data
+
+
+async def restore(path, resume_timeout):
+    """
+    Restores the games saved in `path` and waits for their players to resume their sessions.
+    The file is removed, so the same games are not restored twice.
+    :param path: snapshot file
+    :param resume_timeout: seconds players have to resume their sessions
+    :return: list of restored `Game` objects
+    """
+    data = load(path)
+    if data is None:
+        return []
+    ClientManager().restore_uid(data["last_uid"])
+    games = await LobbyManager().restore(data["lobby"], resume_timeout)
+    for game in games:
+        for slot in game.slots:
+            Sessions().detach(slot.client, resume_timeout)
+    os.remove(path)
+    logger.info(
+        "Restored %s games from %s, saved %.1fs ago", len(games), path, time.time() - data["time"]
+    )
+    return games
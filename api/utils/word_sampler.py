@@ -0,0 +1,87 @@
+import random
+
+
+def unique_words(common, rare):
+    """
+    Removes duplicates from a common and a rare word list. Words in both lists are considered common.
+    :param common: list of common words
+    :param rare: list of rare words
+    :return: `(words, common_count)` tuple, with common words first
+    """
+    common = list(dict.fromkeys(common))
+    common_set = set(common)
+    rare = [x for x in dict.fromkeys(rare) if x not in common_set]
+    return common + rare, len(common)
+
+
+class WordSampler:
+    """
+    Weighted sampler over a list of common words and a list of rare words.
+    Each draw picks the common or the rare list according to `common_weight`
+    (or the only one left), then a word uniformly from it.
+    """
+    def __init__(self, words, common_count, common_weight=0.5):
+        """
+        :param words: sequence of unique words, common ones first
+        :param common_count: number of common words
+        :param common_weight: probability of drawing a common word
+        """
+        self.words = words
+        self.common_count = common_count
+        self.common_weight = common_weight
+
+    @classmethod
+    def from_lists(cls, common, rare, common_weight=0.5):
+        words, common_count = unique_words(common, rare)
+        return cls(tuple(words), common_count, common_weight)
+
+    def __len__(self):
+        return len(self.words)
+
+    def pool(self):
+        """
+        Returns a new `WordPool` that draws from this sampler without replacement
+        :return:
+        """
+        return WordPool(self)
+
+
+class WordPool:
+    """
+    Draws words from a `WordSampler` without replacement.
+    Words not drawn yet are the first `common_left` positions of the common words and the first `rare_left`
+    positions of the rare ones. A draw swaps a random position with the last one of its list and shrinks it.
+    Only swapped positions are stored, so a pool costs memory proportional to its draws, not to the vocabulary.
+    """
+    __slots__ = ("sampler", "common_left", "rare_left", "_swapped")
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.common_left = sampler.common_count
+        self.rare_left = len(sampler) - sampler.common_count
+        self._swapped = {}  # position: word index, for positions that don't hold their own index anymore
+
+    def __len__(self):
+        return self.common_left + self.rare_left
+
+    def draw(self, rng=random):
+        """
+        Draws a word
+        :param rng: random number generator
+        :return: word, or `None` if all words have been drawn
+        """
+        if not self.common_left and not self.rare_left:
+            return None
+        if self.common_left and (not self.rare_left or rng.random() < self.sampler.common_weight):
+            i = rng.randrange(self.common_left)
+            self.common_left -= 1
+            last = self.common_left
+        else:
+            offset = self.sampler.common_count
+            i = offset + rng.randrange(self.rare_left)
+            self.rare_left -= 1
+            last = offset + self.rare_left
+        index = self._swapped.pop(last, last)
+        if i != last:
+            index, self._swapped[i] = self._swapped.get(i, i), index
+        return self.sampler.words[index]
@@ -0,0 +1,186 @@
+"""
+Wordlists, in text and compiled format.
+
+Text wordlists are the source: `nouns.txt`, `rare_nouns.txt`, `adjectives.txt` and `rare_adjectives.txt`
+have one `word,role` entry per line, `verbs.txt` has one verb per line.
+
+The compiled file contains every word once in a string table, plus one section per (kind, role)
+with the (start, end) offsets of its words, common ones first. It's memory-mapped read-only,
+so worker processes share the same pages. Compile it with:
+    python -m utils.wordlist
+"""
+import argparse
+import logging
+import mmap
+import os
+import struct
+
+from utils.word_sampler import unique_words
+
+logger = logging.getLogger(__name__)
+
+ROLES = 4
+KINDS = ("nouns", "adjectives", "verbs")
+TEXT_FILES = ("nouns.txt", "rare_nouns.txt", "adjectives.txt", "rare_adjectives.txt", "verbs.txt")
+
+MAGIC = b"HCWL"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")       # magic, version, sections, spans, strings size
+SECTION = struct.Struct("<BBxxIII")     # kind, role (NO_ROLE for all roles), first span, spans, common words
+SPAN = struct.Struct("<II")             # string table start, end
+NO_ROLE = 255
+
+
+def read_role_file(path, kind):
+    """
+    Reads a `word,role` wordlist
+    :param path: file path
+    :param kind: wordlist name, used in warnings
+    :return: list of `(word, role)` tuples
+    """
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.lower().strip()
+            if not line:
+                continue
+            parts = line.split(",")
+            if len(parts) == 2 and parts[1].isdigit() and int(parts[1]) < ROLES:
+                entries.append((parts[0], int(parts[1])))
+            else:
+                logger.warning(
+                    "The word '%s' in the %s wordlist wasn't configured correctly! "
+                    "Ensure each entry has a comma followed by its role.", line, kind
+                )
+    return entries
+
+
+def read_text(directory):
+    """
+    Reads the text wordlists
+    :param directory: wordlists directory
+    :return: `{(kind, role): (common words, rare words)}`. Role `None` has the words of all roles.
+    """
+    wordlists = {}
+    for kind in ("nouns", "adjectives"):
+        common = read_role_file(os.path.join(directory, "{}.txt".format(kind)), kind.upper())
+        rare = read_role_file(os.path.join(directory, "rare_{}.txt".format(kind)), "RARE " + kind.upper())
+        for role in range(ROLES):
+            wordlists[(kind, role)] = ([w for w, r in common if r == role], [w for w, r in rare if r == role])
+        wordlists[(kind, None)] = ([w for w, _ in common], [w for w, _ in rare])
+    with open(os.path.join(directory, "verbs.txt"), "r") as f:
+        wordlists[("verbs", None)] = ([x.lower().strip() for x in f if x.strip()], [])
+    return wordlists
+
+
+def compile_wordlists(directory, path):
+    """
+    Compiles the text wordlists in `directory` to `path`
+    :param directory: text wordlists directory
+    :param path: compiled file path
+    :return:
+    """
+    strings = bytearray()
+    string_spans = {}
+    sections = []
+    spans = []
+    for (kind, role), (common, rare) in read_text(directory).items():
+        words, common_count = unique_words(common, rare)
+        sections.append(SECTION.pack(
+            KINDS.index(kind), NO_ROLE if role is None else role, len(spans), len(words), common_count
+        ))
+        for word in words:
+            if word not in string_spans:
+                encoded = word.encode("utf-8")
+                string_spans[word] = (len(strings), len(strings) + len(encoded))
+                strings += encoded
+            spans.append(SPAN.pack(*string_spans[word]))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(sections), len(spans), len(strings)))
+        f.write(b"".join(sections))
+        f.write(b"".join(spans))
+        f.write(strings)
+    os.replace(tmp_path, path)
+    logger.info("Compiled %s words (%s bytes of strings) to %s", len(spans), len(strings), path)
+
+
+def is_up_to_date(directory, path):
+    """
+    :return: `True` if `path` exists and is newer than all the text wordlists in `directory`
+    """
+    if not os.path.isfile(path):
+        return False
+    compiled = os.path.getmtime(path)
+    return all(
+        os.path.getmtime(os.path.join(directory, x)) <= compiled
+        for x in TEXT_FILES
+        if os.path.isfile(os.path.join(directory, x))
+    )
+
+
+class WordTable:
+    """
+    Read-only sequence of the words of a section of a compiled wordlist. Words are decoded when accessed.
+    """
+    def __init__(self, buffer, spans_offset, strings_offset, first, count):
+        self.buffer = buffer
+        self.spans_offset = spans_offset + first * SPAN.size
+        self.strings_offset = strings_offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError("word index out of range")
+        start, end = SPAN.unpack_from(self.buffer, self.spans_offset + i * SPAN.size)
+        return self.buffer[self.strings_offset + start:self.strings_offset + end].decode("utf-8")
+
+
+def open_compiled(path):
+    """
+    Memory-maps a compiled wordlist
+    :param path: compiled file path
+    :return: `(mmap, {(kind, role): (WordTable, common_count)})` tuple
+    :raises ValueError: if `path` is not a compiled wordlist of this version, or is truncated
+    """
+    with open(path, "rb") as f:
+        # Fails with `ValueError` on empty files
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buffer) < HEADER.size:
+        buffer.close()
+        raise ValueError("{} is not a compiled wordlist".format(path))
+    magic, version, section_count, span_count, strings_size = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION:
+        buffer.close()
+        raise ValueError("{} is not a compiled wordlist (version {})".format(path, VERSION))
+
+    spans_offset = HEADER.size + section_count * SECTION.size
+    strings_offset = spans_offset + span_count * SPAN.size
+    if len(buffer) != strings_offset + strings_size:
+        buffer.close()
+        raise ValueError("{} is truncated".format(path))
+    sections = {}
+    for i in range(section_count):
+        kind, role, first, count, common_count = SECTION.unpack_from(buffer, HEADER.size + i * SECTION.size)
+        sections[(KINDS[kind], None if role == NO_ROLE else role)] = (
+            WordTable(buffer, spans_offset, strings_offset, first, count),
+            common_count
+        )
+    return buffer, sections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiles the text wordlists")
+    parser.add_argument("--words-dir", default="words", help="text wordlists directory")
+    parser.add_argument("--output", default=os.path.join("words", "words.bin"), help="compiled file path")
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    compile_wordlists(options.words_dir, options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -43,7 +43,8 @@ new Vue({
   mounted () {
     // Connect when the app is mounted on the DOM
     Vue.prototype.$io = io(Config.serverURL, {
-      transports: ['websocket', 'xhr-polling', 'polling', 'htmlfile', 'flashsocket'],
+      // Websocket only, the multi-worker server doesn't route polling requests to the worker that has the session
+      transports: ['websocket'],
       reconnection: true,
       reconnectionDelay: 1000,
       reconnectionDelayMax: 5000,
@@ -56,6 +57,40 @@ new Vue({
     this.$io.on('welcome', (data) => {
       console.log('Greeted by server with uid ' + data.uid)
       this.$store.commit('connected', data.uid)
+
+      // Take back our slot if we were in a game the server still holds (eg: after a server restart)
+      let token = sessionStorage.getItem('token')
+      sessionStorage.setItem('token', data.token)
+      if (token !== null) {
+        this.$io.emit('resume', {
+          token: token
+        })
+      }
+    })
+
+    this.$io.on('resync', (data) => {
+      console.log('Resumed session in game ' + data.game.game_id)
+      sessionStorage.setItem('token', data.token)
+      this.$store.commit('connected', data.uid)
+      this.$store.commit('inGame', true)
+      this.$router.push(data.playing ? '/game' : '/lobby/' + data.game.game_id)
+      this.$nextTick(() => {
+        // Replay the current state for the scene we've just moved to
+        this.$bus.$emit('#game_info', data.game)
+        this.$bus.$emit('#health_info', data.health)
+        if (data.grid !== null) {
+          this.$bus.$emit('#grid', data.grid)
+        }
+        if (data.command !== null) {
+          this.$bus.$emit('#command', data.command)
+        }
+        if (data.over) {
+          this.$bus.$emit('#game_over')
+        } else if (data.playing && !data.intro_done) {
+          // We've lost the intro, skip it
+          this.$io.emit('intro_done')
+        }
+      })
     })
 
     this.$io.on('connect', () => {